@@ -0,0 +1,371 @@
+"""
+Osmotrofia - Benchmarks
+Micro-benchmarks offline de los caminos calientes, con resultados en JSON comparables entre corridas
+
+Uso:
+    python benchmarks.py                              # corre todo e imprime la tabla
+    python benchmarks.py --salida base.json           # guarda los resultados
+    python benchmarks.py --comparar base.json         # marca regresiones (código de salida 1)
+    python benchmarks.py --filtro prompt --procesos 10000
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+
+VERSION_RESULTADOS = 1
+
+# Nombres que aparecen en la tabla de procesos simulada (algunos caen en PATRONES_PROCESOS)
+NOMBRES_PROCESOS = (
+    'systemd', 'bash', 'python3', 'chrome', 'firefox', 'code', 'spotify', 'discord',
+    'steam', 'onedrive', 'dropbox', 'defender', 'avast', 'postgres', 'nginx', 'sshd',
+    'kworker/0:1', 'node', 'java', 'docker'
+)
+
+
+class _ErrorPsutil(Exception):
+    pass
+
+
+class _ProcesoSimulado:
+    __slots__ = ('pid', '_creado', '_nombre', '_memoria')
+    
+    def __init__(self, pid, creado, nombre, memoria):
+        self.pid = pid
+        self._creado = creado
+        self._nombre = nombre
+        self._memoria = memoria
+    
+    def oneshot(self):
+        return contextlib.nullcontext()
+    
+    def create_time(self):
+        return self._creado
+    
+    def name(self):
+        return self._nombre
+    
+    def memory_percent(self):
+        return self._memoria
+
+
+class PsutilSimulado:
+    """
+    Sustituto determinista de psutil con miles de procesos.
+    
+    Implementa solo lo que usan monitor_sistema y tabla_procesos. En cada
+    process_iter() se reemplaza una fracción `rotacion` de los procesos, para
+    medir también el alta y baja de entradas en TablaProcesos.
+    """
+    
+    NoSuchProcess = type('NoSuchProcess', (_ErrorPsutil,), {})
+    ZombieProcess = type('ZombieProcess', (NoSuchProcess,), {})
+    AccessDenied = type('AccessDenied', (_ErrorPsutil,), {})
+    
+    _TiemposCPU = namedtuple('scputimes', 'user nice system idle iowait guest guest_nice')
+    _Memoria = namedtuple('svmem', 'total available percent')
+    _Disco = namedtuple('sdiskusage', 'total used free percent')
+    _Frecuencia = namedtuple('scpufreq', 'current min max')
+    _Temperatura = namedtuple('shwtemp', 'label current high critical')
+    _Bateria = namedtuple('sbattery', 'percent secsleft power_plugged')
+    
+    def __init__(self, procesos=5000, rotacion=0.01, semilla=0):
+        self._azar = random.Random(semilla)
+        self._siguiente_pid = 1
+        self._rotacion = rotacion
+        self._tics = 0.0
+        self._procesos = [self._nuevo_proceso() for _ in range(procesos)]
+    
+    def _nuevo_proceso(self):
+        pid = self._siguiente_pid
+        self._siguiente_pid += 1
+        nombre = self._azar.choice(NOMBRES_PROCESOS)
+        return _ProcesoSimulado(pid, 1_700_000_000.0 + pid, nombre, self._azar.expovariate(1.5))
+    
+    def process_iter(self):
+        for _ in range(int(len(self._procesos) * self._rotacion)):
+            self._procesos[self._azar.randrange(len(self._procesos))] = self._nuevo_proceso()
+        return iter(self._procesos)
+    
+    def cpu_times(self):
+        self._tics += 1.0
+        return self._TiemposCPU(self._tics * 0.3, 0.0, self._tics * 0.1, self._tics * 0.6, 0.0, 0.0, 0.0)
+    
+    def cpu_count(self):
+        return 8
+    
+    def cpu_freq(self):
+        return self._Frecuencia(2400.0, 800.0, 4200.0)
+    
+    def virtual_memory(self):
+        return self._Memoria(16 * 1024**3, 9 * 1024**3, 43.7)
+    
+    def disk_usage(self, ruta):
+        return self._Disco(512 * 1024**3, 300 * 1024**3, 212 * 1024**3, 58.6)
+    
+    def sensors_temperatures(self):
+        return {'coretemp': [self._Temperatura('Package id 0', 61.0, 84.0, 100.0)]}
+    
+    def sensors_battery(self):
+        return self._Bateria(77.0, 3600, False)
+
+
+@contextlib.contextmanager
+def psutil_simulado(simulado):
+    """Reemplaza psutil en monitor_sistema y tabla_procesos mientras dure el bloque"""
+    import monitor_sistema
+    import tabla_procesos
+    
+    originales = (monitor_sistema.psutil, tabla_procesos.psutil)
+    monitor_sistema.psutil = tabla_procesos.psutil = simulado
+    try:
+        yield simulado
+    finally:
+        monitor_sistema.psutil, tabla_procesos.psutil = originales
+
+
+def medir(funcion, repeticiones=7, tiempo_minimo=0.2):
+    """
+    Mide una función sin argumentos
+    
+    Calibra cuántas llamadas entran en `tiempo_minimo` y repite esa tanda
+    `repeticiones` veces. Devuelve tiempos por llamada en microsegundos.
+    """
+    funcion()  # calentamiento (caches, imports perezosos)
+    llamadas = 1
+    while True:
+        inicio = time.perf_counter()
+        for _ in range(llamadas):
+            funcion()
+        duracion = time.perf_counter() - inicio
+        if duracion >= tiempo_minimo or llamadas >= 1_000_000:
+            break
+        llamadas = max(llamadas * 2, int(llamadas * tiempo_minimo / max(duracion, 1e-9)))
+    
+    tandas = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(llamadas):
+            funcion()
+        tandas.append((time.perf_counter() - inicio) / llamadas * 1e6)
+    
+    tandas.sort()
+    return {
+        'mediana_us': statistics.median(tandas),
+        'min_us': tandas[0],
+        'max_us': tandas[-1],
+        'llamadas_por_tanda': llamadas,
+        'tandas': repeticiones
+    }
+
+
+def _snapshots(cantidad, semilla=1):
+    """Snapshots sintéticos variados, con el formato de MonitorSistema"""
+    from monitor_sistema import SECCIONES_POR_DEFECTO
+    
+    azar = random.Random(semilla)
+    snapshots = []
+    for _ in range(cantidad):
+        parametros = copy.deepcopy(SECCIONES_POR_DEFECTO)
+        parametros['timestamp'] = datetime.now().isoformat()
+        parametros['hardware']['temperatura']['cpu'] = round(azar.uniform(35, 95), 1)
+        parametros['hardware']['bateria']['porcentaje'] = round(azar.uniform(5, 100), 1)
+        parametros['rendimiento']['cpu']['uso_porcentaje'] = round(azar.uniform(0, 100), 1)
+        parametros['rendimiento']['ram']['uso_porcentaje'] = round(azar.uniform(10, 95), 1)
+        parametros['rendimiento']['almacenamiento']['uso_porcentaje'] = round(azar.uniform(20, 95), 1)
+        snapshots.append(parametros)
+    return snapshots
+
+
+def _ciclo(elementos):
+    """Función que devuelve el siguiente elemento de la lista en cada llamada"""
+    estado = {'i': 0}
+    
+    def siguiente():
+        i = estado['i']
+        estado['i'] = (i + 1) % len(elementos)
+        return elementos[i]
+    return siguiente
+
+
+def benchmarks_monitor(procesos):
+    from monitor_sistema import MonitorSistema
+    
+    simulado = PsutilSimulado(procesos=procesos)
+    with psutil_simulado(simulado):
+        # ventana_cpu=0: mide el costo de recolectar, no la espera de la ventana de CPU
+        monitor = MonitorSistema(ventana_cpu=0)
+        yield f'monitor.obtener_parametros_completos[{procesos} procesos]', monitor.obtener_parametros_completos
+        
+        parametros = monitor.obtener_parametros_completos()
+        yield 'monitor.calcular_salud_general', lambda: monitor.calcular_salud_general(parametros)
+
+
+def benchmarks_prompt():
+    from generador_prompt import GeneradorPrompt
+    from monitor_sistema import MonitorSistema
+    
+    monitor = MonitorSistema(ventana_cpu=0)
+    snapshots = [(p, monitor.calcular_salud_general(p)) for p in _snapshots(512)]
+    
+    generador = GeneradorPrompt()
+    parametros, salud = snapshots[0]
+    yield 'prompt.generar_prompt_completo[repetido]', lambda: generador.generar_prompt_completo(parametros, salud)
+    
+    siguiente = _ciclo(snapshots)
+    generador_variado = GeneradorPrompt()
+    yield 'prompt.generar_prompt_completo[variado]', lambda: generador_variado.generar_prompt_completo(*siguiente())
+    
+    sin_cache = GeneradorPrompt(tamano_cache=0)
+    yield 'prompt.generar_prompt_completo[sin_cache]', lambda: sin_cache.generar_prompt_completo(*siguiente())
+
+
+def benchmarks_persistencia(carpeta):
+    from generador_prompt import GeneradorPrompt
+    from registro_muestras import RegistroMuestras
+    from historial_generaciones import HistorialGeneraciones
+    
+    parametros = _snapshots(1)[0]
+    salud = 80.0
+    prompt = GeneradorPrompt().generar_prompt_completo(parametros, salud)
+    descripcion = prompt[:1500]
+    
+    # Las funciones reales de la aplicación; los archivos llevan el timestamp al segundo,
+    # así que las repeticiones sobrescriben unos pocos archivos
+    from osmotrofia import guardar_datos_json
+    yield 'persistencia.datos_json', lambda: guardar_datos_json(carpeta, parametros, salud, prompt)
+    
+    # Cliente de Gemini sin red: el modelo nunca se llama. Incluye el alta en un
+    # historial en memoria, como en cada descripción real
+    from gemini_client import GeminiClient
+    cliente = GeminiClient(api_key='benchmark', historial=HistorialGeneraciones())
+    cliente.model = None
+    
+    def registrar_descripcion():
+        with contextlib.redirect_stdout(sumidero):
+            cliente._registrar_descripcion(prompt, descripcion, carpeta)
+    
+    with open(os.devnull, 'w') as sumidero:
+        yield 'persistencia.archivo_prompt', registrar_descripcion
+    cliente.historial.cerrar()
+    
+    registro = RegistroMuestras(os.path.join(carpeta, 'muestras.bin'))
+    try:
+        yield 'persistencia.registro_muestras', lambda: registro.agregar_snapshot(parametros, salud)
+    finally:
+        registro.cerrar()
+    
+    historial = HistorialGeneraciones(os.path.join(carpeta, 'historial.db'))
+    resultado = {'exito': True, 'timestamp': '20250101_000000', 'archivo_prompt': 'prompt.txt',
+                 'descripcion_mejorada': descripcion}
+    try:
+        yield 'persistencia.historial', lambda: historial.agregar(resultado, 'gemini')
+    finally:
+        historial.cerrar()
+
+
+def ejecutar(filtro=None, procesos=5000, repeticiones=7, tiempo_minimo=0.2):
+    """
+    Corre los benchmarks cuyo nombre contiene `filtro`
+    
+    Returns:
+        dict serializable con metadatos y resultados por benchmark
+    """
+    carpeta = tempfile.mkdtemp(prefix='osmotrofia-bench-')
+    resultados = {}
+    try:
+        grupos = (benchmarks_monitor(procesos), benchmarks_prompt(), benchmarks_persistencia(carpeta))
+        for grupo in grupos:
+            for nombre, funcion in grupo:
+                if filtro and filtro not in nombre:
+                    continue
+                resultados[nombre] = medir(funcion, repeticiones, tiempo_minimo)
+                print(f"  {nombre:<60} {resultados[nombre]['mediana_us']:>12.2f} µs", file=sys.stderr)
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+    
+    return {
+        'version': VERSION_RESULTADOS,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementacion': platform.python_implementation(),
+        'plataforma': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+        'parametros': {'procesos': procesos, 'repeticiones': repeticiones, 'tiempo_minimo': tiempo_minimo},
+        'resultados': resultados
+    }
+
+
+def comparar(anterior, actual, tolerancia=0.10):
+    """
+    Compara dos corridas por mediana
+    
+    Returns:
+        lista de (nombre, mediana_anterior, mediana_actual, cambio_relativo, es_regresion)
+        para los benchmarks presentes en ambas corridas
+    """
+    filas = []
+    for nombre, resultado in actual['resultados'].items():
+        base = anterior.get('resultados', {}).get(nombre)
+        if base is None:
+            continue
+        cambio = resultado['mediana_us'] / base['mediana_us'] - 1 if base['mediana_us'] else 0.0
+        filas.append((nombre, base['mediana_us'], resultado['mediana_us'], cambio, cambio > tolerancia))
+    return filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks offline de Osmotrofia')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='Resultados JSON anteriores contra los que comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help='Aumento relativo de la mediana considerado regresión (default: 0.10)')
+    parser.add_argument('--filtro', help='Correr solo los benchmarks cuyo nombre contiene este texto')
+    parser.add_argument('--procesos', type=int, default=5000, help='Procesos simulados (default: 5000)')
+    parser.add_argument('--repeticiones', type=int, default=7)
+    parser.add_argument('--tiempo-minimo', type=float, default=0.2, help='Segundos mínimos por tanda')
+    args = parser.parse_args(argv)
+    
+    print("=== BENCHMARKS DE OSMOTROFIA ===", file=sys.stderr)
+    corrida = ejecutar(args.filtro, args.procesos, args.repeticiones, args.tiempo_minimo)
+    
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(corrida, f, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en: {args.salida}", file=sys.stderr)
+    else:
+        print(json.dumps(corrida, indent=2, ensure_ascii=False))
+    
+    if not args.comparar:
+        return 0
+    
+    with open(args.comparar, encoding='utf-8') as f:
+        anterior = json.load(f)
+    filas = comparar(anterior, corrida, args.tolerancia)
+    print(f"\n📊 Comparación con {args.comparar} ({anterior.get('fecha', '?')}):", file=sys.stderr)
+    for nombre, antes, ahora, cambio, regresion in filas:
+        marca = '🔴' if regresion else ('🟢' if cambio < -args.tolerancia else '⚪')
+        print(f"  {marca} {nombre:<60} {antes:>10.2f} → {ahora:>10.2f} µs ({cambio:+.1%})", file=sys.stderr)
+    
+    regresiones = [fila[0] for fila in filas if fila[4]]
+    if regresiones:
+        print(f"\n❌ {len(regresiones)} regresiones por encima de {args.tolerancia:.0%}", file=sys.stderr)
+        return 1
+    print("\n✅ Sin regresiones", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Osmotrofia - Cache de Respuestas
+Cache en disco direccionado por contenido para las respuestas de los proveedores
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+def ruta_salida(carpeta_salida, prefijo, extension):
+    """
+    Timestamp y ruta única de un archivo de salida (prompt_*.txt, hongos_*.png)
+    
+    Con trabajadores en paralelo, clientes async o la cobertura del enrutador varias
+    generaciones terminan en el mismo segundo: los microsegundos y un sufijo
+    aleatorio evitan que una pise el archivo de otra.
+    
+    Returns:
+        (timestamp 'AAAAMMDD_HHMMSS', ruta)
+    """
+    ahora = datetime.now()
+    timestamp = ahora.strftime("%Y%m%d_%H%M%S")
+    nombre = f'{prefijo}_{timestamp}_{ahora.microsecond:06d}_{uuid.uuid4().hex[:6]}.{extension}'
+    return timestamp, os.path.join(carpeta_salida, nombre)
+
+
+def escribir_atomico(ruta, escribir):
+    """
+    Escribe en un temporal de la misma carpeta y lo renombra: nunca queda un archivo a medias
+    
+    Args:
+        ruta: Archivo destino
+        escribir: Función que recibe el archivo temporal abierto en modo binario
+    """
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            escribir(f)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+
+class CacheRespuestas:
+    """
+    Guarda respuestas de los proveedores indexadas por un hash de
+    (proveedor, modelo, prompt, parámetros).
+    
+    Cada entrada es un JSON con los datos de la respuesta y, opcionalmente, la
+    imagen generada. Se desalojan las entradas más viejas que max_edad y, si el
+    cache supera max_bytes, las usadas hace más tiempo.
+    """
+    
+    def __init__(self, carpeta='osmotrofia_cache', max_bytes=200 * 1024**2, max_edad=7 * 24 * 3600):
+        """
+        Args:
+            carpeta: Carpeta donde viven las entradas
+            max_bytes: Tamaño máximo del cache en disco
+            max_edad: Antigüedad máxima (s) de una entrada; None para no expirar
+        """
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.max_edad = max_edad
+        self._lock = threading.Lock()
+        os.makedirs(carpeta, exist_ok=True)
+        self._bytes = sum(os.path.getsize(ruta) for ruta in self._archivos())
+    
+    @staticmethod
+    def clave(proveedor, modelo, prompt, parametros=None):
+        """Hash SHA-256 que identifica una petición"""
+        contenido = json.dumps([proveedor, modelo, prompt, parametros or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+    
+    def _ruta(self, clave, extension):
+        return os.path.join(self.carpeta, clave[:2], f'{clave}.{extension}')
+    
+    def _archivos(self):
+        for raiz, _, archivos in os.walk(self.carpeta):
+            for archivo in archivos:
+                if not archivo.startswith('.'):
+                    yield os.path.join(raiz, archivo)
+    
+    def obtener(self, clave):
+        """
+        Busca una entrada
+        
+        Returns:
+            dict con los datos guardados (más 'imagen_cache' si hay imagen), o None
+        """
+        ruta = self._ruta(clave, 'json')
+        try:
+            edad = time.time() - os.path.getmtime(ruta)
+            if self.max_edad is not None and edad > self.max_edad:
+                self._eliminar(clave)
+                return None
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        ruta_imagen = self._ruta(clave, 'png')
+        if datos.get('tiene_imagen'):
+            if not os.path.exists(ruta_imagen):
+                return None
+            datos['imagen_cache'] = ruta_imagen
+        
+        # Marcar como usada recientemente (solo el atime: el mtime mide la antigüedad)
+        try:
+            os.utime(ruta, (time.time(), os.path.getmtime(ruta)))
+        except OSError:
+            pass
+        return datos
+    
+    def guardar(self, clave, datos, imagen=None):
+        """
+        Guarda una entrada
+        
+        Args:
+            clave: Resultado de clave()
+            datos: dict serializable con la respuesta
+            imagen: Ruta opcional a una imagen que se copia al cache
+        """
+        os.makedirs(os.path.dirname(self._ruta(clave, 'json')), exist_ok=True)
+        nuevos = 0
+        
+        if imagen is not None:
+            nuevos += self._escribir_atomico(self._ruta(clave, 'png'), lambda f: _copiar(imagen, f))
+        datos = dict(datos, tiene_imagen=imagen is not None, guardado=time.time())
+        contenido = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+        nuevos += self._escribir_atomico(self._ruta(clave, 'json'), lambda f: f.write(contenido))
+        
+        with self._lock:
+            self._bytes += nuevos
+            excedido = self._bytes > self.max_bytes
+        if excedido:
+            self.desalojar()
+    
+    def _escribir_atomico(self, ruta, escribir):
+        """Escribe en un temporal y lo renombra; devuelve el cambio de tamaño en bytes"""
+        anterior = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        escribir_atomico(ruta, escribir)
+        return os.path.getsize(ruta) - anterior
+    
+    def _eliminar(self, clave):
+        for extension in ('json', 'png'):
+            ruta = self._ruta(clave, extension)
+            try:
+                tamano = os.path.getsize(ruta)
+                os.unlink(ruta)
+            except OSError:
+                continue
+            with self._lock:
+                self._bytes -= tamano
+    
+    def desalojar(self):
+        """Elimina entradas vencidas y, si hace falta, las menos usadas hasta quedar bajo max_bytes"""
+        ahora = time.time()
+        entradas = []
+        for ruta in self._archivos():
+            if not ruta.endswith('.json'):
+                continue
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            clave = os.path.basename(ruta)[:-len('.json')]
+            if self.max_edad is not None and ahora - estado.st_mtime > self.max_edad:
+                self._eliminar(clave)
+            else:
+                entradas.append((max(estado.st_atime, estado.st_mtime), clave))
+        
+        entradas.sort()
+        for _, clave in entradas:
+            with self._lock:
+                if self._bytes <= self.max_bytes:
+                    break
+            self._eliminar(clave)
+    
+    def limpiar(self):
+        """Vacía el cache"""
+        shutil.rmtree(self.carpeta, ignore_errors=True)
+        os.makedirs(self.carpeta, exist_ok=True)
+        with self._lock:
+            self._bytes = 0
+
+
+def _copiar(origen, destino):
+    with open(origen, 'rb') as f:
+        shutil.copyfileobj(f, destino)
@@ -0,0 +1,228 @@
+"""
+Osmotrofia - Clientes Asíncronos
+Variantes asyncio de los clientes de generación, con concurrencia acotada y cancelación
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+
+from cache_respuestas import ruta_salida
+from metricas import span
+
+
+class _ClienteAsync(ABC):
+    """
+    Base común: envuelve un cliente síncrono y limita las generaciones simultáneas.
+    
+    Devuelve los mismos dicts de resultado que el cliente envuelto y comparte su
+    historial y su cache. Cancelar la tarea interrumpe la espera de la API y se
+    propaga como asyncio.CancelledError (no se registra como fallo).
+    """
+    
+    def __init__(self, cliente, max_concurrencia=2):
+        """
+        Args:
+            cliente: Cliente síncrono a envolver
+            max_concurrencia: Cantidad máxima de generaciones en vuelo a la vez
+        """
+        if max_concurrencia <= 0:
+            raise ValueError("max_concurrencia debe ser positivo")
+        self.cliente = cliente
+        self.historial = cliente.historial
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+    
+    @property
+    def reintentos(self):
+        """Política de reintentos (e interruptor de circuito) del cliente envuelto"""
+        return self.cliente.reintentos
+    
+    @property
+    def max_caracteres_prompt(self):
+        """Límite de caracteres del prompt del cliente envuelto, o None"""
+        return self.cliente.max_caracteres_prompt
+    
+    @property
+    def limitador(self):
+        """LimitadorTasa del cliente envuelto, o None"""
+        return self.cliente.limitador
+    
+    def _preparar(self, prompt):
+        """Ajustes al prompt antes de buscarlo en cache y enviarlo"""
+        return prompt
+    
+    @abstractmethod
+    async def _generar(self, prompt, carpeta_salida):
+        """Llamada al proveedor, ya dentro del semáforo y con el cupo adquirido"""
+    
+    async def generar_imagen(self, prompt, carpeta_salida='output'):
+        """Igual que generar_imagen del cliente síncrono, sin bloquear el event loop"""
+        return await self._con_limites(prompt, carpeta_salida, self._generar)
+    
+    async def _con_limites(self, prompt, carpeta_salida, generar, al_recibir=None):
+        """Semáforo, cache, cancelación y errores comunes a todas las variantes de generación"""
+        async with self._semaforo:
+            try:
+                prompt = self._preparar(prompt)
+                resultado = await asyncio.to_thread(self.cliente._desde_cache, prompt, carpeta_salida)
+                if resultado is not None:
+                    if al_recibir is not None:
+                        al_recibir(resultado['descripcion_mejorada'])
+                    return resultado
+                
+                print("🍄 Generando colonia de hongos...")
+                print(f"📝 Prompt enviado ({len(prompt)} caracteres)")
+                os.makedirs(carpeta_salida, exist_ok=True)
+                
+                if self.limitador is not None:
+                    await self.limitador.adquirir_async(self.cliente._tokens_estimados(prompt))
+                return await generar(prompt, carpeta_salida)
+            
+            except asyncio.CancelledError:
+                print("🛑 Generación cancelada")
+                raise
+            except Exception as e:
+                return self.cliente._resultado_error(e)
+    
+    async def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output'):
+        """Genera con la política de reintentos del cliente; las esperas no bloquean el event loop"""
+        return await self.reintentos.ejecutar_async(
+            lambda: self.generar_imagen(prompt, carpeta_salida), max_intentos
+        )
+    
+    def obtener_historial(self, limite=20, antes_de=None):
+        return self.cliente.obtener_historial(limite, antes_de)
+
+
+class GeminiClientAsync(_ClienteAsync):
+    """
+    GeminiClient asíncrono: usa generate_content_async del SDK.
+    
+    Con el transporte REST (el de GEMINI_BASE_URL, p. ej. servidor_simulado.py)
+    el SDK no tiene variante asíncrona: la llamada y cada fragmento del
+    streaming se leen en un hilo.
+    """
+    
+    def __init__(self, cliente=None, max_concurrencia=2, **kwargs):
+        """
+        Args:
+            cliente: GeminiClient existente; si es None se crea uno con kwargs
+                     (api_key, historial, cache)
+            max_concurrencia: Cantidad máxima de generaciones en vuelo a la vez
+        """
+        if cliente is None:
+            from gemini_client import GeminiClient
+            cliente = GeminiClient(**kwargs)
+        super().__init__(cliente, max_concurrencia)
+    
+    async def _solicitar(self, prompt, stream=False):
+        instruccion = self.cliente._instruccion(prompt)
+        if self.cliente.transport == 'rest':
+            return await asyncio.to_thread(self.cliente.model.generate_content, instruccion, stream=stream)
+        return await self.cliente.model.generate_content_async(instruccion, stream=stream)
+    
+    async def _fragmentos(self, response):
+        """Fragmentos de un stream, asíncrono o (con REST) síncrono"""
+        if hasattr(response, '__aiter__'):
+            async for fragmento in response:
+                yield fragmento
+            return
+        fin = object()
+        iterador = iter(response)
+        while (fragmento := await asyncio.to_thread(next, iterador, fin)) is not fin:
+            yield fragmento
+    
+    async def _generar(self, prompt, carpeta_salida):
+        with span('proveedor.llamada', proveedor='gemini'):
+            response = await self._solicitar(prompt)
+        return await asyncio.to_thread(
+            self.cliente._registrar_descripcion, prompt, response.text, carpeta_salida
+        )
+    
+    async def generar_imagen_streaming(self, prompt, carpeta_salida='output', al_recibir=None):
+        """
+        Como GeminiClient.generar_imagen_streaming: cada fragmento se agrega al
+        archivo y se pasa a `al_recibir` apenas llega. Cancelar la tarea corta
+        el stream y borra el archivo parcial.
+        """
+        from gemini_client import EscritorDescripcion, texto_fragmento
+        
+        async def generar(prompt, carpeta_salida):
+            with span('proveedor.llamada', proveedor='gemini', modo='streaming'):
+                response = await self._solicitar(prompt, stream=True)
+                with EscritorDescripcion(prompt, carpeta_salida, al_recibir) as escritor:
+                    async for fragmento in self._fragmentos(response):
+                        escritor.agregar(texto_fragmento(fragmento))
+            if al_recibir is not None:
+                print()  # Cierra la línea si los fragmentos se mostraron en consola
+            return await asyncio.to_thread(
+                self.cliente._resultado_descripcion, prompt, response.text,
+                escritor.timestamp, escritor.archivo_prompt
+            )
+        
+        return await self._con_limites(prompt, carpeta_salida, generar, al_recibir)
+    
+    async def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output', al_recibir=None):
+        """Con `al_recibir` usa generar_imagen_streaming (ver GeminiClient.generar_con_reintentos)"""
+        if al_recibir is None:
+            return await super().generar_con_reintentos(prompt, max_intentos, carpeta_salida)
+        return await self.reintentos.ejecutar_async(
+            lambda: self.generar_imagen_streaming(prompt, carpeta_salida, al_recibir), max_intentos
+        )
+
+
+class OpenAIClientAsync(_ClienteAsync):
+    """
+    OpenAIClient asíncrono.
+    
+    La petición y la descarga corren en hilos (el cliente usa requests); al ser
+    dos etapas, cancelar después de la petición evita descargar la imagen.
+    Los hilos comparten la sesión keep-alive del cliente.
+    """
+    
+    def __init__(self, cliente=None, max_concurrencia=2, **kwargs):
+        """
+        Args:
+            cliente: OpenAIClient existente; si es None se crea uno con kwargs
+                     (api_key, historial, cache)
+            max_concurrencia: Cantidad máxima de generaciones en vuelo a la vez
+        """
+        if cliente is None:
+            from openai_client import OpenAIClient
+            cliente = OpenAIClient(**kwargs)
+        super().__init__(cliente, max_concurrencia)
+    
+    def _preparar(self, prompt):
+        return self.cliente._ajustar_prompt(prompt)
+    
+    async def _generar(self, prompt, carpeta_salida):
+        image_url, revised_prompt, imagen_b64 = await asyncio.to_thread(self.cliente._solicitar, prompt)
+        
+        timestamp, archivo_imagen = ruta_salida(carpeta_salida, 'hongos', 'png')
+        await asyncio.to_thread(self.cliente._guardar_imagen, image_url, imagen_b64, archivo_imagen)
+        
+        return await asyncio.to_thread(
+            self.cliente._registrar_imagen, prompt, revised_prompt, image_url,
+            timestamp, archivo_imagen, carpeta_salida
+        )
+
+
+# Función de prueba
+if __name__ == "__main__":
+    print("=== PRUEBA DE CLIENTES ASÍNCRONOS ===")
+    print("\nNOTA: Necesitas definir GEMINI_API_KEY en tu entorno")
+    
+    async def prueba():
+        cliente = GeminiClientAsync(max_concurrencia=2)
+        prompts = [
+            "Hongos marrones saludables creciendo en madera. Vista macro.",
+            "Micelio blanco denso sobre sustrato húmedo. Iluminación suave."
+        ]
+        resultados = await asyncio.gather(*(cliente.generar_imagen(p) for p in prompts))
+        for resultado in resultados:
+            print(f"{'✅' if resultado['exito'] else '❌'} {resultado.get('archivo_prompt', resultado.get('error'))}")
+    
+    try:
+        asyncio.run(prueba())
+    except ValueError as e:
+        print(f"\n⚠️  {e}")
@@ -0,0 +1,582 @@
+"""
+Osmotrofia - Cola de Trabajos
+Cola persistente de generaciones en SQLite y pool de procesos trabajadores que la consumen
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+import psutil
+
+from errores import ErrorConfiguracion
+
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    creado REAL NOT NULL,
+    estado TEXT NOT NULL,
+    proveedor TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    carpeta_salida TEXT NOT NULL,
+    datos TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    disponible_desde REAL NOT NULL,
+    arriendo_hasta REAL,
+    trabajador TEXT,
+    error TEXT,
+    resultado TEXT,
+    terminado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, disponible_desde, id);
+"""
+
+ESTADOS = ('pendiente', 'en_curso', 'hecho', 'fallido')
+
+# Backoff entre intentos de un trabajo que falló por un problema pasajero del proveedor:
+# 5 s, 10 s, 20 s... hasta 15 min. Con 20 intentos un trabajo aguanta ~4 h de caída
+ESPERA_BASE = 5.0
+ESPERA_MAXIMA = 900.0
+
+# Variables de entorno de las que los trabajadores leen las API keys de cada proveedor
+VARIABLES_API_KEY = {
+    'gemini': ('GEMINI_API_KEY',),
+    'openai': ('OPENAI_API_KEY',),
+    'auto': ('GEMINI_API_KEY', 'OPENAI_API_KEY')
+}
+
+
+def identificador_trabajador():
+    """'host:pid' del proceso actual; permite detectar arriendos de procesos muertos"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def verificar_proveedor(proveedor):
+    """Lanza ErrorConfiguracion si un trabajador no podría generar con `proveedor`"""
+    if proveedor not in VARIABLES_API_KEY:
+        raise ErrorConfiguracion(f"Proveedor desconocido: {proveedor} (opciones: {', '.join(VARIABLES_API_KEY)})")
+    variables = VARIABLES_API_KEY[proveedor]
+    if not any(os.getenv(variable) for variable in variables):
+        raise ErrorConfiguracion(f"Los trabajadores necesitan {' u '.join(variables)} para generar con {proveedor}")
+
+
+def _proceso_vivo(pid):
+    # Un zombi (proceso muerto que nadie recogió) no va a terminar su trabajo
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.AccessDenied:
+        return True
+
+
+class ColaTrabajos:
+    """
+    Cola de generaciones persistente en SQLite (modo WAL), segura ante caídas.
+    
+    Entrega al menos una vez: tomar() marca el trabajo 'en_curso' con un arriendo
+    de `arriendo` segundos que el trabajador renueva mientras lo procesa. Si el
+    proceso muere, el arriendo vence y otro trabajador lo vuelve a tomar (o antes,
+    con recuperar_huerfanos()). Un trabajo puede entonces ejecutarse dos veces si
+    el proceso murió entre la respuesta del proveedor y completar(); la caché de
+    respuestas evita pagar la segunda llamada en ese caso.
+    
+    Cada proceso abre su propia conexión; varias colas sobre el mismo archivo se
+    coordinan con las transacciones de SQLite (BEGIN IMMEDIATE).
+    """
+    
+    def __init__(self, ruta, arriendo=120.0, max_intentos=20, reloj=time.time):
+        """
+        Args:
+            ruta: Archivo de la base de datos
+            arriendo: Segundos que un trabajador retiene un trabajo sin renovarlo
+            max_intentos: Intentos (incluidos los arriendos vencidos) antes de darlo por fallido
+            reloj: Función de tiempo de pared (comparable entre procesos)
+        """
+        self.ruta = ruta
+        self.arriendo = arriendo
+        self.max_intentos = max_intentos
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        
+        self._conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conexion.execute('PRAGMA journal_mode=WAL')
+        self._conexion.execute('PRAGMA synchronous=NORMAL')
+        self._conexion.executescript(ESQUEMA)
+    
+    def _transaccion(self, operacion):
+        """Ejecuta operacion(conexion, ahora) en una transacción de escritura exclusiva"""
+        with self._lock:
+            self._conexion.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = operacion(self._conexion, self._reloj())
+            except BaseException:
+                self._conexion.execute('ROLLBACK')
+                raise
+            self._conexion.execute('COMMIT')
+            return resultado
+    
+    def encolar(self, prompt, proveedor, carpeta_salida, datos=None):
+        """
+        Agrega un trabajo
+        
+        Args:
+            prompt: Prompt ya armado para el proveedor
+            proveedor: 'gemini', 'openai' o 'auto'
+            carpeta_salida: Carpeta donde el trabajador guarda el resultado
+            datos: dict con contexto del snapshot (salud, timestamp...)
+        
+        Returns:
+            id del trabajo
+        """
+        def operacion(conexion, ahora):
+            cursor = conexion.execute(
+                'INSERT INTO trabajos (creado, estado, proveedor, prompt, carpeta_salida, datos, disponible_desde) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (ahora, 'pendiente', proveedor, prompt, carpeta_salida,
+                 json.dumps(datos or {}, ensure_ascii=False, default=str), ahora)
+            )
+            return cursor.lastrowid
+        
+        return self._transaccion(operacion)
+    
+    def tomar(self, trabajador):
+        """
+        Toma el trabajo disponible más antiguo y lo arrienda a `trabajador`
+        
+        Antes libera los arriendos vencidos (o da por fallidos los trabajos
+        que ya agotaron sus intentos).
+        
+        Returns:
+            dict del trabajo, o None si no hay ninguno disponible
+        """
+        def operacion(conexion, ahora):
+            self._liberar_vencidos(conexion, ahora)
+            fila = conexion.execute(
+                "SELECT id FROM trabajos WHERE estado = 'pendiente' AND disponible_desde <= ? "
+                'ORDER BY id LIMIT 1',
+                (ahora,)
+            ).fetchone()
+            if fila is None:
+                return None
+            conexion.execute(
+                "UPDATE trabajos SET estado = 'en_curso', intentos = intentos + 1, "
+                'arriendo_hasta = ?, trabajador = ? WHERE id = ?',
+                (ahora + self.arriendo, trabajador, fila[0])
+            )
+            return self._obtener(conexion, fila[0])
+        
+        return self._transaccion(operacion)
+    
+    def _liberar_vencidos(self, conexion, ahora):
+        conexion.execute(
+            "UPDATE trabajos SET estado = CASE WHEN intentos >= ? THEN 'fallido' ELSE 'pendiente' END, "
+            "error = CASE WHEN intentos >= ? THEN 'Arriendo vencido: el trabajador no terminó' ELSE error END, "
+            'terminado = CASE WHEN intentos >= ? THEN ? ELSE NULL END, '
+            'arriendo_hasta = NULL, trabajador = NULL '
+            "WHERE estado = 'en_curso' AND arriendo_hasta < ?",
+            (self.max_intentos, self.max_intentos, self.max_intentos, ahora, ahora)
+        )
+    
+    @staticmethod
+    def _obtener(conexion, id_):
+        columnas = ('id', 'creado', 'estado', 'proveedor', 'prompt', 'carpeta_salida', 'datos',
+                    'intentos', 'disponible_desde', 'arriendo_hasta', 'trabajador', 'error')
+        fila = conexion.execute(f"SELECT {', '.join(columnas)} FROM trabajos WHERE id = ?", (id_,)).fetchone()
+        if fila is None:
+            return None
+        trabajo = dict(zip(columnas, fila))
+        trabajo['datos'] = json.loads(trabajo['datos'] or '{}')
+        return trabajo
+    
+    def obtener(self, id_):
+        """Trabajo por id (None si no existe)"""
+        with self._lock:
+            return self._obtener(self._conexion, id_)
+    
+    def renovar(self, id_, trabajador):
+        """
+        Extiende el arriendo de un trabajo en curso
+        
+        Returns:
+            False si el trabajo ya no es de `trabajador` (el arriendo venció y lo tomó otro)
+        """
+        def operacion(conexion, ahora):
+            cursor = conexion.execute(
+                "UPDATE trabajos SET arriendo_hasta = ? WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+                (ahora + self.arriendo, id_, trabajador)
+            )
+            return cursor.rowcount == 1
+        
+        return self._transaccion(operacion)
+    
+    def completar(self, id_, trabajador, resultado):
+        """Marca el trabajo como hecho; False si ya no era de `trabajador`"""
+        def operacion(conexion, ahora):
+            cursor = conexion.execute(
+                "UPDATE trabajos SET estado = 'hecho', resultado = ?, error = NULL, terminado = ?, "
+                "arriendo_hasta = NULL WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+                (json.dumps(resultado, ensure_ascii=False, default=str), ahora, id_, trabajador)
+            )
+            return cursor.rowcount == 1
+        
+        return self._transaccion(operacion)
+    
+    def fallar(self, id_, trabajador, error, reintentable=True, retry_after=None):
+        """
+        Registra un intento fallido
+        
+        Si es reintentable y quedan intentos, el trabajo vuelve a 'pendiente' con
+        backoff exponencial (o el Retry-After del proveedor, si es mayor); si no,
+        queda 'fallido'.
+        
+        Returns:
+            el nuevo estado, o None si el trabajo ya no era de `trabajador`
+        """
+        def operacion(conexion, ahora):
+            fila = conexion.execute(
+                "SELECT intentos FROM trabajos WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+                (id_, trabajador)
+            ).fetchone()
+            if fila is None:
+                return None
+            intentos = fila[0]
+            if reintentable and intentos < self.max_intentos:
+                espera = max(retry_after or 0.0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** (intentos - 1)))
+                conexion.execute(
+                    "UPDATE trabajos SET estado = 'pendiente', error = ?, disponible_desde = ?, "
+                    'arriendo_hasta = NULL, trabajador = NULL WHERE id = ?',
+                    (error, ahora + espera, id_)
+                )
+                return 'pendiente'
+            conexion.execute(
+                "UPDATE trabajos SET estado = 'fallido', error = ?, terminado = ?, "
+                'arriendo_hasta = NULL WHERE id = ?',
+                (error, ahora, id_)
+            )
+            return 'fallido'
+        
+        return self._transaccion(operacion)
+    
+    def liberar(self, id_, trabajador):
+        """Devuelve un trabajo a la cola sin contar el intento (p. ej. al detener el trabajador)"""
+        def operacion(conexion, ahora):
+            cursor = conexion.execute(
+                "UPDATE trabajos SET estado = 'pendiente', intentos = intentos - 1, arriendo_hasta = NULL, "
+                "trabajador = NULL WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+                (id_, trabajador)
+            )
+            return cursor.rowcount == 1
+        
+        return self._transaccion(operacion)
+    
+    def recuperar_huerfanos(self):
+        """
+        Devuelve a la cola, sin esperar a que venza el arriendo, los trabajos en
+        curso de procesos de esta máquina que ya no existen (p. ej. tras un reinicio)
+        
+        Returns:
+            cantidad de trabajos recuperados
+        """
+        host = socket.gethostname()
+        
+        def operacion(conexion, ahora):
+            filas = conexion.execute(
+                "SELECT id, trabajador FROM trabajos WHERE estado = 'en_curso'"
+            ).fetchall()
+            huerfanos = []
+            for id_, trabajador in filas:
+                host_trabajador, _, pid = (trabajador or '').rpartition(':')
+                if host_trabajador == host and pid.isdigit() and not _proceso_vivo(int(pid)):
+                    huerfanos.append((ahora, id_))
+            # Con el arriendo vencido se liberan igual que los de cualquier otro trabajador
+            conexion.executemany('UPDATE trabajos SET arriendo_hasta = ? - 1 WHERE id = ?', huerfanos)
+            self._liberar_vencidos(conexion, ahora)
+            return len(huerfanos)
+        
+        return self._transaccion(operacion)
+    
+    def reintentar_fallidos(self):
+        """Vuelve a encolar los trabajos fallidos con los intentos en cero; devuelve cuántos"""
+        def operacion(conexion, ahora):
+            cursor = conexion.execute(
+                "UPDATE trabajos SET estado = 'pendiente', intentos = 0, disponible_desde = ?, "
+                "terminado = NULL, trabajador = NULL WHERE estado = 'fallido'",
+                (ahora,)
+            )
+            return cursor.rowcount
+        
+        return self._transaccion(operacion)
+    
+    def estado(self):
+        """
+        Resumen de la cola
+        
+        Returns:
+            dict con la cantidad de trabajos por estado y los segundos hasta que
+            el próximo pendiente esté disponible (None si no hay pendientes)
+        """
+        with self._lock:
+            cuentas = dict(self._conexion.execute(
+                'SELECT estado, COUNT(*) FROM trabajos GROUP BY estado'
+            ).fetchall())
+            proximo = self._conexion.execute(
+                "SELECT MIN(disponible_desde) FROM trabajos WHERE estado = 'pendiente'"
+            ).fetchone()[0]
+        resumen = {estado: cuentas.get(estado, 0) for estado in ESTADOS}
+        resumen['proximo_en_s'] = None if proximo is None else round(max(0.0, proximo - self._reloj()), 1)
+        return resumen
+    
+    def vacia(self):
+        """True si no quedan trabajos pendientes ni en curso"""
+        resumen = self.estado()
+        return resumen['pendiente'] == 0 and resumen['en_curso'] == 0
+    
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+class _Renovador:
+    """Hilo que renueva el arriendo del trabajo en curso cada tercio del plazo"""
+    
+    def __init__(self, cola, id_, trabajador):
+        self._cola = cola
+        self._id = id_
+        self._trabajador = trabajador
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._renovar, name=f'arriendo-{id_}', daemon=True)
+    
+    def _renovar(self):
+        while not self._fin.wait(self._cola.arriendo / 3):
+            try:
+                if not self._cola.renovar(self._id, self._trabajador):
+                    return
+            except sqlite3.Error as e:
+                print(f"⚠️  No se pudo renovar el arriendo del trabajo #{self._id}: {e}")
+    
+    def __enter__(self):
+        self._hilo.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._fin.set()
+        self._hilo.join()
+        return False
+
+
+def procesar_trabajo(cola, trabajo, trabajador, clientes):
+    """
+    Genera un trabajo tomado de la cola y registra el resultado
+    
+    Args:
+        cola: ColaTrabajos
+        trabajo: dict devuelto por cola.tomar()
+        trabajador: Identificador del trabajador dueño del arriendo
+        clientes: _ClientesTrabajador (obtener(proveedor, carpeta) -> cliente)
+    
+    Returns:
+        el estado final del trabajo ('hecho', 'pendiente', 'fallido'), o None si se perdió el arriendo
+    """
+    try:
+        cliente = clientes.obtener(trabajo['proveedor'], trabajo['carpeta_salida'])
+        with _Renovador(cola, trabajo['id'], trabajador):
+            resultado = cliente.generar_con_reintentos(trabajo['prompt'], carpeta_salida=trabajo['carpeta_salida'])
+    except Exception as e:
+        # El trabajador no muere con el arriendo tomado: una API key faltante
+        # (ErrorConfiguracion) deja el trabajo fallido en lugar de volver a la cola
+        from politica_reintentos import describir_error
+        resultado = {'exito': False, 'error': f'{type(e).__name__}: {e}', **describir_error(e)}
+    
+    if resultado['exito']:
+        return 'hecho' if cola.completar(trabajo['id'], trabajador, resultado) else None
+    # Un circuito abierto es una caída del proveedor: el trabajo espera, no falla
+    reintentable = resultado.get('reintentable', True) or resultado.get('circuito_abierto', False)
+    return cola.fallar(trabajo['id'], trabajador, resultado.get('error', 'Desconocido'),
+                       reintentable=reintentable, retry_after=resultado.get('retry_after'))
+
+
+class _ClientesTrabajador:
+    """
+    Clientes de generación de un proceso trabajador, uno por (proveedor, carpeta)
+    
+    Comparten el historial y la caché de la carpeta de salida con la aplicación,
+    pero no abren el registro de muestras: ese archivo es solo de quien muestrea.
+    """
+    
+    def __init__(self):
+        self._clientes = {}
+        self._compartidos = {}
+    
+    def _historial_y_cache(self, carpeta):
+        if carpeta not in self._compartidos:
+            from cache_respuestas import CacheRespuestas
+            from historial_generaciones import HistorialGeneraciones
+            
+            os.makedirs(carpeta, exist_ok=True)
+            self._compartidos[carpeta] = (
+                HistorialGeneraciones(os.path.join(carpeta, 'historial.db')),
+                CacheRespuestas(os.path.join(carpeta, 'cache'))
+            )
+        return self._compartidos[carpeta]
+    
+    def _crear(self, proveedor, carpeta):
+        verificar_proveedor(proveedor)
+        historial, cache = self._historial_y_cache(carpeta)
+        if proveedor == 'gemini':
+            from gemini_client import GeminiClient
+            return GeminiClient(historial=historial, cache=cache)
+        if proveedor == 'openai':
+            from openai_client import OpenAIClient
+            return OpenAIClient(historial=historial, cache=cache)
+        
+        from enrutador_proveedores import EnrutadorProveedores
+        clientes = {
+            nombre: self.obtener(nombre, carpeta)
+            for nombre, variable in (('gemini', 'GEMINI_API_KEY'), ('openai', 'OPENAI_API_KEY'))
+            if os.getenv(variable)
+        }
+        return EnrutadorProveedores(clientes)
+    
+    def obtener(self, proveedor, carpeta):
+        clave = (proveedor, carpeta)
+        if clave not in self._clientes:
+            self._clientes[clave] = self._crear(proveedor, carpeta)
+        return self._clientes[clave]
+    
+    def cerrar(self):
+        """Escribe los lotes pendientes de los historiales"""
+        for historial, _ in self._compartidos.values():
+            historial.cerrar()
+
+
+def _proceso_trabajador(ruta_cola, arriendo, hasta_vaciar, parar, espera_vacia=1.0):
+    """Punto de entrada de cada proceso del pool"""
+    # Con la salida redirigida, que el log de cada trabajo no quede en el buffer si el proceso muere
+    sys.stdout.reconfigure(line_buffering=True)
+    cola = ColaTrabajos(ruta_cola, arriendo=arriendo)
+    trabajador = identificador_trabajador()
+    clientes = _ClientesTrabajador()
+    
+    import multiprocessing
+    padre = multiprocessing.parent_process()
+    
+    trabajo = None
+    try:
+        # Sin el proceso del pool (p. ej. terminado con SIGTERM) nadie detendría a este
+        while not parar.is_set() and padre.is_alive():
+            trabajo = cola.tomar(trabajador)
+            if trabajo is None:
+                if hasta_vaciar and cola.vacia():
+                    break
+                parar.wait(espera_vacia)
+                continue
+            print(f"\n⚙️  [{trabajador}] Trabajo #{trabajo['id']} (intento {trabajo['intentos']})")
+            estado = procesar_trabajo(cola, trabajo, trabajador, clientes)
+            print(f"⚙️  [{trabajador}] Trabajo #{trabajo['id']}: {estado or 'arriendo perdido'}")
+            trabajo = None
+    except KeyboardInterrupt:
+        if trabajo is not None:
+            cola.liberar(trabajo['id'], trabajador)
+    finally:
+        clientes.cerrar()
+        cola.cerrar()
+
+
+class PoolTrabajadores:
+    """
+    Pool de procesos que consumen una ColaTrabajos
+    
+    Cada proceso toma un trabajo a la vez, así `paralelismo` es la cantidad de
+    generaciones simultáneas. Los cupos de los proveedores se respetan entre
+    todos los procesos (ver LimitadorTasa, compartido por archivo).
+    """
+    
+    def __init__(self, ruta_cola, paralelismo=2, arriendo=120.0):
+        """
+        Args:
+            ruta_cola: Archivo de la cola
+            paralelismo: Cantidad de procesos trabajadores
+            arriendo: Segundos de arriendo de cada trabajo (ver ColaTrabajos)
+        """
+        if paralelismo < 1:
+            raise ValueError("El paralelismo tiene que ser al menos 1")
+        self.ruta_cola = ruta_cola
+        self.paralelismo = paralelismo
+        self.arriendo = arriendo
+    
+    def ejecutar(self, hasta_vaciar=False):
+        """
+        Lanza los procesos y espera a que terminen
+        
+        Args:
+            hasta_vaciar: Terminar cuando no queden trabajos pendientes ni en curso;
+                          si no, esperar trabajos nuevos hasta Ctrl+C
+        
+        Returns:
+            el estado final de la cola
+        """
+        import multiprocessing
+        
+        cola = ColaTrabajos(self.ruta_cola, arriendo=self.arriendo)
+        recuperados = cola.recuperar_huerfanos()
+        if recuperados:
+            print(f"♻️  {recuperados} trabajos de procesos anteriores vuelven a la cola")
+        print(f"📋 Cola: {cola.estado()}")
+        
+        # 'spawn': cada proceso arranca limpio (sin hilos ni conexiones heredadas), también en Windows
+        contexto = multiprocessing.get_context('spawn')
+        parar = contexto.Event()
+        procesos = [
+            contexto.Process(target=_proceso_trabajador, name=f'trabajador-{i + 1}',
+                             args=(self.ruta_cola, self.arriendo, hasta_vaciar, parar))
+            for i in range(self.paralelismo)
+        ]
+        for proceso in procesos:
+            proceso.start()
+        
+        try:
+            for proceso in procesos:
+                proceso.join()
+        except KeyboardInterrupt:
+            # Los procesos también reciben el Ctrl+C y devuelven su trabajo a la cola
+            parar.set()
+            for proceso in procesos:
+                proceso.join()
+        
+        estado = cola.estado()
+        cola.cerrar()
+        return estado
+
+
+# Función de prueba
+if __name__ == "__main__":
+    import tempfile
+    
+    print("=== PRUEBA DE LA COLA DE TRABAJOS ===")
+    
+    ruta = os.path.join(tempfile.mkdtemp(), 'cola.db')
+    cola = ColaTrabajos(ruta, arriendo=0.5, max_intentos=3)
+    for i in range(3):
+        cola.encolar(f'prompt {i}', 'gemini', 'output', datos={'salud_general': 50 + i})
+    print(f"Encolados: {cola.estado()}")
+    
+    trabajo = cola.tomar('a:1')
+    print(f"Tomado #{trabajo['id']} por a:1")
+    cola.completar(trabajo['id'], 'a:1', {'exito': True})
+    
+    trabajo = cola.tomar('a:1')
+    print(f"Tomado #{trabajo['id']} por a:1, que muere sin completarlo...")
+    time.sleep(0.6)
+    otro = cola.tomar('b:2')
+    print(f"Arriendo vencido: b:2 toma #{otro['id']} (intento {otro['intentos']})")
+    print(f"a:1 intenta completar #{trabajo['id']}: {cola.completar(trabajo['id'], 'a:1', {'exito': True})}")
+    
+    siguiente = cola.tomar('b:2')
+    print(f"Fallo pasajero en #{siguiente['id']}: {cola.fallar(siguiente['id'], 'b:2', '503', retry_after=0.1)}")
+    print(f"Estado final: {cola.estado()}")
@@ -0,0 +1,181 @@
+"""
+Osmotrofia - Colector /proc
+Backend de lecturas para Linux que lee /proc y /sys directamente, sin pasar por psutil
+"""
+
+import glob
+import os
+
+
+# Tipos de zona térmica que corresponden a la CPU
+ZONAS_TERMICAS_CPU = ('x86_pkg_temp', 'coretemp', 'cpu', 'soc', 'pkg')
+
+
+def proc_disponible():
+    """Indica si este sistema expone /proc/stat y /proc/meminfo legibles"""
+    return os.access('/proc/stat', os.R_OK) and os.access('/proc/meminfo', os.R_OK)
+
+
+class _Archivo:
+    """Archivo de /proc o /sys abierto una sola vez y releído con pread desde el inicio"""
+    
+    def __init__(self, ruta, tamano=8192):
+        self.ruta = ruta
+        self.tamano = tamano
+        self._fd = None
+    
+    def leer(self):
+        if self._fd is None:
+            self._fd = os.open(self.ruta, os.O_RDONLY)
+        try:
+            return os.pread(self._fd, self.tamano, 0)
+        except OSError:
+            # El archivo pudo desaparecer (p. ej. batería desconectada); reabrir en la próxima lectura
+            self.cerrar()
+            raise
+    
+    def leer_texto(self):
+        return self.leer().decode('ascii', 'replace').strip()
+    
+    def cerrar(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _leer_una_vez(ruta):
+    try:
+        with open(ruta, encoding='ascii', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+class ColectorProc:
+    """
+    Backend de lecturas crudas para Linux.
+    
+    Los descriptores se abren una vez y se reutilizan; cada snapshot hace un pread
+    por archivo. Expone la misma interfaz que ColectorPsutil.
+    """
+    
+    nombre = 'proc'
+    
+    def __init__(self, raiz_sys='/sys'):
+        self._stat = _Archivo('/proc/stat', 2048)
+        self._meminfo = _Archivo('/proc/meminfo')
+        self._nucleos = os.cpu_count()
+        
+        self._frecuencia = None
+        self._cpuinfo = None
+        ruta_frecuencia = os.path.join(raiz_sys, 'devices/system/cpu/cpu0/cpufreq/scaling_cur_freq')
+        if os.path.exists(ruta_frecuencia):
+            self._frecuencia = _Archivo(ruta_frecuencia, 64)
+        else:
+            # Sin cpufreq (p. ej. máquinas virtuales) queda el promedio de /proc/cpuinfo
+            self._cpuinfo = _Archivo('/proc/cpuinfo', 1 << 20)
+        
+        # Los sensores se descubren una sola vez
+        self._temperatura = self._buscar_zona_termica(raiz_sys)
+        self._baterias, self._cargadores = self._buscar_fuentes(raiz_sys)
+    
+    def _buscar_zona_termica(self, raiz_sys):
+        for zona in sorted(glob.glob(os.path.join(raiz_sys, 'class/thermal/thermal_zone*'))):
+            tipo = _leer_una_vez(os.path.join(zona, 'type')).lower()
+            if any(patron in tipo for patron in ZONAS_TERMICAS_CPU):
+                return _Archivo(os.path.join(zona, 'temp'), 64)
+        return None
+    
+    def _buscar_fuentes(self, raiz_sys):
+        baterias = []
+        cargadores = []
+        for fuente in sorted(glob.glob(os.path.join(raiz_sys, 'class/power_supply/*'))):
+            tipo = _leer_una_vez(os.path.join(fuente, 'type'))
+            if tipo == 'Battery' and os.path.exists(os.path.join(fuente, 'capacity')):
+                baterias.append((_Archivo(os.path.join(fuente, 'capacity'), 64),
+                                 _Archivo(os.path.join(fuente, 'status'), 64)))
+            elif tipo in ('Mains', 'USB') and os.path.exists(os.path.join(fuente, 'online')):
+                cargadores.append(_Archivo(os.path.join(fuente, 'online'), 64))
+        return baterias, cargadores
+    
+    def cerrar(self):
+        """Cierra todos los descriptores abiertos"""
+        archivos = [self._stat, self._meminfo, self._frecuencia, self._cpuinfo, self._temperatura,
+                    *self._cargadores]
+        for capacidad, estado in self._baterias:
+            archivos.extend((capacidad, estado))
+        for archivo in archivos:
+            if archivo is not None:
+                archivo.cerrar()
+    
+    def tiempos_cpu(self):
+        # Primera línea: cpu user nice system idle iowait irq softirq steal guest guest_nice
+        linea = self._stat.leer().split(b'\n', 1)[0]
+        campos = [int(v) for v in linea.split()[1:]]
+        total = sum(campos[:8])  # guest/guest_nice ya están incluidos en user/nice
+        inactivo = campos[3] + (campos[4] if len(campos) > 4 else 0)
+        return total - inactivo, total
+    
+    def nucleos(self):
+        return self._nucleos
+    
+    def frecuencia_cpu(self):
+        try:
+            if self._frecuencia is not None:
+                return int(self._frecuencia.leer_texto()) / 1000  # kHz -> MHz
+            if self._cpuinfo is not None:
+                mhz = [float(linea.partition(b':')[2]) for linea in self._cpuinfo.leer().splitlines()
+                       if linea.startswith(b'cpu MHz')]
+                if mhz:
+                    return sum(mhz) / len(mhz)
+        except (OSError, ValueError):
+            pass
+        return 0
+    
+    def memoria(self):
+        valores = {}
+        for linea in self._meminfo.leer().splitlines():
+            clave, _, resto = linea.partition(b':')
+            if clave in (b'MemTotal', b'MemAvailable', b'MemFree', b'Buffers', b'Cached'):
+                valores[clave] = int(resto.split()[0]) * 1024
+        
+        total = valores[b'MemTotal']
+        disponible = valores.get(b'MemAvailable')
+        if disponible is None:
+            # Kernels anteriores a 3.14 no exponen MemAvailable
+            disponible = valores.get(b'MemFree', 0) + valores.get(b'Buffers', 0) + valores.get(b'Cached', 0)
+        
+        porcentaje = round((total - disponible) / total * 100, 1) if total else 0.0
+        return {'porcentaje': porcentaje, 'total': total, 'disponible': disponible}
+    
+    def disco(self, ruta='/'):
+        st = os.statvfs(ruta)
+        total = st.f_blocks * st.f_frsize
+        usado = (st.f_blocks - st.f_bfree) * st.f_frsize
+        libre = st.f_bavail * st.f_frsize
+        # Igual que psutil: porcentaje sobre el espacio disponible para usuarios no root
+        porcentaje = round(usado / (usado + libre) * 100, 1) if usado + libre else 0.0
+        return {'porcentaje': porcentaje, 'total': total, 'libre': libre}
+    
+    def temperatura_cpu(self):
+        """Temperatura de CPU en °C, o None si no hay zona térmica de CPU"""
+        if self._temperatura is None:
+            return None
+        try:
+            return int(self._temperatura.leer_texto()) / 1000  # miligrados -> °C
+        except (OSError, ValueError):
+            return None
+    
+    def bateria(self):
+        """(porcentaje, conectado) de la batería, o None si no hay batería"""
+        if not self._baterias:
+            return None
+        
+        capacidad, estado = self._baterias[0]
+        porcentaje = int(capacidad.leer_texto())
+        
+        if self._cargadores:
+            conectado = any(c.leer_texto() == '1' for c in self._cargadores)
+        else:
+            conectado = estado.leer_texto() != 'Discharging'
+        return porcentaje, conectado
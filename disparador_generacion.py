@@ -0,0 +1,160 @@
+"""
+Osmotrofia - Disparador de Generación
+Decide cuándo vale la pena generar: cambio de condiciones, salto de salud o antigüedad máxima
+"""
+
+import time
+
+from generador_prompt import UMBRALES_CONDICIONES, bucket_condicion, valores_condiciones
+
+
+def bucket_con_histeresis(dimension, valor, bucket_actual, margen):
+    """
+    Bucket de un valor, manteniendo el actual mientras el valor no cruce el umbral por más de `margen`
+    
+    Los buckets son monótonos en el valor, así que los alcanzables dentro de
+    ±margen forman un rango; si el bucket actual está en ese rango no cambia.
+    """
+    nuevo = bucket_condicion(dimension, valor)
+    if bucket_actual is None or nuevo == bucket_actual or margen <= 0:
+        return nuevo
+    extremos = (bucket_condicion(dimension, valor - margen), bucket_condicion(dimension, valor + margen))
+    if min(extremos) <= bucket_actual <= max(extremos):
+        return bucket_actual
+    return nuevo
+
+
+class DisparadorGeneracion:
+    """
+    Dispara una generación cuando:
+      - cambia la firma de condiciones (los buckets de UMBRALES_CONDICIONES),
+      - la salud se alejó `delta_salud` puntos de la última generación, o
+      - pasaron `max_antiguedad` segundos desde la última generación.
+    
+    Los buckets tienen histéresis (`histeresis` puntos alrededor de cada umbral)
+    para que un valor oscilando junto a un umbral no dispare una y otra vez, y
+    entre dos disparos pasan al menos `min_intervalo` segundos; un cambio
+    que llega antes queda pendiente hasta entonces.
+    
+    Un disparo cuenta como generación recién cuando se llama a confirmar() con
+    él: si el proveedor falla, el mismo cambio vuelve a disparar pasado
+    `min_intervalo`, en lugar de esperar a `max_antiguedad`.
+    """
+    
+    def __init__(self, delta_salud=10, max_antiguedad=1800, histeresis=2.0, min_intervalo=30,
+                 por_condiciones=True, reloj=time.monotonic):
+        """
+        Args:
+            delta_salud: Puntos de salud que disparan una generación (None para ignorar la salud)
+            max_antiguedad: Segundos máximos sin generar (None para no forzar)
+            histeresis: Margen, en unidades del campo (°C, %), para cambiar de bucket
+            min_intervalo: Segundos mínimos entre disparos
+            por_condiciones: Si un cambio de firma dispara una generación
+            reloj: Función de tiempo monotónico
+        """
+        self.delta_salud = delta_salud
+        self.max_antiguedad = max_antiguedad
+        self.histeresis = histeresis
+        self.min_intervalo = min_intervalo
+        self.por_condiciones = por_condiciones
+        self._reloj = reloj
+        
+        self.firma = None
+        self._firma_generada = None
+        self._salud_generada = None
+        self._ultima_generacion = None
+        self._ultimo_intento = None
+        # (firma, salud, instante) del último disparo, para confirmar()
+        self.ultimo_disparo = None
+        self.evaluaciones = 0
+        self.disparos = 0
+    
+    def actualizar_firma(self, parametros, salud):
+        """Firma de condiciones con histéresis respecto de la anterior"""
+        valores = valores_condiciones(parametros, salud)
+        anterior = self.firma or (None,) * len(UMBRALES_CONDICIONES)
+        self.firma = tuple(
+            bucket_con_histeresis(dimension, valores[campo], actual, self.histeresis)
+            for (dimension, (campo, _, _)), actual in zip(UMBRALES_CONDICIONES.items(), anterior)
+        )
+        return self.firma
+    
+    def motivo(self, salud, ahora):
+        """Razón para generar con la firma actual, o None"""
+        if self._ultima_generacion is None:
+            return 'inicio'
+        if self.por_condiciones and self.firma != self._firma_generada:
+            return 'condiciones'
+        if self.delta_salud is not None and abs(salud - self._salud_generada) >= self.delta_salud:
+            return 'salud'
+        if self.max_antiguedad is not None and ahora - self._ultima_generacion >= self.max_antiguedad:
+            return 'antiguedad'
+        return None
+    
+    def evaluar(self, parametros, salud, ahora=None):
+        """
+        Procesa una muestra
+        
+        Returns:
+            'inicio', 'condiciones', 'salud' o 'antiguedad' si hay que generar ahora
+            (ver ultimo_disparo y confirmar()), o None
+        """
+        ahora = self._reloj() if ahora is None else ahora
+        self.evaluaciones += 1
+        self.actualizar_firma(parametros, salud)
+        
+        motivo = self.motivo(salud, ahora)
+        if motivo is None:
+            return None
+        if self._ultimo_intento is not None and ahora - self._ultimo_intento < self.min_intervalo:
+            return None
+        
+        self._ultimo_intento = ahora
+        self.ultimo_disparo = (self.firma, salud, ahora)
+        self.disparos += 1
+        return motivo
+    
+    def confirmar(self, disparo):
+        """Da por generado un disparo (el ultimo_disparo de cuando evaluar() lo devolvió)"""
+        firma, salud, instante = disparo
+        # Con varias generaciones en vuelo puede terminar antes una más nueva
+        if self._ultima_generacion is not None and instante < self._ultima_generacion:
+            return
+        self._firma_generada = firma
+        self._salud_generada = salud
+        self._ultima_generacion = instante
+    
+    def segundos_desde_generacion(self, ahora=None):
+        if self._ultima_generacion is None:
+            return None
+        return (self._reloj() if ahora is None else ahora) - self._ultima_generacion
+
+
+# Función de prueba
+if __name__ == "__main__":
+    import random
+    
+    print("=== PRUEBA DEL DISPARADOR DE GENERACIÓN ===")
+    
+    def snapshot(cpu, temperatura):
+        return {
+            'hardware': {'temperatura': {'cpu': temperatura}, 'bateria': {'porcentaje': 90}},
+            'rendimiento': {
+                'cpu': {'uso_porcentaje': cpu},
+                'ram': {'uso_porcentaje': 50},
+                'almacenamiento': {'uso_porcentaje': 40}
+            }
+        }
+    
+    disparador = DisparadorGeneracion(min_intervalo=0)
+    # Una hora a 1 muestra/s con la CPU oscilando alrededor del umbral de 30 %
+    for segundo in range(3600):
+        cpu = 30 + random.uniform(-1.5, 1.5) + (40 if 1800 <= segundo < 1900 else 0)
+        temperatura = 65 + random.uniform(-1, 1)
+        salud = 100 - cpu / 2
+        motivo = disparador.evaluar(snapshot(cpu, temperatura), salud, ahora=segundo)
+        if motivo:
+            disparador.confirmar(disparador.ultimo_disparo)
+            print(f"  t={segundo:4d}s  cpu={cpu:5.1f}%  -> generar ({motivo})")
+    
+    print(f"\n{disparador.disparos} generaciones en {disparador.evaluaciones} muestras")
@@ -0,0 +1,330 @@
+"""
+Osmotrofia - Enrutador de Proveedores
+Elige el proveedor más rápido y sano según latencias y errores recientes, con cobertura (hedging) opcional
+"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from metricas import contar
+from politica_reintentos import InterruptorCircuito, PoliticaReintentos
+
+
+class EstadisticasProveedor:
+    """Ventana deslizante de latencias y resultados de las llamadas a un proveedor"""
+    
+    def __init__(self, ventana=50):
+        self.latencias = deque(maxlen=ventana)
+        self.resultados = deque(maxlen=ventana)  # True si la llamada tuvo éxito
+        self._lock = threading.Lock()
+    
+    def registrar(self, latencia, exito):
+        """Registra una llamada terminada; solo las exitosas aportan latencia"""
+        with self._lock:
+            self.resultados.append(exito)
+            if exito:
+                self.latencias.append(latencia)
+    
+    def registrar_latencia(self, latencia):
+        """
+        Latencia de una llamada cancelada (perdió la cobertura): es una cota
+        inferior, pero descartarla haría que el p95 ignore justo la cola lenta
+        """
+        with self._lock:
+            self.latencias.append(latencia)
+    
+    def percentil(self, q):
+        """Percentil q (0-1) de las latencias por rango más cercano, o None sin datos"""
+        with self._lock:
+            ordenadas = sorted(self.latencias)
+        if not ordenadas:
+            return None
+        return ordenadas[max(0, math.ceil(q * len(ordenadas)) - 1)]
+    
+    def tasa_error(self):
+        with self._lock:
+            if not self.resultados:
+                return 0.0
+            return self.resultados.count(False) / len(self.resultados)
+    
+    def resumen(self):
+        return {
+            'llamadas': len(self.resultados),
+            'tasa_error': round(self.tasa_error(), 3),
+            'p50': self.percentil(0.5),
+            'p95': self.percentil(0.95)
+        }
+
+
+class _EnrutadorBase:
+    """
+    Estado común de los enrutadores: estadísticas por proveedor y orden de preferencia.
+    
+    Un proveedor está sano si su interruptor de circuito no está abierto y su
+    tasa de error reciente no supera `max_tasa_error`. Los sanos van primero,
+    del p50 más bajo al más alto; uno sin mediciones va adelante para medirlo.
+    Con probabilidad `exploracion` se intercambian los dos primeros sanos, así
+    el que quedó segundo sigue midiéndose y puede recuperar el primer lugar.
+    """
+    
+    def __init__(self, clientes, ventana=50, max_tasa_error=0.5, exploracion=0.05,
+                 reintentos=None, aleatorio=random.random):
+        """
+        Args:
+            clientes: dict nombre -> cliente, en orden de preferencia para desempatar;
+                      cada cliente tiene generar_con_reintentos y su propia política
+            ventana: Llamadas recientes que se consideran por proveedor
+            max_tasa_error: Tasa de error (0-1) a partir de la cual el proveedor va al final
+            exploracion: Probabilidad de probar el segundo proveedor sano en lugar del primero
+            reintentos: PoliticaReintentos entre rondas (por defecto una propia del enrutador)
+            aleatorio: Fuente de números en [0, 1) para la exploración
+        """
+        if not clientes:
+            raise ValueError("El enrutador necesita al menos un proveedor")
+        self.clientes = dict(clientes)
+        self.estadisticas = {nombre: EstadisticasProveedor(ventana) for nombre in self.clientes}
+        self.max_tasa_error = max_tasa_error
+        self.exploracion = exploracion
+        self._aleatorio = aleatorio
+        # Una ronda ya probó todos los proveedores: el circuito del enrutador solo
+        # se abre si fallan todos varias rondas seguidas
+        self.reintentos = reintentos if reintentos is not None else PoliticaReintentos(
+            nombre='enrutador', interruptor=InterruptorCircuito(umbral_fallos=10)
+        )
+        self.historial = next(iter(self.clientes.values())).historial
+    
+    @property
+    def max_caracteres_prompt(self):
+        """El límite más estricto entre los proveedores: el prompt tiene que servirle a cualquiera"""
+        limites = [cliente.max_caracteres_prompt for cliente in self.clientes.values()
+                   if cliente.max_caracteres_prompt is not None]
+        return min(limites) if limites else None
+    
+    def sano(self, nombre):
+        if self.clientes[nombre].reintentos.interruptor.estado == 'abierto':
+            return False
+        return self.estadisticas[nombre].tasa_error() <= self.max_tasa_error
+    
+    def orden(self):
+        """Nombres de los proveedores en el orden en que se intentarán"""
+        def clave(nombre):
+            p50 = self.estadisticas[nombre].percentil(0.5)
+            return (not self.sano(nombre), -1 if p50 is None else p50)
+        
+        orden = sorted(self.clientes, key=clave)
+        if len(orden) > 1 and self.sano(orden[1]) and self._aleatorio() < self.exploracion:
+            orden[0], orden[1] = orden[1], orden[0]
+        return orden
+    
+    def _argumentos(self, nombre, al_recibir):
+        # Solo los clientes con streaming (Gemini) reciben el callback
+        if al_recibir is not None and hasattr(self.clientes[nombre], 'generar_imagen_streaming'):
+            return {'al_recibir': al_recibir}
+        return {}
+    
+    def _registrar(self, nombre, inicio, resultado):
+        # Un acierto de cache o un circuito abierto no dicen nada de la latencia del proveedor
+        if resultado.get('cache') or resultado.get('circuito_abierto'):
+            return
+        self.estadisticas[nombre].registrar(time.monotonic() - inicio, resultado['exito'])
+    
+    def resumen(self):
+        """dict nombre -> estadísticas recientes, estado del circuito y cupo disponible"""
+        resumen = {}
+        for nombre, cliente in self.clientes.items():
+            limitador = getattr(cliente, 'limitador', None)
+            resumen[nombre] = {
+                **self.estadisticas[nombre].resumen(),
+                'circuito': cliente.reintentos.interruptor.estado,
+                'sano': self.sano(nombre),
+                'holgura': limitador.holgura() if limitador is not None else None
+            }
+        return resumen
+    
+    def obtener_historial(self, limite=20, antes_de=None):
+        return self.historial.ultimos(limite, antes_de=antes_de)
+
+
+class EnrutadorProveedores(_EnrutadorBase):
+    """
+    Enrutador síncrono con la misma interfaz que GeminiClient y OpenAIClient.
+    
+    Cada ronda intenta los proveedores en orden (un intento por proveedor,
+    con su interruptor de circuito) hasta que uno responde. No hace cobertura:
+    un hilo no se puede cancelar, así que la llamada perdedora seguiría
+    corriendo; para eso está EnrutadorProveedoresAsync.
+    """
+    
+    def _intentar(self, nombre, prompt, carpeta_salida, al_recibir):
+        inicio = time.monotonic()
+        resultado = self.clientes[nombre].generar_con_reintentos(
+            prompt, max_intentos=1, carpeta_salida=carpeta_salida, **self._argumentos(nombre, al_recibir)
+        )
+        self._registrar(nombre, inicio, resultado)
+        return resultado
+    
+    def generar_imagen(self, prompt, carpeta_salida='output', al_recibir=None):
+        """Una ronda: el primer proveedor que responde bien, o el último fallo"""
+        resultado = None
+        for nombre in self.orden():
+            print(f"🧭 Proveedor: {nombre}")
+            resultado = self._intentar(nombre, prompt, carpeta_salida, al_recibir)
+            if resultado['exito']:
+                resultado['proveedor'] = nombre
+                return resultado
+        return resultado
+    
+    def generar_imagen_streaming(self, prompt, carpeta_salida='output', al_recibir=None):
+        return self.generar_imagen(prompt, carpeta_salida, al_recibir)
+    
+    def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output', al_recibir=None):
+        """Rondas con la política de reintentos del enrutador"""
+        return self.reintentos.ejecutar(
+            lambda: self.generar_imagen(prompt, carpeta_salida, al_recibir), max_intentos
+        )
+
+
+class EnrutadorProveedoresAsync(_EnrutadorBase):
+    """
+    Enrutador sobre los clientes asíncronos (GeminiClientAsync, OpenAIClientAsync).
+    
+    Con cobertura=True, si el primer proveedor no respondió dentro de su p95
+    se lanza la misma generación en el segundo; gana la primera respuesta
+    exitosa y la otra tarea se cancela. La cobertura empieza recién cuando
+    el primero tiene `min_muestras_cobertura` latencias medidas. La llamada de
+    cobertura no recibe `al_recibir`, para no mezclar dos streams en pantalla.
+    """
+    
+    def __init__(self, clientes, cobertura=False, min_muestras_cobertura=5, **kwargs):
+        super().__init__(clientes, **kwargs)
+        self.cobertura = cobertura
+        self.min_muestras_cobertura = min_muestras_cobertura
+    
+    async def _intentar(self, nombre, prompt, carpeta_salida, al_recibir):
+        inicio = time.monotonic()
+        try:
+            resultado = await self.clientes[nombre].generar_con_reintentos(
+                prompt, max_intentos=1, carpeta_salida=carpeta_salida, **self._argumentos(nombre, al_recibir)
+            )
+        except asyncio.CancelledError:
+            self.estadisticas[nombre].registrar_latencia(time.monotonic() - inicio)
+            raise
+        self._registrar(nombre, inicio, resultado)
+        resultado['proveedor'] = nombre
+        return resultado
+    
+    def _espera_cobertura(self, nombre):
+        """Segundos antes de cubrir al proveedor, o None si aún no hay datos suficientes"""
+        estadisticas = self.estadisticas[nombre]
+        if len(estadisticas.latencias) < self.min_muestras_cobertura:
+            return None
+        return estadisticas.percentil(0.95)
+    
+    async def generar_imagen(self, prompt, carpeta_salida='output', al_recibir=None):
+        """Una ronda, con cobertura entre los dos primeros proveedores si está habilitada"""
+        orden = self.orden()
+        resultado = None
+        
+        if self.cobertura and len(orden) > 1 and self.sano(orden[1]):
+            espera = self._espera_cobertura(orden[0])
+            if espera is not None:
+                resultado, cubierto = await self._con_cobertura(orden[0], orden[1], espera, prompt,
+                                                                carpeta_salida, al_recibir)
+                if resultado['exito']:
+                    return resultado
+                # Si el primero falló antes de su p95 el segundo aún no se probó
+                orden = orden[2:] if cubierto else orden[1:]
+        
+        for nombre in orden:
+            print(f"🧭 Proveedor: {nombre}")
+            resultado = await self._intentar(nombre, prompt, carpeta_salida, al_recibir)
+            if resultado['exito']:
+                return resultado
+        return resultado
+    
+    async def _con_cobertura(self, primero, segundo, espera, prompt, carpeta_salida, al_recibir):
+        """
+        Returns:
+            (resultado, si se lanzó la cobertura con el segundo proveedor)
+        """
+        print(f"🧭 Proveedor: {primero} (cobertura con {segundo} a los {espera:.1f}s)")
+        tareas = {asyncio.create_task(self._intentar(primero, prompt, carpeta_salida, al_recibir))}
+        try:
+            listas, _ = await asyncio.wait(tareas, timeout=espera)
+            if not listas:
+                contar('cobertura_disparada', proveedor=segundo)
+                print(f"🧭 {primero} superó su p95: lanzando cobertura con {segundo}")
+                tareas.add(asyncio.create_task(self._intentar(segundo, prompt, carpeta_salida, None)))
+            
+            resultado = None
+            pendientes = tareas
+            while pendientes:
+                listas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in listas:
+                    resultado = tarea.result()
+                    if resultado['exito']:
+                        if len(tareas) > 1:
+                            contar('cobertura_ganada', proveedor=resultado['proveedor'])
+                        return resultado, len(tareas) > 1
+            return resultado, len(tareas) > 1
+        finally:
+            # La perdedora (o ambas, si se canceló la ronda) se cancela
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+    
+    async def generar_imagen_streaming(self, prompt, carpeta_salida='output', al_recibir=None):
+        return await self.generar_imagen(prompt, carpeta_salida, al_recibir)
+    
+    async def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output', al_recibir=None):
+        """Rondas con la política de reintentos del enrutador; las esperas no bloquean el event loop"""
+        return await self.reintentos.ejecutar_async(
+            lambda: self.generar_imagen(prompt, carpeta_salida, al_recibir), max_intentos
+        )
+
+
+# Función de prueba
+if __name__ == "__main__":
+    print("=== PRUEBA DEL ENRUTADOR DE PROVEEDORES ===")
+    
+    class ClienteSimulado:
+        """Cliente con latencia aleatoria y cola larga, sin red"""
+        
+        def __init__(self, nombre, mediana, prob_lenta):
+            self.nombre = nombre
+            self.mediana = mediana
+            self.prob_lenta = prob_lenta
+            self.historial = None
+            self.reintentos = PoliticaReintentos(nombre=nombre)
+        
+        async def generar_con_reintentos(self, prompt, max_intentos=1, carpeta_salida='output'):
+            lenta = random.random() < self.prob_lenta
+            await asyncio.sleep(self.mediana * (10 if lenta else random.uniform(0.8, 1.2)))
+            return {'exito': True}
+    
+    async def prueba(cobertura):
+        enrutador = EnrutadorProveedoresAsync(
+            {'rapido': ClienteSimulado('rapido', 0.02, 0.1), 'estable': ClienteSimulado('estable', 0.04, 0.0)},
+            cobertura=cobertura
+        )
+        latencias = []
+        for _ in range(100):
+            inicio = time.monotonic()
+            await enrutador.generar_imagen('prompt')
+            latencias.append(time.monotonic() - inicio)
+        latencias.sort()
+        return latencias[49], latencias[94], latencias[-1]
+    
+    import io
+    from contextlib import redirect_stdout
+    
+    with redirect_stdout(io.StringIO()):
+        sin_cobertura = asyncio.run(prueba(False))
+        con_cobertura = asyncio.run(prueba(True))
+    
+    for titulo, (p50, p95, maximo) in (('Sin cobertura', sin_cobertura), ('Con cobertura', con_cobertura)):
+        print(f"{titulo}: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, máx {maximo * 1000:.0f} ms")
@@ -0,0 +1,17 @@
+"""
+Osmotrofia - Errores
+Excepciones compartidas por los clientes y la aplicación (sin dependencias, para el arranque rápido)
+"""
+
+
+class ErrorConfiguracion(ValueError):
+    """Configuración inválida: API key faltante o proveedor desconocido"""
+
+
+class ErrorProveedor(Exception):
+    """Error de la API de un proveedor, con su código HTTP y el Retry-After si lo envió"""
+    
+    def __init__(self, mensaje, codigo=None, retry_after=None):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.retry_after = retry_after
@@ -0,0 +1,165 @@
+"""
+Osmotrofia - Evaluación por Lotes
+Puntaje de salud y clasificación de condiciones vectorizados con NumPy, para re-evaluar historia
+"""
+
+import numpy as np
+
+from generador_prompt import UMBRALES_CONDICIONES
+from monitor_sistema import UMBRALES_SALUD_TEMPERATURA, PUNTAJES_SALUD_TEMPERATURA
+from registro_muestras import CABECERA, LectorMuestras
+from serie_temporal import CAMPOS_MUESTRA
+
+
+# Mismo layout que registro_muestras.REGISTRO, para ver el log como array estructurado
+DTYPE_REGISTRO = np.dtype([('timestamp', '<f8')] + [(campo, '<f4') for campo in CAMPOS_MUESTRA])
+
+
+def _columna(columnas, campo):
+    return np.asarray(columnas[campo], dtype=np.float64)
+
+
+def calcular_salud_lote(columnas):
+    """
+    Puntaje de salud (0-100) de muchas muestras en una sola pasada
+    
+    Args:
+        columnas: mapeo con arrays 'temperatura', 'bateria', 'cpu', 'ram' y 'disco'
+                  (un dict, un array estructurado o cualquier cosa indexable por nombre)
+    
+    Returns:
+        array float64 con el mismo resultado que MonitorSistema.calcular_salud_general
+    """
+    umbrales = np.asarray(UMBRALES_SALUD_TEMPERATURA, dtype=np.float64)
+    puntajes = np.asarray(PUNTAJES_SALUD_TEMPERATURA, dtype=np.float64)
+    puntaje_temperatura = puntajes[np.searchsorted(umbrales, _columna(columnas, 'temperatura'), side='right')]
+    
+    suma = (
+        puntaje_temperatura
+        + _columna(columnas, 'bateria')
+        + (100 - _columna(columnas, 'cpu'))
+        + (100 - _columna(columnas, 'ram'))
+        + (100 - _columna(columnas, 'disco'))
+    )
+    media = suma / 5
+    salud = np.round(media, 1)
+    # np.round escala por 10 y redondea el producto, y difiere de round() cuando la
+    # media queda a un paso de ,x5: esos pocos casos se redondean como el monitor
+    dudosos = np.flatnonzero(np.abs(media * 10 % 1 - 0.5) < 1e-6)
+    for i in dudosos:
+        salud[i] = round(float(media[i]), 1)
+    return salud
+
+
+def clasificar_condiciones_lote(columnas, dimensiones=None):
+    """
+    Índice de bucket por dimensión para muchas muestras (ver UMBRALES_CONDICIONES)
+    
+    Args:
+        columnas: mapeo campo -> array; 'salud' puede faltar si no se pide esa dimensión
+        dimensiones: Dimensiones a clasificar (por defecto todas las disponibles)
+    
+    Returns:
+        dict dimensión -> array int8 con el índice en DESCRIPCIONES_CONDICIONES
+    """
+    if dimensiones is None:
+        disponibles = _campos(columnas)
+        dimensiones = [d for d, (campo, _, _) in UMBRALES_CONDICIONES.items() if campo in disponibles]
+    
+    buckets = {}
+    for dimension in dimensiones:
+        campo, umbrales, comparacion = UMBRALES_CONDICIONES[dimension]
+        umbrales = np.asarray(umbrales, dtype=np.float64)
+        valores = _columna(columnas, campo)
+        if comparacion == 'menor':
+            indices = np.searchsorted(umbrales, valores, side='right')
+        else:
+            indices = len(umbrales) - np.searchsorted(umbrales, valores, side='left')
+        buckets[dimension] = indices.astype(np.int8)
+    return buckets
+
+
+def _campos(columnas):
+    nombres = getattr(getattr(columnas, 'dtype', None), 'names', None)
+    return set(nombres) if nombres else set(columnas)
+
+
+def columnas_registro(lector, inicio=0, fin=None):
+    """
+    Vista (sin copia) de un LectorMuestras como array estructurado con un campo por columna
+    
+    La vista es válida mientras el lector siga abierto.
+    """
+    fin = len(lector) if fin is None else min(fin, len(lector))
+    inicio = min(inicio, fin)
+    return np.frombuffer(
+        lector.mapa,
+        dtype=DTYPE_REGISTRO,
+        count=fin - inicio,
+        offset=CABECERA.size + inicio * DTYPE_REGISTRO.itemsize
+    )
+
+
+def columnas_serie(serie, ultimas=None):
+    """Copia contigua de las columnas de una SerieTemporal, como dict campo -> array"""
+    columnas = {}
+    for campo in ('timestamp',) + CAMPOS_MUESTRA:
+        segmentos = [np.asarray(vista) for vista in serie.vista(campo, ultimas)]
+        columnas[campo] = np.concatenate(segmentos) if segmentos else np.empty(0)
+    return columnas
+
+
+def reevaluar_registro(ruta):
+    """
+    Recalcula salud y buckets de todo un registro de muestras con los umbrales actuales
+    
+    Returns:
+        (salud, buckets) como arrays alineados con los registros del log
+    """
+    with LectorMuestras(ruta) as lector:
+        muestras = columnas_registro(lector)
+        salud = calcular_salud_lote(muestras)
+        columnas = {campo: muestras[campo] for campo in CAMPOS_MUESTRA}
+        columnas['salud'] = salud
+        buckets = clasificar_condiciones_lote(columnas)
+        del muestras, columnas
+    return salud, buckets
+
+
+# Función de prueba
+if __name__ == "__main__":
+    from monitor_sistema import MonitorSistema
+    
+    print("=== PRUEBA DE EVALUACIÓN POR LOTES ===")
+    
+    cantidad = 200_000
+    generador = np.random.default_rng(0)
+    columnas = {
+        'temperatura': generador.uniform(20, 100, cantidad),
+        'bateria': generador.uniform(0, 100, cantidad),
+        'cpu': generador.uniform(0, 100, cantidad),
+        'ram': generador.uniform(0, 100, cantidad),
+        'disco': generador.uniform(0, 100, cantidad)
+    }
+    # Valores con dos decimales, como los que reporta el monitor
+    columnas = {campo: np.round(valores, 2) for campo, valores in columnas.items()}
+    lote = calcular_salud_lote(columnas)
+    
+    monitor = MonitorSistema()
+    distintos = 0
+    for i in range(cantidad):
+        parametros = {
+            'hardware': {
+                'temperatura': {'cpu': float(columnas['temperatura'][i])},
+                'bateria': {'porcentaje': float(columnas['bateria'][i])}
+            },
+            'rendimiento': {
+                'cpu': {'uso_porcentaje': float(columnas['cpu'][i])},
+                'ram': {'uso_porcentaje': float(columnas['ram'][i])},
+                'almacenamiento': {'uso_porcentaje': float(columnas['disco'][i])}
+            }
+        }
+        distintos += monitor.calcular_salud_general(parametros) != lote[i]
+    
+    print(f"{cantidad} muestras: {distintos} puntajes distintos de calcular_salud_general")
+    assert distintos == 0
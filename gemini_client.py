@@ -6,24 +6,191 @@ Maneja la comunicación con la API de Gemini para generar imágenes
 import google.generativeai as genai
 import os
 from datetime import datetime
-import time
+
+from cache_respuestas import ruta_salida
+from errores import ErrorConfiguracion
+from historial_generaciones import HistorialGeneraciones
+from limitador_tasa import LimitadorTasa, estimar_tokens
+from metricas import span
+from politica_reintentos import PoliticaReintentos, describir_error
+
+# Tokens de salida que se reservan por generación (la descripción mejorada)
+TOKENS_RESPUESTA_ESTIMADOS = 800
+
+# Pausa del cupo tras un 429 sin Retry-After
+PAUSA_429 = 10
+
+
+def _ruta_prompt(carpeta_salida):
+    """Timestamp y ruta del prompt_*.txt de una generación"""
+    return ruta_salida(carpeta_salida, 'prompt', 'txt')
+
+
+def _encabezado_prompt(prompt):
+    return f"=== PROMPT ORIGINAL ===\n\n{prompt}\n\n=== DESCRIPCIÓN MEJORADA ===\n\n"
+
+
+def texto_fragmento(fragmento):
+    """Texto de un fragmento del stream; '' si no trae texto (p. ej. solo el motivo de fin)"""
+    try:
+        return fragmento.text
+    except ValueError:
+        return ''
+
+
+class EscritorDescripcion:
+    """
+    Escribe una descripción en prompt_*.txt a medida que llegan los fragmentos
+    
+    Se usa como context manager: al salir sin error cierra y renombra el
+    archivo .parcial a su nombre final; si hubo una excepción lo borra.
+    No guarda el texto: cada fragmento va al archivo y a `al_recibir`.
+    """
+    
+    def __init__(self, prompt, carpeta_salida, al_recibir=None):
+        self.timestamp, self.archivo_prompt = _ruta_prompt(carpeta_salida)
+        self.caracteres = 0
+        self._parcial = self.archivo_prompt + '.parcial'
+        self._al_recibir = al_recibir
+        self._archivo = open(self._parcial, 'w', encoding='utf-8')
+        self._archivo.write(_encabezado_prompt(prompt))
+    
+    def agregar(self, fragmento):
+        if not fragmento:
+            return
+        self._archivo.write(fragmento)
+        # Visible enseguida para quien siga el archivo (tail -f)
+        self._archivo.flush()
+        self.caracteres += len(fragmento)
+        if self._al_recibir is not None:
+            self._al_recibir(fragmento)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, tipo, valor, traza):
+        self._archivo.close()
+        if tipo is None:
+            os.replace(self._parcial, self.archivo_prompt)
+        else:
+            try:
+                os.remove(self._parcial)
+            except OSError:
+                pass
+        return False
+
 
 class GeminiClient:
-    def __init__(self, api_key=None):
-        """Inicializa el cliente de Gemini"""
+    def __init__(self, api_key=None, historial=None, cache=None, reintentos=None, base_url=None, transport=None,
+                 limitador=None):
+        """
+        Inicializa el cliente de Gemini
+        
+        Args:
+            base_url: Endpoint alternativo (por defecto GEMINI_BASE_URL); permite apuntar a
+                      servidor_simulado.py. Implica el transporte REST
+            transport: Transporte del SDK ('grpc', 'grpc_asyncio' o 'rest')
+            limitador: LimitadorTasa (por defecto uno con GEMINI_RPM / GEMINI_TPM, si están definidos)
+        """
         if api_key is None:
             api_key = os.getenv('GEMINI_API_KEY')
         
         if not api_key:
-            raise ValueError("API Key de Gemini no encontrada. Define GEMINI_API_KEY en variables de entorno.")
+            raise ErrorConfiguracion("API Key de Gemini no encontrada. Define GEMINI_API_KEY en variables de entorno.")
         
-        genai.configure(api_key=api_key)
+        self.base_url = base_url or os.getenv('GEMINI_BASE_URL')
+        opciones = {'api_key': api_key}
+        if transport:
+            opciones['transport'] = transport
+        if self.base_url:
+            opciones.setdefault('transport', 'rest')
+            opciones['client_options'] = {'api_endpoint': self.base_url}
+        genai.configure(**opciones)
+        # Con REST las variantes *_async del SDK devuelven objetos síncronos (ver clientes_async)
+        self.transport = opciones.get('transport')
         
         # Configurar el modelo para generación de imágenes
         # Nota: Gemini actualmente genera imágenes a través de Imagen 3
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.nombre_modelo = 'gemini-2.0-flash-exp'
+        self.model = genai.GenerativeModel(self.nombre_modelo)
+        # Sin límite práctico de caracteres (ver GeneradorPrompt.generar_prompt)
+        self.max_caracteres_prompt = None
+        
+        # Historial persistente; sin uno explícito se usa una base en memoria
+        self.historial = historial if historial is not None else HistorialGeneraciones()
+        # Cache de respuestas opcional (CacheRespuestas)
+        self.cache = cache
+        # Backoff e interruptor de circuito propios de este proveedor
+        self.reintentos = reintentos if reintentos is not None else PoliticaReintentos(nombre='gemini')
+        # Cupo de solicitudes y tokens por minuto, compartido con otros procesos que usan la misma key
+        self.limitador = limitador if limitador is not None else LimitadorTasa.desde_entorno(
+            'gemini', api_key, self.nombre_modelo
+        )
+    
+    def _instruccion(self, prompt):
+        """Instrucción que envuelve el prompt para obtener la descripción mejorada"""
+        return f"""Basándote en esta descripción de una colonia de hongos, genera una descripción aún más detallada y visual para un generador de imágenes AI. Enfócate en detalles microscópicos, texturas, iluminación y composición:
+
+{prompt}
+
+Responde SOLO con la descripción mejorada, sin explicaciones adicionales."""
+    
+    def _tokens_estimados(self, prompt):
+        """Tokens que consume una generación: la instrucción más una respuesta típica"""
+        return estimar_tokens(self._instruccion(prompt)) + TOKENS_RESPUESTA_ESTIMADOS
+    
+    def _reservar_cupo(self, prompt):
+        """Espera, si hay limitador, a tener cupo para la llamada"""
+        if self.limitador is not None:
+            self.limitador.adquirir(self._tokens_estimados(prompt))
+    
+    def _clave_cache(self, prompt):
+        # Respuestas de otro servidor (p. ej. el simulado) no se mezclan con las reales
+        parametros = {'base_url': self.base_url} if self.base_url else None
+        return self.cache.clave('gemini', self.nombre_modelo, prompt, parametros)
+    
+    def _desde_cache(self, prompt, carpeta_salida):
+        """Resultado inmediato si el prompt ya fue respondido, o None"""
+        if self.cache is None:
+            return None
+        entrada = self.cache.obtener(self._clave_cache(prompt))
+        if entrada is None:
+            return None
+        
+        print("♻️  Respuesta encontrada en cache, sin llamar a la API")
+        os.makedirs(carpeta_salida, exist_ok=True)
+        return self._registrar_descripcion(prompt, entrada['descripcion_mejorada'], carpeta_salida, desde_cache=True)
+    
+    def _registrar_descripcion(self, prompt, descripcion_mejorada, carpeta_salida, desde_cache=False):
+        """Guarda el prompt y la respuesta, y arma el resultado"""
+        timestamp, archivo_prompt = _ruta_prompt(carpeta_salida)
+        
+        with open(archivo_prompt, 'w', encoding='utf-8') as f:
+            f.write(_encabezado_prompt(prompt))
+            f.write(descripcion_mejorada)
+        
+        return self._resultado_descripcion(prompt, descripcion_mejorada, timestamp, archivo_prompt, desde_cache)
+    
+    def _resultado_descripcion(self, prompt, descripcion_mejorada, timestamp, archivo_prompt, desde_cache=False):
+        """Arma el resultado de una descripción ya escrita; la guarda en cache y en el historial"""
+        resultado = {
+            'exito': True,
+            'timestamp': timestamp,
+            'archivo_prompt': archivo_prompt,
+            'descripcion_mejorada': descripcion_mejorada,
+            'cache': desde_cache,
+            'mensaje': 'Descripción generada exitosamente. Usa esta descripción con un generador de imágenes como Midjourney, DALL-E o Stable Diffusion.'
+        }
         
-        self.historial = []
+        if self.cache is not None and not desde_cache:
+            self.cache.guardar(self._clave_cache(prompt), {'descripcion_mejorada': descripcion_mejorada})
+        
+        self.historial.agregar(resultado, 'gemini')
+        
+        print("✅ Descripción generada exitosamente")
+        print(f"📁 Guardado en: {archivo_prompt}")
+        
+        return resultado
     
     def generar_imagen(self, prompt, carpeta_salida='output'):
         """
@@ -34,9 +201,13 @@ class GeminiClient:
             carpeta_salida: Carpeta donde guardar las imágenes
         
         Returns:
-            dict con información de la generación
+            dict con información de la generación ('cache': True si no se llamó a la API)
         """
         try:
+            resultado = self._desde_cache(prompt, carpeta_salida)
+            if resultado is not None:
+                return resultado
+            
             print("🍄 Generando colonia de hongos...")
             print(f"📝 Prompt enviado ({len(prompt)} caracteres)")
             
@@ -47,70 +218,90 @@ class GeminiClient:
             # Usamos el modelo de texto para generar una descripción mejorada
             # que luego podría usarse con Imagen 3 (cuando esté disponible en API)
             
-            response = self.model.generate_content(
-                f"""Basándote en esta descripción de una colonia de hongos, genera una descripción 
-                aún más detallada y visual para un generador de imágenes AI. Enfócate en detalles 
-                microscópicos, texturas, iluminación y composición:
-
-{prompt}
-
-Responde SOLO con la descripción mejorada, sin explicaciones adicionales."""
-            )
-            
-            descripcion_mejorada = response.text
-            
-            # Guardar el prompt y la respuesta
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            archivo_prompt = os.path.join(carpeta_salida, f'prompt_{timestamp}.txt')
+            self._reservar_cupo(prompt)
+            with span('proveedor.llamada', proveedor='gemini'):
+                response = self.model.generate_content(self._instruccion(prompt))
             
-            with open(archivo_prompt, 'w', encoding='utf-8') as f:
-                f.write("=== PROMPT ORIGINAL ===\n\n")
-                f.write(prompt)
-                f.write("\n\n=== DESCRIPCIÓN MEJORADA ===\n\n")
-                f.write(descripcion_mejorada)
+            return self._registrar_descripcion(prompt, response.text, carpeta_salida)
             
-            resultado = {
-                'exito': True,
-                'timestamp': timestamp,
-                'archivo_prompt': archivo_prompt,
-                'descripcion_mejorada': descripcion_mejorada,
-                'mensaje': 'Descripción generada exitosamente. Usa esta descripción con un generador de imágenes como Midjourney, DALL-E o Stable Diffusion.'
-            }
+        except Exception as e:
+            return self._resultado_error(e)
+    
+    def generar_imagen_streaming(self, prompt, carpeta_salida='output', al_recibir=None):
+        """
+        Como generar_imagen, pero consume la respuesta por fragmentos
+        
+        Cada fragmento se agrega a prompt_*.txt apenas llega (el archivo se escribe
+        como prompt_*.txt.parcial y se renombra al terminar) y se pasa a
+        `al_recibir`, así la primera parte de la descripción se puede mostrar
+        sin esperar la respuesta completa.
+        
+        Args:
+            prompt: Descripción detallada para la imagen
+            carpeta_salida: Carpeta donde guardar las imágenes
+            al_recibir: Callable(fragmento) llamado con cada fragmento de texto;
+                        con un acierto de cache recibe la descripción entera
+        
+        Returns:
+            dict con información de la generación (mismo formato que generar_imagen)
+        """
+        try:
+            resultado = self._desde_cache(prompt, carpeta_salida)
+            if resultado is not None:
+                if al_recibir is not None:
+                    al_recibir(resultado['descripcion_mejorada'])
+                return resultado
             
-            self.historial.append(resultado)
+            print("🍄 Generando colonia de hongos (streaming)...")
+            print(f"📝 Prompt enviado ({len(prompt)} caracteres)")
+            os.makedirs(carpeta_salida, exist_ok=True)
             
-            print("✅ Descripción generada exitosamente")
-            print(f"📁 Guardado en: {archivo_prompt}")
+            self._reservar_cupo(prompt)
+            with span('proveedor.llamada', proveedor='gemini', modo='streaming'):
+                response = self.model.generate_content(self._instruccion(prompt), stream=True)
+                with EscritorDescripcion(prompt, carpeta_salida, al_recibir) as escritor:
+                    for fragmento in response:
+                        escritor.agregar(texto_fragmento(fragmento))
+            if al_recibir is not None:
+                print()  # Cierra la línea si los fragmentos se mostraron en consola
             
-            return resultado
+            # El SDK ya acumuló los fragmentos: se usa su texto en lugar de juntar otra copia
+            return self._resultado_descripcion(prompt, response.text, escritor.timestamp, escritor.archivo_prompt)
             
         except Exception as e:
-            print(f"❌ Error al generar: {str(e)}")
-            return {
-                'exito': False,
-                'error': str(e),
-                'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S")
-            }
-    
-    def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output'):
-        """Genera imagen con reintentos en caso de fallo"""
-        for intento in range(max_intentos):
-            print(f"Intento {intento + 1}/{max_intentos}")
-            resultado = self.generar_imagen(prompt, carpeta_salida)
-            
-            if resultado['exito']:
-                return resultado
-            
-            if intento < max_intentos - 1:
-                tiempo_espera = (intento + 1) * 5
-                print(f"⏳ Esperando {tiempo_espera}s antes de reintentar...")
-                time.sleep(tiempo_espera)
-        
+            return self._resultado_error(e)
+    
+    def _resultado_error(self, e):
+        """Registra y devuelve el resultado de una generación fallida"""
+        print(f"❌ Error al generar: {str(e)}")
+        resultado = {
+            'exito': False,
+            'error': str(e),
+            'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
+            **describir_error(e)
+        }
+        if resultado['codigo'] == 429 and self.limitador is not None:
+            # Los demás procesos con la misma key también esperan
+            self.limitador.pausar(resultado['retry_after'] or PAUSA_429)
+        self.historial.agregar(resultado, 'gemini')
         return resultado
     
-    def obtener_historial(self):
-        """Retorna el historial de generaciones"""
-        return self.historial
+    def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output', al_recibir=None):
+        """
+        Genera imagen reintentando solo los fallos pasajeros (ver PoliticaReintentos)
+        
+        Con `al_recibir` usa generar_imagen_streaming; un reintento vuelve a
+        enviar los fragmentos desde el principio.
+        """
+        if al_recibir is not None:
+            return self.reintentos.ejecutar(
+                lambda: self.generar_imagen_streaming(prompt, carpeta_salida, al_recibir), max_intentos
+            )
+        return self.reintentos.ejecutar(lambda: self.generar_imagen(prompt, carpeta_salida), max_intentos)
+    
+    def obtener_historial(self, limite=20, antes_de=None):
+        """Retorna una página con las últimas generaciones (ver HistorialGeneraciones.ultimos)"""
+        return self.historial.ultimos(limite, antes_de=antes_de)
 
 
 # Función de prueba
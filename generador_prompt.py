@@ -3,8 +3,256 @@ Osmotrofia - Generador de Prompts
 Traduce parámetros técnicos a características biológicas de hongos
 """
 
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+# Umbrales ordenados por dimensión: (campo de muestra, umbrales ascendentes, comparación).
+# 'menor': el bucket 0 es valor < umbrales[0], el 1 es valor < umbrales[1], ...
+# 'mayor': el bucket 0 es valor > umbrales[-1], el 1 es valor > umbrales[-2], ...
+# El índice de bucket es la posición en DESCRIPCIONES_CONDICIONES.
+UMBRALES_CONDICIONES = {
+    'temperatura': ('temperatura', (50, 70, 85), 'menor'),
+    'hidratacion': ('bateria', (20, 50, 80), 'mayor'),
+    'ventilacion': ('cpu', (30, 70), 'menor'),
+    'densidad': ('ram', (40, 70), 'menor'),
+    'espacio': ('disco', (50, 80), 'menor'),
+    'metabolismo': ('cpu', (30, 70), 'menor'),
+    'salud': ('salud', (40, 60, 80), 'mayor')
+}
+
+DESCRIPCIONES_CONDICIONES = {
+    'temperatura': (
+        {
+            'descripcion': 'Ambiente frío, hongos con escarcha visible, crecimiento lento y conservativo.',
+            'paleta': 'frio',
+            'textura': 'superficie cristalizada, con pequeños cristales de hielo'
+        },
+        {
+            'descripcion': 'Temperatura óptima, hongos saludables con colores naturales y vibrantes.',
+            'paleta': 'optimo',
+            'textura': 'superficie suave y ligeramente húmeda, natural'
+        },
+        {
+            'descripcion': 'Ambiente caliente, hongos con tonos cálidos, crecimiento acelerado.',
+            'paleta': 'caliente',
+            'textura': 'superficie seca, bordes ligeramente deshidratados'
+        },
+        {
+            'descripcion': 'TEMPERATURA CRÍTICA: hongos chamuscados, áreas quemadas, vapor visible.',
+            'paleta': 'critico',
+            'textura': 'superficie agrietada y ennegrecida, con señales de daño térmico'
+        }
+    ),
+    'hidratacion': (
+        {
+            'descripcion': 'Alta hidratación, hongos turgentes y brillantes.',
+            'estado': 'cuerpos fructíferos llenos, con brillo de humedad'
+        },
+        {
+            'descripcion': 'Hidratación moderada, hongos en estado normal.',
+            'estado': 'apariencia estándar saludable'
+        },
+        {
+            'descripcion': 'Baja hidratación, hongos comenzando a marchitarse.',
+            'estado': 'colores ligeramente apagados, pérdida de turgencia'
+        },
+        {
+            'descripcion': 'Deshidratación crítica, hongos secos y agrietados.',
+            'estado': 'superficie craquelada, esporas flotando en el aire'
+        }
+    ),
+    'ventilacion': (
+        {
+            'descripcion': 'Excelente ventilación, hongos aireados y porosos.',
+            'densidad': 'estructuras abiertas con lamelas visibles'
+        },
+        {
+            'descripcion': 'Ventilación adecuada, crecimiento saludable.',
+            'densidad': 'textura estándar, bien oxigenados'
+        },
+        {
+            'descripcion': 'Ventilación limitada, hongos densos y compactos.',
+            'densidad': 'moho compacto, falta de oxígeno visible'
+        }
+    ),
+    'densidad': (
+        {
+            'descripcion': 'Baja densidad, hongos espaciados con mucho sustrato visible.',
+            'distribucion': 'colonias individuales bien separadas'
+        },
+        {
+            'descripcion': 'Densidad moderada, colonia establecida.',
+            'distribucion': 'hongos agrupados pero con espacio entre ellos'
+        },
+        {
+            'descripcion': 'Alta densidad, hongos apiñados y compitiendo por espacio.',
+            'distribucion': 'sobrepoblación, hongos creciendo unos sobre otros'
+        }
+    ),
+    'espacio': (
+        {
+            'descripcion': 'Amplio espacio disponible, territorio expandido.',
+            'crecimiento': 'hongos pueden crecer libremente en todas direcciones'
+        },
+        {
+            'descripcion': 'Espacio moderado, colonia establecida con límites.',
+            'crecimiento': 'crecimiento vertical, optimizando espacio'
+        },
+        {
+            'descripcion': 'Espacio crítico, hongos fosilizados en capas.',
+            'crecimiento': 'estratificación visible, sin espacio para nuevos brotes'
+        }
+    ),
+    'metabolismo': (
+        {
+            'descripcion': 'Metabolismo en reposo, colonia dormida.',
+            'intensidad': 'tonos pasteles suaves, sin actividad visible'
+        },
+        {
+            'descripcion': 'Metabolismo activo, crecimiento visible.',
+            'intensidad': 'colores saturados, señales de vida activa'
+        },
+        {
+            'descripcion': 'Metabolismo acelerado, actividad intensa.',
+            'intensidad': 'colores brillantes pulsantes, energía visible'
+        }
+    ),
+    'salud': (
+        {'descripcion': 'Ecosistema saludable y próspero, sin señales de estrés.'},
+        {'descripcion': 'Ecosistema moderadamente saludable, algunas áreas de estrés.'},
+        {'descripcion': 'Ecosistema bajo estrés, señales visibles de deterioro.'},
+        {'descripcion': 'Ecosistema crítico, colonia en peligro con múltiples problemas.'}
+    )
+}
+
+
+def valores_condiciones(params, salud):
+    """Extrae de un snapshot los valores que usan las condiciones, por campo de muestra"""
+    return {
+        'temperatura': params['hardware']['temperatura']['cpu'],
+        'bateria': params['hardware']['bateria']['porcentaje'],
+        'cpu': params['rendimiento']['cpu']['uso_porcentaje'],
+        'ram': params['rendimiento']['ram']['uso_porcentaje'],
+        'disco': params['rendimiento']['almacenamiento']['uso_porcentaje'],
+        'salud': salud
+    }
+
+
+def bucket_condicion(dimension, valor):
+    """Índice de bucket de un valor en una dimensión (ver UMBRALES_CONDICIONES)"""
+    _, umbrales, comparacion = UMBRALES_CONDICIONES[dimension]
+    if comparacion == 'menor':
+        return bisect_right(umbrales, valor)
+    return len(umbrales) - bisect_left(umbrales, valor)
+
+
+# Marca que ocupa el lugar de los números dentro de una plantilla pre-renderizada
+_HUECO = '\x00'
+
+SEPARADOR_SECCIONES = '\n\n'
+
+# Qué secciones del prompt se conservan primero al ajustarlo a un presupuesto (mayor = más importante)
+PRIORIDADES_SECCIONES = {
+    'introduccion': 100,
+    'salud': 90,
+    'temperatura': 80,
+    'metabolismo': 70,
+    'densidad': 60,
+    'hidratacion': 50,
+    'espacio': 40,
+    'ventilacion': 30,
+    'estilo': 20,
+    'composicion': 10,
+    'cierre': 5
+}
+SECCIONES_OBLIGATORIAS = frozenset({'introduccion', 'salud'})
+
+# Caracteres por token para convertir un presupuesto en tokens (sin tokenizador)
+CARACTERES_POR_TOKEN = 4
+
+
+def _resumir(descripcion):
+    """Primera frase corta de una descripción: 'Ambiente frío, hongos con...' -> 'Ambiente frío'"""
+    return descripcion.split(',')[0].rstrip('.')
+
+
+def _unir(textos):
+    """Une secciones; las líneas condensadas ('- ...') seguidas van sin línea en blanco"""
+    partes = []
+    for texto in textos:
+        if partes:
+            lista = texto.startswith('- ') and partes[-1].startswith('- ')
+            partes.append('\n' if lista else SEPARADOR_SECCIONES)
+        partes.append(texto)
+    return ''.join(partes)
+
+
+def _presupuesto(max_caracteres, max_tokens):
+    """Presupuesto en caracteres (el menor de los dos), o None"""
+    limites = [limite for limite in (max_caracteres, max_tokens and max_tokens * CARACTERES_POR_TOKEN) if limite]
+    return min(limites) if limites else None
+
+
+def recortar_prompt(prompt, max_caracteres):
+    """
+    Recorta un prompt que no entra en `max_caracteres` quitando líneas enteras del final
+    
+    Último recurso de generar_prompt y de los clientes con límite de caracteres;
+    solo corta una palabra a la mitad si la primera línea ya no entra.
+    """
+    if len(prompt) <= max_caracteres:
+        return prompt
+    corte = prompt.rfind('\n', 0, max_caracteres + 1)
+    if corte > 0:
+        return prompt[:corte].rstrip()
+    return prompt[:max_caracteres - 3] + "..."
+
+
+class CacheLRU:
+    """Diccionario acotado que descarta la entrada usada hace más tiempo"""
+    
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self._datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def __len__(self):
+        return len(self._datos)
+    
+    def obtener(self, clave):
+        valor = self._datos.get(clave)
+        if valor is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        self._datos.move_to_end(clave)
+        return valor
+    
+    def guardar(self, clave, valor):
+        if self.capacidad <= 0:
+            return
+        self._datos[clave] = valor
+        self._datos.move_to_end(clave)
+        if len(self._datos) > self.capacidad:
+            self._datos.popitem(last=False)
+    
+    def limpiar(self):
+        self._datos.clear()
+
+
 class GeneradorPrompt:
-    def __init__(self):
+    def __init__(self, tamano_cache=256, cuantizar=None):
+        """
+        Args:
+            tamano_cache: Cantidad máxima de prompts (y de plantillas) memorizados; 0 desactiva el cache
+            cuantizar: Si se indica (p. ej. 5), los porcentajes del prompt se redondean a ese paso
+                       para que estados cercanos compartan el mismo prompt
+        """
+        self.cuantizar = cuantizar
+        self._cache_plantillas = CacheLRU(tamano_cache)
+        self._cache_prompts = CacheLRU(tamano_cache)
         self.mapeo_colores = {
             'optimo': ['marrones naturales', 'beige', 'dorado suave', 'blanco cremoso'],
             'caliente': ['rojo', 'naranja', 'amarillo intenso'],
@@ -15,206 +263,234 @@ class GeneradorPrompt:
             'humedo': ['verde musgo', 'marrón oscuro húmedo']
         }
     
+    def firma_condiciones(self, parametros, salud_general):
+        """Tupla con el bucket de cada dimensión; dos snapshots con la misma firma se describen igual"""
+        valores = valores_condiciones(parametros, salud_general)
+        return tuple(
+            bucket_condicion(dimension, valores[campo])
+            for dimension, (campo, _, _) in UMBRALES_CONDICIONES.items()
+        )
+    
+    def _cuantizar(self, valor):
+        if not self.cuantizar:
+            return valor
+        redondeado = round(valor / self.cuantizar) * self.cuantizar
+        return int(redondeado) if float(redondeado).is_integer() else round(redondeado, 1)
+    
+    def _valores_interpolados(self, parametros, salud_general):
+        """
+        Números que se interpolan en el prompt, en orden de aparición y ya como texto
+        
+        El texto es la clave del cache de prompts: 100 y 100.0 son iguales como
+        números pero se escriben distinto.
+        """
+        return tuple(str(self._cuantizar(v)) for v in (
+            parametros['hardware']['bateria']['porcentaje'],
+            parametros['rendimiento']['ram']['uso_porcentaje'],
+            parametros['rendimiento']['almacenamiento']['uso_porcentaje'],
+            parametros['rendimiento']['cpu']['uso_porcentaje'],
+            salud_general
+        ))
+    
     def generar_prompt_completo(self, parametros, salud_general):
         """Genera el prompt completo para Gemini"""
+        firma = self.firma_condiciones(parametros, salud_general)
+        valores = self._valores_interpolados(parametros, salud_general)
         
-        # Análisis de condiciones
-        condiciones = self._analizar_condiciones(parametros, salud_general)
+        prompt = self._cache_prompts.obtener((firma, valores))
+        if prompt is None:
+            segmentos = self._plantilla(firma)
+            partes = [segmentos[0]]
+            for valor, segmento in zip(valores, segmentos[1:]):
+                partes.append(valor)
+                partes.append(segmento)
+            prompt = ''.join(partes)
+            self._cache_prompts.guardar((firma, valores), prompt)
         
-        # Construcción del prompt
-        prompt = f"""Genera una imagen fotorealista de una colonia de hongos que representa el estado actual de una computadora.
-
-PARÁMETROS BIOLÓGICOS A REPRESENTAR:
-
-**TEMPERATURA Y AMBIENTE**
-{condiciones['temperatura']['descripcion']}
-- Colores dominantes: {', '.join(condiciones['temperatura']['colores'])}
-- Textura: {condiciones['temperatura']['textura']}
-
-**HIDRATACIÓN (Batería: {parametros['hardware']['bateria']['porcentaje']}%)**
-{condiciones['hidratacion']['descripcion']}
-- Estado de los hongos: {condiciones['hidratacion']['estado']}
-
-**OXIGENACIÓN (Ventilación)**
-{condiciones['ventilacion']['descripcion']}
-- Densidad: {condiciones['ventilacion']['densidad']}
-
-**DENSIDAD POBLACIONAL (RAM: {parametros['rendimiento']['ram']['uso_porcentaje']}%)**
-{condiciones['densidad']['descripcion']}
-- Distribución: {condiciones['densidad']['distribucion']}
-
-**ESPACIO VITAL (Almacenamiento: {parametros['rendimiento']['almacenamiento']['uso_porcentaje']}%)**
-{condiciones['espacio']['descripcion']}
-- Crecimiento: {condiciones['espacio']['crecimiento']}
-
-**METABOLISMO (CPU: {parametros['rendimiento']['cpu']['uso_porcentaje']}%)**
-{condiciones['metabolismo']['descripcion']}
-- Intensidad visual: {condiciones['metabolismo']['intensidad']}
-
-**SALUD GENERAL DEL ECOSISTEMA: {salud_general}%**
-{condiciones['salud']['descripcion']}
-
-ESTILO VISUAL:
-- Fotografía macro de alta calidad, iluminación natural difusa
-- Textura realista de hongos con detalles visibles (lamelas, poros, esporas)
-- Profundidad de campo para dar sensación tridimensional
-- Ambiente orgánico y natural, como un bosque microscópico
-- Sin texto, sin números, solo la representación visual pura
-
-COMPOSICIÓN:
-- Vista cenital o lateral de la colonia
-- Fondo de sustrato orgánico (tierra, madera, material en descomposición)
-- Múltiples especies de hongos si hay variedad de condiciones
-- Atmósfera coherente con las condiciones descritas
-
-La imagen debe sentirse VIVA y representar visualmente el estado de salud de la computadora a través de la metáfora de los hongos."""
-
         return prompt
     
-    def _analizar_condiciones(self, params, salud):
-        """Analiza parámetros y genera descripciones biológicas"""
-        condiciones = {}
+    def estadisticas_cache(self):
+        """Aciertos y fallos del cache de prompts"""
+        return {
+            'aciertos': self._cache_prompts.aciertos,
+            'fallos': self._cache_prompts.fallos,
+            'prompts': len(self._cache_prompts),
+            'plantillas': len(self._cache_plantillas)
+        }
+    
+    def _plantilla(self, firma):
+        """Partes estáticas del prompt para una firma, separadas donde van los números"""
+        segmentos = self._cache_plantillas.obtener(firma)
+        if segmentos is None:
+            segmentos = tuple(self._renderizar_plantilla(firma).split(_HUECO))
+            self._cache_plantillas.guardar(firma, segmentos)
+        return segmentos
+    
+    def _renderizar_plantilla(self, firma):
+        """Renderiza el prompt de una firma dejando _HUECO en lugar de cada porcentaje"""
+        secciones = self._secciones(firma, (_HUECO,) * 5)
+        return SEPARADOR_SECCIONES.join(completa for _, completa, _ in secciones)
+    
+    def _secciones(self, firma, valores):
+        """
+        Secciones del prompt en orden de aparición
+        
+        Returns:
+            lista de (clave, texto completo, texto condensado o None); la clave
+            indexa PRIORIDADES_SECCIONES
+        """
+        condiciones = self._condiciones_de_firma(firma)
+        bateria, ram, disco, cpu, salud = valores
+        temperatura, hidratacion = condiciones['temperatura'], condiciones['hidratacion']
+        ventilacion, densidad = condiciones['ventilacion'], condiciones['densidad']
+        espacio, metabolismo = condiciones['espacio'], condiciones['metabolismo']
+        
+        return [
+            ('introduccion',
+             "Genera una imagen fotorealista de una colonia de hongos que representa el estado actual "
+             "de una computadora.\n\nPARÁMETROS BIOLÓGICOS A REPRESENTAR:",
+             "Imagen fotorealista de una colonia de hongos que representa el estado de una computadora:"),
+            ('temperatura',
+             f"**TEMPERATURA Y AMBIENTE**\n{temperatura['descripcion']}\n"
+             f"- Colores dominantes: {', '.join(temperatura['colores'])}\n"
+             f"- Textura: {temperatura['textura']}",
+             f"- Ambiente: {_resumir(temperatura['descripcion'])}; colores {', '.join(temperatura['colores'])}"),
+            ('hidratacion',
+             f"**HIDRATACIÓN (Batería: {bateria}%)**\n{hidratacion['descripcion']}\n"
+             f"- Estado de los hongos: {hidratacion['estado']}",
+             f"- Hidratación: {_resumir(hidratacion['descripcion'])}"),
+            ('ventilacion',
+             f"**OXIGENACIÓN (Ventilación)**\n{ventilacion['descripcion']}\n"
+             f"- Densidad: {ventilacion['densidad']}",
+             f"- Oxigenación: {_resumir(ventilacion['descripcion'])}"),
+            ('densidad',
+             f"**DENSIDAD POBLACIONAL (RAM: {ram}%)**\n{densidad['descripcion']}\n"
+             f"- Distribución: {densidad['distribucion']}",
+             f"- Densidad: {_resumir(densidad['descripcion'])}"),
+            ('espacio',
+             f"**ESPACIO VITAL (Almacenamiento: {disco}%)**\n{espacio['descripcion']}\n"
+             f"- Crecimiento: {espacio['crecimiento']}",
+             f"- Espacio: {_resumir(espacio['descripcion'])}"),
+            ('metabolismo',
+             f"**METABOLISMO (CPU: {cpu}%)**\n{metabolismo['descripcion']}\n"
+             f"- Intensidad visual: {metabolismo['intensidad']}",
+             f"- Metabolismo: {_resumir(metabolismo['descripcion'])}; {metabolismo['intensidad']}"),
+            ('salud',
+             f"**SALUD GENERAL DEL ECOSISTEMA: {salud}%**\n{condiciones['salud']['descripcion']}",
+             f"- Salud: {_resumir(condiciones['salud']['descripcion'])}"),
+            ('estilo',
+             "ESTILO VISUAL:\n"
+             "- Fotografía macro de alta calidad, iluminación natural difusa\n"
+             "- Textura realista de hongos con detalles visibles (lamelas, poros, esporas)\n"
+             "- Profundidad de campo para dar sensación tridimensional\n"
+             "- Ambiente orgánico y natural, como un bosque microscópico\n"
+             "- Sin texto, sin números, solo la representación visual pura",
+             "Estilo: fotografía macro realista, luz natural difusa, sin texto ni números."),
+            ('composicion',
+             "COMPOSICIÓN:\n"
+             "- Vista cenital o lateral de la colonia\n"
+             "- Fondo de sustrato orgánico (tierra, madera, material en descomposición)\n"
+             "- Múltiples especies de hongos si hay variedad de condiciones\n"
+             "- Atmósfera coherente con las condiciones descritas",
+             "Composición: vista cenital o lateral sobre sustrato orgánico."),
+            ('cierre',
+             "La imagen debe sentirse VIVA y representar visualmente el estado de salud de la computadora "
+             "a través de la metáfora de los hongos.",
+             None)
+        ]
+    
+    def generar_prompt(self, parametros, salud_general, max_caracteres=None, max_tokens=None,
+                       firma_anterior=None):
+        """
+        Prompt ajustado a un presupuesto
         
-        # TEMPERATURA
-        temp = params['hardware']['temperatura']['cpu']
-        if temp < 50:
-            condiciones['temperatura'] = {
-                'descripcion': 'Ambiente frío, hongos con escarcha visible, crecimiento lento y conservativo.',
-                'colores': self.mapeo_colores['frio'],
-                'textura': 'superficie cristalizada, con pequeños cristales de hielo'
-            }
-        elif temp < 70:
-            condiciones['temperatura'] = {
-                'descripcion': 'Temperatura óptima, hongos saludables con colores naturales y vibrantes.',
-                'colores': self.mapeo_colores['optimo'],
-                'textura': 'superficie suave y ligeramente húmeda, natural'
-            }
-        elif temp < 85:
-            condiciones['temperatura'] = {
-                'descripcion': 'Ambiente caliente, hongos con tonos cálidos, crecimiento acelerado.',
-                'colores': self.mapeo_colores['caliente'],
-                'textura': 'superficie seca, bordes ligeramente deshidratados'
-            }
-        else:
-            condiciones['temperatura'] = {
-                'descripcion': 'TEMPERATURA CRÍTICA: hongos chamuscados, áreas quemadas, vapor visible.',
-                'colores': self.mapeo_colores['critico'],
-                'textura': 'superficie agrietada y ennegrecida, con señales de daño térmico'
-            }
+        Sin presupuesto ni firma_anterior es igual a generar_prompt_completo. Si el
+        prompt no entra, se condensan a una línea las secciones de menor prioridad
+        (ver PRIORIDADES_SECCIONES), o se quitan si no tienen forma condensada; si
+        aún no entra se quitan las condensadas, también de menor a mayor prioridad.
+        La introducción y la salud no se quitan nunca. Solo si eso no alcanza se
+        recorta el final (ver recortar_prompt).
         
-        # HIDRATACIÓN (Batería)
-        bateria = params['hardware']['bateria']['porcentaje']
-        if bateria > 80:
-            condiciones['hidratacion'] = {
-                'descripcion': 'Alta hidratación, hongos turgentes y brillantes.',
-                'estado': 'cuerpos fructíferos llenos, con brillo de humedad'
-            }
-        elif bateria > 50:
-            condiciones['hidratacion'] = {
-                'descripcion': 'Hidratación moderada, hongos en estado normal.',
-                'estado': 'apariencia estándar saludable'
-            }
-        elif bateria > 20:
-            condiciones['hidratacion'] = {
-                'descripcion': 'Baja hidratación, hongos comenzando a marchitarse.',
-                'estado': 'colores ligeramente apagados, pérdida de turgencia'
-            }
-        else:
-            condiciones['hidratacion'] = {
-                'descripcion': 'Deshidratación crítica, hongos secos y agrietados.',
-                'estado': 'superficie craquelada, esporas flotando en el aire'
-            }
+        Args:
+            parametros: Snapshot del sistema
+            salud_general: Salud (0-100)
+            max_caracteres: Presupuesto en caracteres
+            max_tokens: Presupuesto en tokens (estimados a ~4 caracteres por token)
+            firma_anterior: Firma de la última generación (ver firma_condiciones);
+                            variante compacta: solo las dimensiones cuyo bucket cambió
+                            (y la salud) van completas, el resto condensado a una línea
         
-        # VENTILACIÓN
-        cpu_uso = params['rendimiento']['cpu']['uso_porcentaje']
-        if cpu_uso < 30:
-            condiciones['ventilacion'] = {
-                'descripcion': 'Excelente ventilación, hongos aireados y porosos.',
-                'densidad': 'estructuras abiertas con lamelas visibles'
-            }
-        elif cpu_uso < 70:
-            condiciones['ventilacion'] = {
-                'descripcion': 'Ventilación adecuada, crecimiento saludable.',
-                'densidad': 'textura estándar, bien oxigenados'
-            }
-        else:
-            condiciones['ventilacion'] = {
-                'descripcion': 'Ventilación limitada, hongos densos y compactos.',
-                'densidad': 'moho compacto, falta de oxígeno visible'
-            }
+        Returns:
+            el prompt
+        """
+        limite = _presupuesto(max_caracteres, max_tokens)
+        if limite is None and firma_anterior is None:
+            return self.generar_prompt_completo(parametros, salud_general)
         
-        # DENSIDAD POBLACIONAL (RAM)
-        ram = params['rendimiento']['ram']['uso_porcentaje']
-        if ram < 40:
-            condiciones['densidad'] = {
-                'descripcion': 'Baja densidad, hongos espaciados con mucho sustrato visible.',
-                'distribucion': 'colonias individuales bien separadas'
-            }
-        elif ram < 70:
-            condiciones['densidad'] = {
-                'descripcion': 'Densidad moderada, colonia establecida.',
-                'distribucion': 'hongos agrupados pero con espacio entre ellos'
-            }
-        else:
-            condiciones['densidad'] = {
-                'descripcion': 'Alta densidad, hongos apiñados y compitiendo por espacio.',
-                'distribucion': 'sobrepoblación, hongos creciendo unos sobre otros'
-            }
+        firma = self.firma_condiciones(parametros, salud_general)
+        secciones = self._secciones(firma, self._valores_interpolados(parametros, salud_general))
+        elegidas = {clave: completa for clave, completa, _ in secciones}
+        condensadas = {clave: condensada for clave, _, condensada in secciones}
         
-        # ESPACIO VITAL (Almacenamiento)
-        disco = params['rendimiento']['almacenamiento']['uso_porcentaje']
-        if disco < 50:
-            condiciones['espacio'] = {
-                'descripcion': 'Amplio espacio disponible, territorio expandido.',
-                'crecimiento': 'hongos pueden crecer libremente en todas direcciones'
-            }
-        elif disco < 80:
-            condiciones['espacio'] = {
-                'descripcion': 'Espacio moderado, colonia establecida con límites.',
-                'crecimiento': 'crecimiento vertical, optimizando espacio'
-            }
-        else:
-            condiciones['espacio'] = {
-                'descripcion': 'Espacio crítico, hongos fosilizados en capas.',
-                'crecimiento': 'estratificación visible, sin espacio para nuevos brotes'
-            }
+        def armar():
+            return _unir(elegidas[clave] for clave, _, _ in secciones if clave in elegidas)
         
-        # METABOLISMO (CPU)
-        if cpu_uso < 30:
-            condiciones['metabolismo'] = {
-                'descripcion': 'Metabolismo en reposo, colonia dormida.',
-                'intensidad': 'tonos pasteles suaves, sin actividad visible'
-            }
-        elif cpu_uso < 70:
-            condiciones['metabolismo'] = {
-                'descripcion': 'Metabolismo activo, crecimiento visible.',
-                'intensidad': 'colores saturados, señales de vida activa'
-            }
-        else:
-            condiciones['metabolismo'] = {
-                'descripcion': 'Metabolismo acelerado, actividad intensa.',
-                'intensidad': 'colores brillantes pulsantes, energía visible'
-            }
+        if firma_anterior is not None:
+            cambiadas = {dimension for dimension, bucket, anterior in zip(UMBRALES_CONDICIONES, firma, firma_anterior)
+                         if bucket != anterior}
+            # La API no recuerda la imagen anterior: lo que no cambió se describe breve, no se omite
+            for clave in list(elegidas):
+                if clave in cambiadas or clave == 'salud':
+                    continue
+                if condensadas[clave] is None:
+                    del elegidas[clave]
+                else:
+                    elegidas[clave] = condensadas[clave]
         
-        # SALUD GENERAL
-        if salud > 80:
-            condiciones['salud'] = {
-                'descripcion': 'Ecosistema saludable y próspero, sin señales de estrés.'
-            }
-        elif salud > 60:
-            condiciones['salud'] = {
-                'descripcion': 'Ecosistema moderadamente saludable, algunas áreas de estrés.'
-            }
-        elif salud > 40:
-            condiciones['salud'] = {
-                'descripcion': 'Ecosistema bajo estrés, señales visibles de deterioro.'
-            }
-        else:
-            condiciones['salud'] = {
-                'descripcion': 'Ecosistema crítico, colonia en peligro con múltiples problemas.'
-            }
+        if limite is not None:
+            por_prioridad = sorted(elegidas, key=PRIORIDADES_SECCIONES.get)
+            # Primero se condensa (o se quita, si no tiene forma condensada) de menor a mayor prioridad
+            for clave in por_prioridad:
+                if len(armar()) <= limite:
+                    break
+                if condensadas[clave] is not None:
+                    elegidas[clave] = condensadas[clave]
+                elif clave not in SECCIONES_OBLIGATORIAS:
+                    del elegidas[clave]
+            for clave in [clave for clave in por_prioridad if clave in elegidas]:
+                if len(armar()) <= limite:
+                    break
+                if clave not in SECCIONES_OBLIGATORIAS:
+                    del elegidas[clave]
+        
+        prompt = armar()
+        return prompt if limite is None else recortar_prompt(prompt, limite)
+    
+    def _analizar_condiciones(self, params, salud):
+        """Analiza parámetros y genera descripciones biológicas"""
+        return self._condiciones_de_firma(self.firma_condiciones(params, salud))
+    
+    def _condiciones_de_firma(self, firma):
+        """Descripciones biológicas correspondientes a una firma de buckets"""
+        condiciones = {}
+        for dimension, bucket in zip(UMBRALES_CONDICIONES, firma):
+            condicion = dict(DESCRIPCIONES_CONDICIONES[dimension][bucket])
+            if 'paleta' in condicion:
+                condicion['colores'] = self.mapeo_colores[condicion.pop('paleta')]
+            condiciones[dimension] = condicion
         
         return condiciones
+    
+    def analizar_condiciones_lote(self, columnas):
+        """
+        Versión vectorizada de _analizar_condiciones para muchas muestras (requiere NumPy)
+        
+        Returns:
+            dict dimensión -> array con el índice de bucket de cada muestra
+            (índices de DESCRIPCIONES_CONDICIONES)
+        """
+        from evaluacion_lote import clasificar_condiciones_lote
+        return clasificar_condiciones_lote(columnas)
 
 
 # Función de prueba
@@ -236,4 +512,14 @@ if __name__ == "__main__":
     prompt = generador.generar_prompt_completo(params_ejemplo, 62)
     
     print("=== PROMPT GENERADO ===")
-    print(prompt)
\ No newline at end of file
+    print(prompt)
+    
+    print("\n=== PRESUPUESTOS ===")
+    for max_tokens in (400, 250, 100):
+        ajustado = generador.generar_prompt(params_ejemplo, 62, max_tokens=max_tokens)
+        print(f"{max_tokens} tokens: {len(prompt)} -> {len(ajustado)} caracteres")
+    
+    firma = generador.firma_condiciones(params_ejemplo, 62)
+    params_ejemplo['hardware']['temperatura']['cpu'] = 90
+    print("\n=== COMPACTO (solo cambió la temperatura) ===")
+    print(generador.generar_prompt(params_ejemplo, 62, firma_anterior=firma))
@@ -0,0 +1,194 @@
+"""
+Osmotrofia - Historial de Generaciones
+Historial persistente en SQLite, indexado y paginado
+"""
+
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import weakref
+
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS generaciones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    creado REAL NOT NULL,
+    timestamp TEXT,
+    proveedor TEXT NOT NULL,
+    exito INTEGER NOT NULL,
+    archivo_prompt TEXT,
+    archivo_imagen TEXT,
+    error TEXT,
+    datos TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_generaciones_creado ON generaciones (creado);
+CREATE INDEX IF NOT EXISTS idx_generaciones_proveedor ON generaciones (proveedor, id);
+CREATE INDEX IF NOT EXISTS idx_generaciones_exito ON generaciones (exito, id);
+"""
+
+# Resultados por transacción, y segundos máximos que uno espera en memoria a completar el lote
+TAMANO_LOTE = 16
+ESPERA_LOTE = 5.0
+
+
+def _vaciar_al_salir(referencia):
+    historial = referencia()
+    if historial is not None:
+        historial.vaciar()
+
+
+class HistorialGeneraciones:
+    """
+    Historial de resultados de generación guardado en SQLite (modo WAL).
+    
+    Los resultados completos (incluida la descripción mejorada) viven en disco;
+    las consultas devuelven páginas acotadas en lugar de la lista entera.
+    
+    Las inserciones se agrupan en lotes: un lote se escribe al llenarse, a los
+    `espera_lote` segundos de su primer resultado, antes de cada consulta, en
+    cerrar() y al terminar el intérprete.
+    """
+    
+    def __init__(self, ruta=':memory:', tamano_lote=TAMANO_LOTE, espera_lote=ESPERA_LOTE):
+        """
+        Args:
+            ruta: Archivo de la base de datos (':memory:' para un historial efímero)
+            tamano_lote: Cantidad de resultados a acumular antes de insertarlos en una transacción
+            espera_lote: Segundos máximos que un resultado espera a que se complete el lote
+        """
+        self.ruta = ruta
+        self.tamano_lote = max(1, tamano_lote)
+        self.espera_lote = espera_lote
+        self._pendientes = []
+        self._temporizador = None
+        self._cerrado = False
+        self._lock = threading.Lock()
+        # Sin cerrar() explícito (p. ej. un sys.exit en medio del monitoreo) el lote no se pierde
+        atexit.register(_vaciar_al_salir, weakref.ref(self))
+        
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute('PRAGMA journal_mode=WAL')
+        self._conexion.execute('PRAGMA synchronous=NORMAL')
+        self._conexion.executescript(ESQUEMA)
+    
+    @staticmethod
+    def _fila(resultado, proveedor):
+        return (
+            time.time(),
+            resultado.get('timestamp'),
+            proveedor,
+            1 if resultado.get('exito') else 0,
+            resultado.get('archivo_prompt'),
+            resultado.get('archivo_imagen'),
+            resultado.get('error'),
+            json.dumps(resultado, ensure_ascii=False, default=str)
+        )
+    
+    def agregar(self, resultado, proveedor):
+        """Registra un resultado; se inserta al completar el lote"""
+        fila = self._fila(resultado, proveedor)
+        with self._lock:
+            self._pendientes.append(fila)
+            if len(self._pendientes) >= self.tamano_lote:
+                self._vaciar()
+            elif self._temporizador is None:
+                self._temporizador = threading.Timer(self.espera_lote, self.vaciar)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+    
+    def agregar_lote(self, resultados, proveedor):
+        """Registra varios resultados en una sola transacción"""
+        filas = [self._fila(resultado, proveedor) for resultado in resultados]
+        with self._lock:
+            self._pendientes.extend(filas)
+            self._vaciar()
+    
+    def vaciar(self):
+        """Inserta los resultados pendientes"""
+        with self._lock:
+            self._vaciar()
+    
+    def _vaciar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        if not self._pendientes or self._cerrado:
+            return
+        with self._conexion:
+            self._conexion.executemany(
+                'INSERT INTO generaciones '
+                '(creado, timestamp, proveedor, exito, archivo_prompt, archivo_imagen, error, datos) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                self._pendientes
+            )
+        self._pendientes = []
+    
+    def _consultar(self, condiciones, parametros, orden, limite):
+        self.vaciar()
+        sql = 'SELECT id, datos FROM generaciones'
+        if condiciones:
+            sql += ' WHERE ' + ' AND '.join(condiciones)
+        sql += f' ORDER BY id {orden} LIMIT ?'
+        with self._lock:
+            filas = self._conexion.execute(sql, (*parametros, limite)).fetchall()
+        resultados = []
+        for id_, datos in filas:
+            resultado = json.loads(datos)
+            resultado['id'] = id_
+            resultados.append(resultado)
+        return resultados
+    
+    @staticmethod
+    def _filtros(proveedor, exito):
+        condiciones, parametros = [], []
+        if proveedor is not None:
+            condiciones.append('proveedor = ?')
+            parametros.append(proveedor)
+        if exito is not None:
+            condiciones.append('exito = ?')
+            parametros.append(1 if exito else 0)
+        return condiciones, parametros
+    
+    def ultimos(self, n=20, antes_de=None, proveedor=None, exito=None):
+        """
+        Página con las últimas n generaciones, en orden cronológico
+        
+        Args:
+            n: Tamaño de página
+            antes_de: id a partir del cual paginar hacia atrás (el 'id' más viejo de la página anterior)
+            proveedor: Filtrar por proveedor ('gemini', 'openai', ...)
+            exito: Filtrar por éxito (True/False)
+        """
+        condiciones, parametros = self._filtros(proveedor, exito)
+        if antes_de is not None:
+            condiciones.append('id < ?')
+            parametros.append(antes_de)
+        return list(reversed(self._consultar(condiciones, parametros, 'DESC', n)))
+    
+    def rango(self, desde, hasta=None, limite=100, proveedor=None, exito=None):
+        """Generaciones entre dos instantes epoch (hasta incluido), en orden cronológico"""
+        condiciones, parametros = self._filtros(proveedor, exito)
+        condiciones.append('creado >= ?')
+        parametros.append(desde)
+        if hasta is not None:
+            condiciones.append('creado <= ?')
+            parametros.append(hasta)
+        return self._consultar(condiciones, parametros, 'ASC', limite)
+    
+    def contar(self, proveedor=None, exito=None):
+        """Cantidad de generaciones registradas"""
+        self.vaciar()
+        condiciones, parametros = self._filtros(proveedor, exito)
+        sql = 'SELECT COUNT(*) FROM generaciones'
+        if condiciones:
+            sql += ' WHERE ' + ' AND '.join(condiciones)
+        with self._lock:
+            return self._conexion.execute(sql, parametros).fetchone()[0]
+    
+    def cerrar(self):
+        with self._lock:
+            self._vaciar()
+            self._cerrado = True
+            self._conexion.close()
@@ -0,0 +1,312 @@
+"""
+Osmotrofia - Limitador de Tasa
+Cubetas de tokens por API key y modelo (solicitudes/min y tokens/min), compartibles entre procesos
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from metricas import observar
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Estado compartido por todos los procesos de la máquina, sin importar su directorio
+RUTA_ESTADO = os.path.join(tempfile.gettempdir(), 'osmotrofia_limites.json')
+
+# Caracteres por token para estimar el costo de un prompt antes de enviarlo
+CARACTERES_POR_TOKEN = 4
+
+
+def estimar_tokens(texto):
+    """Estimación de tokens de un texto (sin tokenizador: ~4 caracteres por token)"""
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+
+class CubetaTokens:
+    """
+    Cubeta de tokens: se llena a `tasa` unidades por segundo hasta `capacidad`
+    
+    Un pedido mayor que la capacidad se concede con la cubeta llena y la deja
+    en negativo, así no queda bloqueado para siempre.
+    """
+    
+    def __init__(self, capacidad, tasa, nivel=None):
+        self.capacidad = capacidad
+        self.tasa = tasa
+        self.nivel = capacidad if nivel is None else nivel
+    
+    def recargar(self, segundos):
+        self.nivel = min(self.capacidad, self.nivel + max(segundos, 0) * self.tasa)
+    
+    def espera(self, cantidad):
+        """Segundos hasta poder consumir `cantidad` (0 si ya se puede)"""
+        necesario = min(cantidad, self.capacidad)
+        if self.nivel >= necesario:
+            return 0.0
+        return (necesario - self.nivel) / self.tasa
+
+
+class _BloqueoArchivo:
+    """Bloqueo exclusivo entre procesos sobre un archivo (flock, o msvcrt en Windows)"""
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = None
+    
+    def __enter__(self):
+        self._archivo = open(self.ruta, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._archivo.fileno(), fcntl.LOCK_EX)
+        else:
+            self._archivo.seek(0)
+            msvcrt.locking(self._archivo.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+    
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._archivo.fileno(), fcntl.LOCK_UN)
+            else:
+                self._archivo.seek(0)
+                msvcrt.locking(self._archivo.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._archivo.close()
+        return False
+
+
+class LimitadorTasa:
+    """
+    Limita las llamadas a un proveedor según sus cupos de solicitudes y tokens por minuto.
+    
+    La clave es (proveedor, hash de la API key, modelo): los procesos que comparten
+    una key comparten el cupo. Con `compartido=True` el estado de las cubetas vive
+    en un archivo JSON protegido con un bloqueo de archivo, así varios monitores
+    en la misma máquina no superan juntos el límite. Las llamadas que no tienen
+    cupo esperan (en orden de llegada dentro del proceso) en lugar de fallar.
+    
+    Cada cubeta acumula a lo sumo `rafaga_segundos` de cupo, para que tras un rato
+    sin uso no salga una ráfaga de un minuto entero que el proveedor cortaría con 429.
+    """
+    
+    def __init__(self, proveedor, api_key, modelo, rpm=None, tpm=None, rafaga_segundos=10,
+                 compartido=True, ruta_estado=RUTA_ESTADO, reloj=time.time):
+        """
+        Args:
+            proveedor: Nombre del proveedor ('gemini', 'openai')
+            api_key: API key (solo se guarda un hash)
+            modelo: Modelo al que aplican los límites
+            rpm: Solicitudes por minuto (None = sin límite)
+            tpm: Tokens por minuto (None = sin límite)
+            rafaga_segundos: Segundos de cupo que puede acumular cada cubeta
+            compartido: Compartir el cupo con otros procesos a través de `ruta_estado`
+            ruta_estado: Archivo JSON con el estado de las cubetas
+            reloj: Función de tiempo de pared (comparable entre procesos)
+        """
+        if rpm is None and tpm is None:
+            raise ValueError("El limitador necesita rpm, tpm o ambos")
+        huella = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+        self.clave = f'{proveedor}:{huella}:{modelo}'
+        self.nombre = f'{proveedor}/{modelo}'
+        self.rpm = rpm
+        self.tpm = tpm
+        self.compartido = compartido
+        self.ruta_estado = ruta_estado
+        self._reloj = reloj
+        self._cubetas = {}
+        for nombre, por_minuto in (('solicitudes', rpm), ('tokens', tpm)):
+            if por_minuto is not None:
+                tasa = por_minuto / 60
+                self._cubetas[nombre] = CubetaTokens(max(1, tasa * rafaga_segundos), tasa)
+        self._actualizado = reloj()
+        self._pausado_hasta = 0.0
+        # Un solo pedido en espera a la vez por proceso: los demás hacen cola detrás
+        self._cola = threading.Lock()
+        # Lo mismo para las corrutinas; el asyncio.Lock pertenece a un event loop
+        self._cola_async = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def desde_entorno(cls, proveedor, api_key, modelo, **kwargs):
+        """
+        Limitador configurado con <PROVEEDOR>_RPM y <PROVEEDOR>_TPM (p. ej. GEMINI_RPM=10),
+        o None si no hay ninguno definido
+        """
+        prefijo = proveedor.upper()
+        rpm, tpm = os.getenv(f'{prefijo}_RPM'), os.getenv(f'{prefijo}_TPM')
+        if not rpm and not tpm:
+            return None
+        return cls(proveedor, api_key, modelo, rpm=float(rpm) if rpm else None,
+                   tpm=float(tpm) if tpm else None, **kwargs)
+    
+    def _transaccion(self, operacion):
+        """Aplica `operacion()` sobre el estado actualizado (y compartido, si corresponde)"""
+        with self._lock:
+            if not self.compartido:
+                self._recargar()
+                return operacion()
+            with _BloqueoArchivo(self.ruta_estado + '.lock'):
+                estados = self._leer_estados()
+                self._cargar(estados.get(self.clave))
+                self._recargar()
+                resultado = operacion()
+                estados[self.clave] = self._volcar()
+                self._escribir_estados(estados)
+                return resultado
+    
+    def _leer_estados(self):
+        try:
+            with open(self.ruta_estado, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _escribir_estados(self, estados):
+        temporal = f'{self.ruta_estado}.{os.getpid()}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(estados, f)
+        os.replace(temporal, self.ruta_estado)
+    
+    def _cargar(self, estado):
+        if not estado:
+            return
+        self._actualizado = estado['actualizado']
+        self._pausado_hasta = estado.get('pausado_hasta', 0.0)
+        for nombre, cubeta in self._cubetas.items():
+            if nombre in estado:
+                cubeta.nivel = min(estado[nombre], cubeta.capacidad)
+    
+    def _volcar(self):
+        estado = {'actualizado': self._actualizado, 'pausado_hasta': self._pausado_hasta}
+        estado.update({nombre: cubeta.nivel for nombre, cubeta in self._cubetas.items()})
+        return estado
+    
+    def _recargar(self):
+        ahora = self._reloj()
+        for cubeta in self._cubetas.values():
+            cubeta.recargar(ahora - self._actualizado)
+        self._actualizado = max(self._actualizado, ahora)
+    
+    def _intentar(self, tokens):
+        """Consume el cupo si alcanza; devuelve 0, o los segundos a esperar antes de volver a probar"""
+        def operacion():
+            pedidos = {'solicitudes': 1, 'tokens': tokens}
+            espera = max(self._pausado_hasta - self._actualizado,
+                         *(cubeta.espera(pedidos[nombre]) for nombre, cubeta in self._cubetas.items()))
+            if espera > 0:
+                return espera
+            for nombre, cubeta in self._cubetas.items():
+                cubeta.nivel -= pedidos[nombre]
+            return 0.0
+        
+        return self._transaccion(operacion)
+    
+    def adquirir(self, tokens=0):
+        """
+        Espera hasta tener cupo para una solicitud de `tokens` tokens y lo consume
+        
+        Returns:
+            segundos esperados
+        """
+        inicio = self._reloj()
+        with self._cola:
+            while True:
+                espera = self._intentar(tokens)
+                if not espera:
+                    break
+                self._avisar(espera)
+                time.sleep(espera)
+        return self._registrar_espera(inicio)
+    
+    def _cola_del_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._cola_async is None or self._cola_async[0] is not loop:
+            self._cola_async = (loop, asyncio.Lock())
+        return self._cola_async[1]
+    
+    async def adquirir_async(self, tokens=0):
+        """
+        Como adquirir(), sin bloquear el event loop
+        
+        Las corrutinas esperan en orden de llegada detrás de un asyncio.Lock, y la
+        transacción (que toma el bloqueo de archivo) corre en un hilo.
+        """
+        inicio = self._reloj()
+        async with self._cola_del_loop():
+            while True:
+                espera = await asyncio.to_thread(self._intentar, tokens)
+                if not espera:
+                    break
+                self._avisar(espera)
+                await asyncio.sleep(espera)
+        return self._registrar_espera(inicio)
+    
+    def _avisar(self, espera):
+        if espera >= 1:
+            print(f"🚦 Cupo de {self.nombre} agotado: esperando {espera:.1f}s")
+    
+    def _registrar_espera(self, inicio):
+        esperado = max(self._reloj() - inicio, 0.0)
+        observar('limitador_espera_segundos', esperado, limitador=self.nombre)
+        return esperado
+    
+    def pausar(self, segundos):
+        """Frena a todos los que comparten el cupo (p. ej. tras un 429 con Retry-After)"""
+        def operacion():
+            self._pausado_hasta = max(self._pausado_hasta, self._actualizado + segundos)
+        
+        self._transaccion(operacion)
+    
+    def holgura(self):
+        """
+        Cupo disponible ahora
+        
+        Returns:
+            dict con las solicitudes y tokens disponibles, los límites por minuto
+            y los segundos hasta que la próxima solicitud tenga cupo
+        """
+        def operacion():
+            holgura = {'limitador': self.nombre, 'rpm': self.rpm, 'tpm': self.tpm}
+            for nombre, cubeta in self._cubetas.items():
+                holgura[f'{nombre}_disponibles'] = max(0, math.floor(cubeta.nivel))
+            esperas = [cubeta.espera(1) for cubeta in self._cubetas.values()]
+            holgura['espera_s'] = round(max(self._pausado_hasta - self._actualizado, *esperas, 0.0), 2)
+            return holgura
+        
+        return self._transaccion(operacion)
+
+
+# Función de prueba
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    
+    print("=== PRUEBA DEL LIMITADOR DE TASA ===")
+    
+    ruta = os.path.join(tempfile.mkdtemp(), 'limites.json')
+    # 120 solicitudes/min = 2/s, con 1 s de ráfaga
+    limitador = LimitadorTasa('prueba', 'clave', 'modelo', rpm=120, tpm=6000, rafaga_segundos=1, ruta_estado=ruta)
+    print(f"Holgura inicial: {limitador.holgura()}")
+    
+    inicio = time.time()
+    instantes = []
+    
+    def llamada(_):
+        limitador.adquirir(tokens=40)
+        instantes.append(time.time() - inicio)
+    
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(llamada, range(10)))
+    
+    print(f"10 llamadas de 4 hilos en {instantes[-1]:.2f}s (≈ 2/s tras la ráfaga):")
+    print("  " + " ".join(f"{t:.2f}" for t in sorted(instantes)))
+    print(f"Holgura final: {limitador.holgura()}")
@@ -0,0 +1,311 @@
+"""
+Osmotrofia - Métricas
+Spans de tiempo por etapa, histogramas y exportación en formato Prometheus y JSON
+"""
+
+import functools
+import json
+import threading
+import time
+from bisect import bisect_left
+
+
+# Límites superiores (s) de los buckets de los histogramas de duración
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIJO = 'osmotrofia'
+
+
+class Histograma:
+    """Histograma acumulativo de buckets fijos (como los de Prometheus)"""
+    
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = tuple(buckets)
+        self.cuentas = [0] * (len(self.buckets) + 1)  # el último es +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+        self.maximo = 0.0
+    
+    def observar(self, valor):
+        self.cuentas[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+        if valor > self.maximo:
+            self.maximo = valor
+    
+    def percentil(self, q):
+        """Estimación del percentil q (0-1) interpolando dentro del bucket"""
+        if not self.cantidad:
+            return None
+        objetivo = q * self.cantidad
+        acumulado = 0
+        for i, cuenta in enumerate(self.cuentas):
+            if acumulado + cuenta >= objetivo and cuenta:
+                inferior = self.buckets[i - 1] if i > 0 else 0.0
+                superior = self.buckets[i] if i < len(self.buckets) else self.maximo
+                return inferior + (superior - inferior) * (objetivo - acumulado) / cuenta
+            acumulado += cuenta
+        return self.maximo
+    
+    def resumen(self):
+        return {
+            'cantidad': self.cantidad,
+            'suma': self.suma,
+            'promedio': self.suma / self.cantidad if self.cantidad else None,
+            'p50': self.percentil(0.5),
+            'p95': self.percentil(0.95),
+            'p99': self.percentil(0.99),
+            'maximo': self.maximo
+        }
+
+
+class _SpanNulo:
+    """Span que no hace nada: lo que se usa con las métricas deshabilitadas"""
+    
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def etiqueta(self, nombre, valor):
+        pass
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+class Span:
+    """Mide la duración de un bloque y la registra al salir"""
+    
+    __slots__ = ('_metricas', '_nombre', '_etiquetas', '_inicio')
+    
+    def __init__(self, metricas, nombre, etiquetas):
+        self._metricas = metricas
+        self._nombre = nombre
+        self._etiquetas = etiquetas
+    
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+    
+    def __exit__(self, tipo, valor, traza):
+        duracion = time.perf_counter() - self._inicio
+        if tipo is not None:
+            self._etiquetas['resultado'] = 'excepcion'
+        self._metricas.observar('span_segundos', duracion, span=self._nombre, **self._etiquetas)
+        return False
+    
+    def etiqueta(self, nombre, valor):
+        """Agrega una etiqueta conocida recién dentro del bloque (p. ej. el resultado)"""
+        self._etiquetas[nombre] = valor
+
+
+class Metricas:
+    """
+    Registro de histogramas y contadores etiquetados.
+    
+    Deshabilitado, span() devuelve un span nulo compartido y observar()/contar()
+    retornan tras comprobar un booleano: el costo es una llamada a función.
+    """
+    
+    def __init__(self, habilitado=False):
+        self.habilitado = habilitado
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._contadores = {}
+    
+    def habilitar(self):
+        self.habilitado = True
+    
+    def deshabilitar(self):
+        self.habilitado = False
+    
+    def reiniciar(self):
+        with self._lock:
+            self._histogramas.clear()
+            self._contadores.clear()
+    
+    @staticmethod
+    def _clave(nombre, etiquetas):
+        return nombre, tuple(sorted(etiquetas.items()))
+    
+    def span(self, nombre, **etiquetas):
+        """Context manager que registra la duración del bloque en el histograma 'span_segundos'"""
+        if not self.habilitado:
+            return _SPAN_NULO
+        return Span(self, nombre, etiquetas)
+    
+    def observar(self, nombre, valor, **etiquetas):
+        """Agrega un valor (en segundos) a un histograma"""
+        if not self.habilitado:
+            return
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+    
+    def contar(self, nombre, cantidad=1, **etiquetas):
+        """Incrementa un contador"""
+        if not self.habilitado:
+            return
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+    
+    def cronometrado(self, nombre, **etiquetas):
+        """Decorador: registra cada llamada a la función como un span"""
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                if not self.habilitado:
+                    return funcion(*args, **kwargs)
+                with Span(self, nombre, dict(etiquetas)):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+    
+    def a_dict(self):
+        """Snapshot serializable: resúmenes de histogramas y valores de contadores"""
+        with self._lock:
+            return {
+                'histogramas': [
+                    {'nombre': nombre, 'etiquetas': dict(etiquetas), **histograma.resumen()}
+                    for (nombre, etiquetas), histograma in sorted(self._histogramas.items())
+                ],
+                'contadores': [
+                    {'nombre': nombre, 'etiquetas': dict(etiquetas), 'valor': valor}
+                    for (nombre, etiquetas), valor in sorted(self._contadores.items())
+                ]
+            }
+    
+    def volcar_json(self, ruta):
+        """Escribe a_dict() en un archivo JSON"""
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(self.a_dict(), f, indent=2, ensure_ascii=False)
+    
+    def a_prometheus(self):
+        """Exposición en formato de texto de Prometheus (versión 0.0.4)"""
+        lineas = []
+        with self._lock:
+            # Copia de los valores para no leer un histograma a medio actualizar
+            histogramas = [(clave, h.buckets, list(h.cuentas), h.suma, h.cantidad)
+                           for clave, h in sorted(self._histogramas.items())]
+            contadores = sorted(self._contadores.items())
+        
+        anterior = None
+        for (nombre, etiquetas), buckets, cuentas, suma, cantidad in histogramas:
+            metrica = f'{PREFIJO}_{nombre}'
+            if nombre != anterior:
+                lineas.append(f'# TYPE {metrica} histogram')
+                anterior = nombre
+            acumulado = 0
+            limites = [_numero(b) for b in buckets] + ['+Inf']
+            for limite, cuenta in zip(limites, cuentas):
+                acumulado += cuenta
+                lineas.append(f'{metrica}_bucket{_etiquetas(etiquetas, le=limite)} {acumulado}')
+            lineas.append(f'{metrica}_sum{_etiquetas(etiquetas)} {suma!r}')
+            lineas.append(f'{metrica}_count{_etiquetas(etiquetas)} {cantidad}')
+        
+        anterior = None
+        for (nombre, etiquetas), valor in contadores:
+            metrica = f'{PREFIJO}_{nombre}_total'
+            if nombre != anterior:
+                lineas.append(f'# TYPE {metrica} counter')
+                anterior = nombre
+            lineas.append(f'{metrica}{_etiquetas(etiquetas)} {valor}')
+        
+        return '\n'.join(lineas) + '\n'
+    
+    def servir(self, puerto=9464, host='127.0.0.1'):
+        """
+        Expone /metrics (Prometheus) y /metrics.json en un hilo de fondo
+        
+        Returns:
+            el ThreadingHTTPServer (llamar a shutdown() para detenerlo)
+        """
+        # Import diferido: http.server no entra en el presupuesto de arranque de `analyze`
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        metricas = self
+        
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, formato, *args):
+                pass
+            
+            def do_GET(self):
+                ruta = self.path.split('?')[0]
+                if ruta == '/metrics':
+                    cuerpo, tipo = metricas.a_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+                elif ruta == '/metrics.json':
+                    cuerpo, tipo = json.dumps(metricas.a_dict(), ensure_ascii=False), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                cuerpo = cuerpo.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', tipo)
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+        
+        servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, name='metricas', daemon=True).start()
+        return servidor
+
+
+def _numero(valor):
+    return repr(float(valor))
+
+
+def _etiquetas(etiquetas, **extra):
+    pares = list(etiquetas) + list(extra.items())
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + '}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# Registro global que usan los módulos de la aplicación
+METRICAS = Metricas()
+span = METRICAS.span
+observar = METRICAS.observar
+contar = METRICAS.contar
+cronometrado = METRICAS.cronometrado
+
+
+# Función de prueba
+if __name__ == "__main__":
+    import random
+    
+    print("=== PRUEBA DE MÉTRICAS ===")
+    
+    inicio = time.perf_counter()
+    for _ in range(100_000):
+        with span('nada'):
+            pass
+    print(f"Span deshabilitado: {(time.perf_counter() - inicio) * 10:.3f} µs por span")
+    
+    METRICAS.habilitar()
+    inicio = time.perf_counter()
+    for _ in range(100_000):
+        with span('nada'):
+            pass
+    print(f"Span habilitado:    {(time.perf_counter() - inicio) * 10:.3f} µs por span")
+    
+    for _ in range(200):
+        with span('proveedor.intento', proveedor='gemini') as s:
+            time.sleep(random.uniform(0, 0.002))
+            s.etiqueta('resultado', 'ok')
+    contar('reintentos', proveedor='gemini')
+    
+    print()
+    print(METRICAS.a_prometheus()[:1200])
@@ -5,34 +5,312 @@ Captura parámetros del sistema para mapearlos a características de hongos
 
 import psutil
 import platform
+import copy
+import threading
 import time
+from collections import deque
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeout
 from datetime import datetime
 
+from metricas import cronometrado
+from tabla_procesos import TablaProcesos
+
+
+def tiempos_cpu():
+    """Devuelve (tiempo_ocupado, tiempo_total) acumulados de la CPU"""
+    tiempos = psutil.cpu_times()
+    total = sum(tiempos)
+    # En Linux guest/guest_nice ya están contados dentro de user/nice
+    total -= getattr(tiempos, 'guest', 0) + getattr(tiempos, 'guest_nice', 0)
+    inactivo = tiempos.idle + getattr(tiempos, 'iowait', 0)
+    return total - inactivo, total
+
+
+class ColectorPsutil:
+    """Backend de lecturas crudas basado en psutil (funciona en cualquier SO)"""
+    
+    nombre = 'psutil'
+    
+    def tiempos_cpu(self):
+        return tiempos_cpu()
+    
+    def nucleos(self):
+        return psutil.cpu_count()
+    
+    def frecuencia_cpu(self):
+        frecuencia = psutil.cpu_freq()
+        return frecuencia.current if frecuencia else 0
+    
+    def memoria(self):
+        memoria = psutil.virtual_memory()
+        return {'porcentaje': memoria.percent, 'total': memoria.total, 'disponible': memoria.available}
+    
+    def disco(self, ruta='/'):
+        disco = psutil.disk_usage(ruta)
+        return {'porcentaje': disco.percent, 'total': disco.total, 'libre': disco.free}
+    
+    def temperatura_cpu(self):
+        """Temperatura de CPU en °C, o None si no hay sensor"""
+        if hasattr(psutil, 'sensors_temperatures'):
+            temps = psutil.sensors_temperatures()
+            if temps:
+                # Buscar temperatura de CPU
+                for nombre, entradas in temps.items():
+                    if 'coretemp' in nombre.lower() or 'cpu' in nombre.lower():
+                        if entradas:
+                            return entradas[0].current
+        return None
+    
+    def bateria(self):
+        """(porcentaje, conectado) de la batería, o None si no hay batería"""
+        bateria = psutil.sensors_battery()
+        if bateria is None:
+            return None
+        return bateria.percent, bateria.power_plugged
+
+
+def crear_colector(backend='psutil'):
+    """
+    Crea el backend de lecturas
+    
+    Args:
+        backend: 'psutil', 'proc' (lectura directa de /proc y /sys, solo Linux)
+                 o 'auto' (proc si está disponible, si no psutil)
+    """
+    if backend == 'psutil':
+        return ColectorPsutil()
+    
+    from colector_proc import ColectorProc, proc_disponible
+    if backend == 'proc':
+        return ColectorProc()
+    if backend == 'auto':
+        return ColectorProc() if proc_disponible() else ColectorPsutil()
+    raise ValueError(f"Backend de colector desconocido: {backend}")
+
+
+def porcentaje_cpu(inicio, fin):
+    """Uso de CPU (%) entre dos lecturas de tiempos_cpu()"""
+    delta_total = fin[1] - inicio[1]
+    if delta_total <= 0:
+        return 0.0
+    uso = (fin[0] - inicio[0]) / delta_total * 100
+    return round(min(max(uso, 0.0), 100.0), 1)
+
+
+class MuestreadorCPU:
+    """
+    Mantiene caliente una ventana de uso de CPU desde un hilo en segundo plano,
+    para que los snapshots la lean de memoria en lugar de bloquear.
+    """
+    
+    def __init__(self, intervalo=0.25, ventana=1.0, leer_tiempos=None):
+        """
+        Args:
+            intervalo: Segundos entre lecturas de los contadores de CPU
+            ventana: Duración (s) de la ventana sobre la que se calcula el uso
+            leer_tiempos: Función que devuelve (ocupado, total); por defecto tiempos_cpu
+        """
+        self.intervalo = intervalo
+        self.ventana = ventana
+        self._leer_tiempos = leer_tiempos or tiempos_cpu
+        self._muestras = deque()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+    
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+    
+    def iniciar(self):
+        """Arranca el hilo de muestreo (idempotente)"""
+        if self.activo:
+            return
+        self._detener.clear()
+        self._registrar()
+        self._hilo = threading.Thread(target=self._bucle, name='osmotrofia-muestreador-cpu', daemon=True)
+        self._hilo.start()
+    
+    def detener(self):
+        """Detiene el hilo de muestreo y descarta la ventana"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        with self._lock:
+            self._muestras.clear()
+    
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self._registrar()
+            except Exception:
+                pass
+    
+    def _registrar(self):
+        ahora = time.monotonic()
+        muestra = (ahora, self._leer_tiempos())
+        with self._lock:
+            self._muestras.append(muestra)
+            # Conservar solo la muestra más reciente que todavía cubre la ventana completa
+            limite = ahora - self.ventana
+            while len(self._muestras) > 2 and self._muestras[1][0] <= limite:
+                self._muestras.popleft()
+    
+    def uso_cpu(self):
+        """Uso de CPU (%) en la última ventana, o None si todavía no hay dos lecturas"""
+        with self._lock:
+            if len(self._muestras) < 2:
+                return None
+            inicio = self._muestras[0][1]
+            fin = self._muestras[-1][1]
+        return porcentaje_cpu(inicio, fin)
+
+
+# Puntaje de salud por temperatura de CPU: < 60°C -> 100, < 80°C -> 70, resto -> 30
+UMBRALES_SALUD_TEMPERATURA = (60, 80)
+PUNTAJES_SALUD_TEMPERATURA = (100, 70, 30)
+
+
+# Valores que se usan cuando una sección no responde a tiempo en modo concurrente
+SECCIONES_POR_DEFECTO = {
+    'hardware': {
+        'temperatura': {'cpu': 50},
+        'bateria': {'porcentaje': 100, 'conectado': True},
+        'ventiladores': {'activos': False, 'velocidad_estimada': 'baja'}
+    },
+    'software': {
+        'sistema_operativo': {'nombre': platform.system(), 'version': 'desconocida', 'actualizado': 'desconocido'},
+        'procesos': {'total': 0, 'innecesarios': 0, 'pesados': 0},
+        'seguridad': {'antivirus_activo': False, 'firewall': 'desconocido'}
+    },
+    'rendimiento': {
+        'cpu': {'uso_porcentaje': 0, 'nucleos': 0, 'frecuencia': 0},
+        'ram': {'uso_porcentaje': 0, 'total_gb': 0, 'disponible_gb': 0},
+        'almacenamiento': {'uso_porcentaje': 0, 'total_gb': 0, 'libre_gb': 0}
+    }
+}
+
+
 class MonitorSistema:
-    def __init__(self):
+    def __init__(self, muestreo_fondo=False, intervalo_muestreo=0.25, ventana_cpu=1.0, backend='psutil',
+                 concurrente=False, timeout_seccion=3.0, serie=None):
+        """
+        Args:
+            muestreo_fondo: Si es True, arranca un MuestreadorCPU y los snapshots no bloquean
+            intervalo_muestreo: Segundos entre lecturas del muestreador
+            ventana_cpu: Ventana (s) sobre la que se mide el uso de CPU
+            backend: Origen de las lecturas: 'psutil', 'proc' o 'auto' (ver crear_colector)
+            concurrente: Si es True, hardware, software y rendimiento se recolectan en paralelo
+            timeout_seccion: Segundos máximos por sección en modo concurrente antes de usar
+                             SECCIONES_POR_DEFECTO
+            serie: SerieTemporal opcional donde registrar_muestra acumula los snapshots
+        """
         self.sistema_operativo = platform.system()
+        self.ventana_cpu = ventana_cpu
+        self.colector = crear_colector(backend)
+        self.muestreador = MuestreadorCPU(intervalo_muestreo, ventana_cpu, self.colector.tiempos_cpu)
+        self.tabla_procesos = TablaProcesos()
+        self._lock_procesos = threading.Lock()
+        
+        self.concurrente = concurrente
+        self.timeout_seccion = timeout_seccion
+        self._pool = None
+        self.serie = serie
+        
+        if muestreo_fondo:
+            self.iniciar_muestreo()
+    
+    def cerrar(self):
+        """Detiene el muestreador y libera el pool de hilos"""
+        self.detener_muestreo()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+    
+    def iniciar_muestreo(self):
+        """Activa el muestreo de CPU en segundo plano"""
+        self.muestreador.iniciar()
+    
+    def detener_muestreo(self):
+        """Desactiva el muestreo de CPU en segundo plano"""
+        self.muestreador.detener()
         
+    @cronometrado('monitor.snapshot')
     def obtener_parametros_completos(self):
         """Obtiene todos los parámetros del sistema"""
+        if self.concurrente:
+            return self._obtener_parametros_concurrente()
+        
+        timestamp = datetime.now().isoformat()
+        # Una sola medición de CPU compartida por temperatura, ventiladores y rendimiento
+        cpu_uso = self._medir_cpu()
+        
         return {
-            'timestamp': datetime.now().isoformat(),
-            'hardware': self._obtener_hardware(),
+            'timestamp': timestamp,
+            'hardware': self._obtener_hardware(cpu_uso),
             'software': self._obtener_software(),
-            'rendimiento': self._obtener_rendimiento()
+            'rendimiento': self._obtener_rendimiento(cpu_uso)
         }
     
-    def _obtener_hardware(self):
+    def _obtener_parametros_concurrente(self):
+        """Recolecta las secciones en paralelo; la latencia es la de la sección más lenta"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='osmotrofia-monitor')
+        
+        timestamp = datetime.now().isoformat()
+        inicio = time.monotonic()
+        
+        # La medición de CPU se solapa con el escaneo de procesos
+        futuro_cpu = self._pool.submit(self._medir_cpu)
+        futuros = {
+            'hardware': self._pool.submit(lambda: self._obtener_hardware(futuro_cpu.result())),
+            'software': self._pool.submit(self._obtener_software),
+            'rendimiento': self._pool.submit(lambda: self._obtener_rendimiento(futuro_cpu.result()))
+        }
+        
+        parametros = {'timestamp': timestamp}
+        for seccion, futuro in futuros.items():
+            restante = max(self.timeout_seccion - (time.monotonic() - inicio), 0)
+            try:
+                parametros[seccion] = futuro.result(timeout=restante)
+            except FuturoTimeout:
+                print(f"⚠️  Sección '{seccion}' excedió {self.timeout_seccion}s, usando valores por defecto")
+                parametros[seccion] = copy.deepcopy(SECCIONES_POR_DEFECTO[seccion])
+            except Exception as e:
+                print(f"⚠️  Error en sección '{seccion}': {e}")
+                parametros[seccion] = copy.deepcopy(SECCIONES_POR_DEFECTO[seccion])
+        
+        return parametros
+    
+    @cronometrado('monitor.cpu')
+    def _medir_cpu(self):
+        """Uso de CPU (%): de memoria si el muestreador está activo, si no bloquea una ventana"""
+        if self.muestreador.activo:
+            uso = self.muestreador.uso_cpu()
+            if uso is not None:
+                return uso
+        inicio = self.colector.tiempos_cpu()
+        time.sleep(self.ventana_cpu)
+        return porcentaje_cpu(inicio, self.colector.tiempos_cpu())
+    
+    @cronometrado('monitor.hardware')
+    def _obtener_hardware(self, cpu_uso=None):
         """Parámetros de hardware"""
+        if cpu_uso is None:
+            cpu_uso = self._medir_cpu()
+        
         try:
-            temperatura = self._obtener_temperatura()
+            temperatura = self._obtener_temperatura(cpu_uso)
         except:
             temperatura = {'cpu': 50}  # Valor por defecto si no se puede leer
             
         try:
-            bateria = psutil.sensors_battery()
+            bateria = self.colector.bateria()
             bateria_info = {
-                'porcentaje': bateria.percent if bateria else 100,
-                'conectado': bateria.power_plugged if bateria else True
+                'porcentaje': bateria[0] if bateria else 100,
+                'conectado': bateria[1] if bateria else True
             }
         except:
             bateria_info = {'porcentaje': 100, 'conectado': True}
@@ -40,12 +318,14 @@ class MonitorSistema:
         return {
             'temperatura': temperatura,
             'bateria': bateria_info,
-            'ventiladores': self._estado_ventiladores()
+            'ventiladores': self._estado_ventiladores(cpu_uso)
         }
     
-    def _obtener_software(self):
+    @cronometrado('monitor.software')
+    def _obtener_software(self, escaneo=None):
         """Parámetros de software"""
-        procesos = list(psutil.process_iter(['name', 'memory_percent']))
+        if escaneo is None:
+            escaneo = self._escanear_procesos()
         
         return {
             'sistema_operativo': {
@@ -54,58 +334,52 @@ class MonitorSistema:
                 'actualizado': self._verificar_actualizacion()
             },
             'procesos': {
-                'total': len(procesos),
-                'innecesarios': self._contar_procesos_innecesarios(procesos),
-                'pesados': self._contar_procesos_pesados(procesos)
+                'total': escaneo['total'],
+                'innecesarios': escaneo['innecesarios'],
+                'pesados': escaneo['pesados']
             },
-            'seguridad': self._verificar_seguridad()
+            'seguridad': self._verificar_seguridad(escaneo)
         }
     
-    def _obtener_rendimiento(self):
+    @cronometrado('monitor.rendimiento')
+    def _obtener_rendimiento(self, cpu_uso=None):
         """Parámetros de rendimiento"""
-        cpu = psutil.cpu_percent(interval=1)
-        memoria = psutil.virtual_memory()
-        disco = psutil.disk_usage('/')
+        cpu = cpu_uso if cpu_uso is not None else self._medir_cpu()
+        memoria = self.colector.memoria()
+        disco = self.colector.disco('/')
         
         return {
             'cpu': {
                 'uso_porcentaje': cpu,
-                'nucleos': psutil.cpu_count(),
-                'frecuencia': psutil.cpu_freq().current if psutil.cpu_freq() else 0
+                'nucleos': self.colector.nucleos(),
+                'frecuencia': self.colector.frecuencia_cpu()
             },
             'ram': {
-                'uso_porcentaje': memoria.percent,
-                'total_gb': round(memoria.total / (1024**3), 2),
-                'disponible_gb': round(memoria.available / (1024**3), 2)
+                'uso_porcentaje': memoria['porcentaje'],
+                'total_gb': round(memoria['total'] / (1024**3), 2),
+                'disponible_gb': round(memoria['disponible'] / (1024**3), 2)
             },
             'almacenamiento': {
-                'uso_porcentaje': disco.percent,
-                'total_gb': round(disco.total / (1024**3), 2),
-                'libre_gb': round(disco.free / (1024**3), 2)
+                'uso_porcentaje': disco['porcentaje'],
+                'total_gb': round(disco['total'] / (1024**3), 2),
+                'libre_gb': round(disco['libre'] / (1024**3), 2)
             }
         }
     
-    def _obtener_temperatura(self):
+    def _obtener_temperatura(self, cpu_uso):
         """Intenta obtener temperatura del sistema"""
         try:
-            if hasattr(psutil, 'sensors_temperatures'):
-                temps = psutil.sensors_temperatures()
-                if temps:
-                    # Buscar temperatura de CPU
-                    for nombre, entradas in temps.items():
-                        if 'coretemp' in nombre.lower() or 'cpu' in nombre.lower():
-                            if entradas:
-                                return {'cpu': entradas[0].current}
+            temperatura = self.colector.temperatura_cpu()
+            if temperatura is not None:
+                return {'cpu': temperatura}
             # Si no se puede obtener, estimamos basado en uso de CPU
-            cpu_uso = psutil.cpu_percent(interval=0.5)
             temp_estimada = 40 + (cpu_uso * 0.5)  # Estimación simple
             return {'cpu': round(temp_estimada, 1)}
         except:
             return {'cpu': 50}
     
-    def _estado_ventiladores(self):
+    def _estado_ventiladores(self, cpu_uso):
         """Estado de ventilación (simplificado)"""
-        cpu_uso = psutil.cpu_percent()
         # Estimamos que ventiladores están activos si CPU > 60%
         return {
             'activos': cpu_uso > 60,
@@ -117,56 +391,32 @@ class MonitorSistema:
         # En un caso real, esto requeriría APIs específicas del SO
         return 'desconocido'
     
-    def _contar_procesos_innecesarios(self, procesos):
-        """Cuenta procesos que podrían ser innecesarios"""
-        # Lista simple de procesos comunes innecesarios
-        innecesarios = ['bloatware', 'toolbar', 'updater', 'helper']
-        count = 0
-        for proc in procesos:
-            try:
-                nombre = proc.info['name'].lower()
-                if any(inn in nombre for inn in innecesarios):
-                    count += 1
-            except:
-                pass
-        return count
+    @cronometrado('monitor.procesos')
+    def _escanear_procesos(self):
+        """Actualiza la tabla de procesos y agrega lo que consumen software y seguridad"""
+        # Un escaneo que excedió su timeout puede seguir corriendo en el pool
+        with self._lock_procesos:
+            return self.tabla_procesos.actualizar()
     
-    def _contar_procesos_pesados(self, procesos):
-        """Cuenta procesos que usan mucha memoria"""
-        count = 0
-        for proc in procesos:
-            try:
-                if proc.info['memory_percent'] and proc.info['memory_percent'] > 5:
-                    count += 1
-            except:
-                pass
-        return count
-    
-    def _verificar_seguridad(self):
+    def _verificar_seguridad(self, escaneo):
         """Verifica estado básico de seguridad"""
-        procesos = [p.info['name'].lower() for p in psutil.process_iter(['name'])]
-        
-        # Buscar procesos de antivirus comunes
-        antivirus = ['defender', 'avast', 'avg', 'norton', 'mcafee', 'kaspersky']
-        tiene_antivirus = any(av in str(procesos) for av in antivirus)
-        
         return {
-            'antivirus_activo': tiene_antivirus,
+            'antivirus_activo': escaneo['antivirus_activo'],
             'firewall': 'desconocido'  # Requeriría permisos admin para verificar
         }
     
+    def registrar_muestra(self, parametros, salud):
+        """Agrega el snapshot a la serie temporal, si hay una configurada"""
+        if self.serie is not None:
+            self.serie.agregar_snapshot(parametros, salud)
+    
     def calcular_salud_general(self, parametros):
         """Calcula un score de salud general (0-100)"""
         scores = []
         
         # Hardware
         temp_cpu = parametros['hardware']['temperatura']['cpu']
-        if temp_cpu < 60:
-            scores.append(100)
-        elif temp_cpu < 80:
-            scores.append(70)
-        else:
-            scores.append(30)
+        scores.append(PUNTAJES_SALUD_TEMPERATURA[bisect_right(UMBRALES_SALUD_TEMPERATURA, temp_cpu)])
         
         # Batería
         bateria = parametros['hardware']['bateria']['porcentaje']
@@ -185,6 +435,16 @@ class MonitorSistema:
         scores.append(100 - disco)
         
         return round(sum(scores) / len(scores), 1)
+    
+    def calcular_salud_lote(self, columnas):
+        """
+        Versión vectorizada de calcular_salud_general para muchas muestras (requiere NumPy)
+        
+        Args:
+            columnas: dict con arrays 'temperatura', 'bateria', 'cpu', 'ram' y 'disco'
+        """
+        from evaluacion_lote import calcular_salud_lote
+        return calcular_salud_lote(columnas)
 
 
 # Función de prueba
@@ -7,19 +7,208 @@ import os
 import requests
 from datetime import datetime
 import base64
+import shutil
+
+from cache_respuestas import escribir_atomico, ruta_salida
+from errores import ErrorConfiguracion, ErrorProveedor
+from generador_prompt import recortar_prompt
+from historial_generaciones import HistorialGeneraciones
+from limitador_tasa import LimitadorTasa
+from metricas import cronometrado
+from politica_reintentos import PoliticaReintentos, leer_retry_after, describir_error
+
+URL_API = "https://api.openai.com/v1"
+
+# Límite de caracteres del prompt de DALL-E 3
+MAX_CARACTERES_PROMPT = 4000
+
+# Pausa del cupo tras un 429 sin Retry-After
+PAUSA_429 = 10
+
 
 class OpenAIClient:
-    def __init__(self, api_key=None):
-        """Inicializa el cliente de OpenAI"""
+    def __init__(self, api_key=None, historial=None, cache=None, reintentos=None, base_url=None, sesion=None,
+                 limitador=None):
+        """
+        Inicializa el cliente de OpenAI
+        
+        Args:
+            base_url: Raíz de la API (por defecto OPENAI_BASE_URL o https://api.openai.com/v1);
+                      permite apuntar a servidor_simulado.py
+            sesion: requests.Session a usar en lugar de la propia (transporte alternativo)
+            limitador: LimitadorTasa (por defecto uno con OPENAI_RPM, si está definido)
+        """
         if api_key is None:
             api_key = os.getenv('OPENAI_API_KEY')
         
         if not api_key:
-            raise ValueError("API Key de OpenAI no encontrada. Define OPENAI_API_KEY en variables de entorno.")
+            raise ErrorConfiguracion("API Key de OpenAI no encontrada. Define OPENAI_API_KEY en variables de entorno.")
         
         self.api_key = api_key
-        self.api_url = "https://api.openai.com/v1/images/generations"
-        self.historial = []
+        self.base_url = (base_url or os.getenv('OPENAI_BASE_URL') or URL_API).rstrip('/')
+        self.api_url = f"{self.base_url}/images/generations"
+        self.modelo = "dall-e-3"
+        self.tamano = "1024x1024"  # Opciones: 1024x1024, 1792x1024, 1024x1792
+        self.calidad = "standard"  # "standard" o "hd"
+        # "url" descarga la imagen en un segundo request; "b64_json" la recibe en la respuesta
+        self.formato_respuesta = "url"
+        # GeneradorPrompt.generar_prompt ajusta el prompt a este límite antes de enviarlo
+        self.max_caracteres_prompt = MAX_CARACTERES_PROMPT
+        
+        # Sesión keep-alive: reutiliza las conexiones TLS entre generaciones
+        if sesion is None:
+            sesion = requests.Session()
+            adaptador = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4)
+            sesion.mount('https://', adaptador)
+            sesion.mount('http://', adaptador)
+        self.sesion = sesion
+        self.sesion.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        })
+        # Historial persistente; sin uno explícito se usa una base en memoria
+        self.historial = historial if historial is not None else HistorialGeneraciones()
+        # Cache de respuestas opcional (CacheRespuestas)
+        self.cache = cache
+        # Backoff e interruptor de circuito propios de este proveedor
+        self.reintentos = reintentos if reintentos is not None else PoliticaReintentos(nombre='openai')
+        # Cupo de imágenes por minuto, compartido con otros procesos que usan la misma key
+        self.limitador = limitador if limitador is not None else LimitadorTasa.desde_entorno(
+            'openai', api_key, self.modelo
+        )
+    
+    def _ajustar_prompt(self, prompt):
+        """Red de seguridad para prompts que no se armaron con el presupuesto del cliente"""
+        if len(prompt) <= self.max_caracteres_prompt:
+            return prompt
+        print(f"⚠️  Prompt muy largo, recortando a {self.max_caracteres_prompt} caracteres...")
+        return recortar_prompt(prompt, self.max_caracteres_prompt)
+    
+    def _tokens_estimados(self, prompt):
+        # Los límites de imágenes son por solicitud, no por token
+        return 0
+    
+    def _reservar_cupo(self, prompt):
+        """Espera, si hay limitador, a tener cupo para la llamada"""
+        if self.limitador is not None:
+            self.limitador.adquirir(self._tokens_estimados(prompt))
+    
+    def _clave_cache(self, prompt):
+        parametros = {'size': self.tamano, 'quality': self.calidad}
+        if self.base_url != URL_API:
+            # Respuestas de otro servidor (p. ej. el simulado) no se mezclan con las reales
+            parametros['base_url'] = self.base_url
+        return self.cache.clave('openai', self.modelo, prompt, parametros)
+    
+    def _desde_cache(self, prompt, carpeta_salida):
+        """Resultado inmediato si el prompt ya fue generado, o None"""
+        if self.cache is None:
+            return None
+        entrada = self.cache.obtener(self._clave_cache(prompt))
+        # Solo sirve la imagen guardada: la URL de DALL-E vence mucho antes que el cache
+        if entrada is None or 'imagen_cache' not in entrada:
+            return None
+        
+        print("♻️  Imagen encontrada en cache, sin llamar a la API")
+        os.makedirs(carpeta_salida, exist_ok=True)
+        timestamp, archivo_imagen = ruta_salida(carpeta_salida, 'hongos', 'png')
+        shutil.copyfile(entrada['imagen_cache'], archivo_imagen)
+        return self._registrar_imagen(prompt, entrada['revised_prompt'], None,
+                                      timestamp, archivo_imagen, carpeta_salida, desde_cache=True)
+    
+    def _registrar_imagen(self, prompt, revised_prompt, image_url, timestamp, archivo_imagen, carpeta_salida,
+                          desde_cache=False):
+        """Guarda el prompt junto a la imagen ya descargada, y arma el resultado"""
+        # prompt_<sello>.txt junto a hongos_<sello>.png
+        sello = os.path.splitext(os.path.basename(archivo_imagen))[0].split('_', 1)[1]
+        archivo_prompt = os.path.join(carpeta_salida, f'prompt_{sello}.txt')
+        with open(archivo_prompt, 'w', encoding='utf-8') as f:
+            f.write("=== PROMPT ORIGINAL ===\n\n")
+            f.write(prompt)
+            f.write("\n\n=== PROMPT REVISADO POR DALL-E ===\n\n")
+            f.write(revised_prompt)
+            f.write(f"\n\n=== URL DE IMAGEN ===\n\n")
+            f.write(image_url or ("(copia del cache local)" if desde_cache else "(recibida como b64_json)"))
+        
+        resultado = {
+            'exito': True,
+            'timestamp': timestamp,
+            'archivo_imagen': archivo_imagen,
+            'archivo_prompt': archivo_prompt,
+            'url_imagen': image_url,
+            'revised_prompt': revised_prompt,
+            'cache': desde_cache,
+            'mensaje': f'✅ Imagen generada y guardada en: {archivo_imagen}'
+        }
+        
+        if self.cache is not None and not desde_cache:
+            self.cache.guardar(self._clave_cache(prompt),
+                               {'revised_prompt': revised_prompt, 'url_imagen': image_url},
+                               imagen=archivo_imagen)
+        
+        self.historial.agregar(resultado, 'openai')
+        
+        print(f"✅ Imagen guardada en: {archivo_imagen}")
+        print(f"📁 Prompt guardado en: {archivo_prompt}")
+        
+        return resultado
+    
+    @cronometrado('proveedor.llamada', proveedor='openai')
+    def _solicitar(self, prompt):
+        """
+        Pide la imagen a la API
+        
+        Returns:
+            (url_imagen, prompt_revisado, imagen_b64); según formato_respuesta,
+            url_imagen o imagen_b64 es None
+        """
+        # Preparar el request a DALL-E
+        data = {
+            "model": self.modelo,
+            "prompt": prompt,
+            "n": 1,
+            "size": self.tamano,
+            "quality": self.calidad,
+            "response_format": self.formato_respuesta
+        }
+        
+        # Hacer el request
+        response = self.sesion.post(self.api_url, json=data, timeout=60)
+        
+        if response.status_code != 200:
+            # Los gateways (502/503) suelen responder HTML: el código manda, no el cuerpo
+            try:
+                error_msg = response.json().get('error', {}).get('message', 'Error desconocido')
+            except (ValueError, AttributeError):
+                error_msg = response.text[:200]
+            raise ErrorProveedor(f"Error de API: {response.status_code} - {error_msg}", response.status_code,
+                                 leer_retry_after(response.headers.get('Retry-After')))
+        
+        imagen = response.json()['data'][0]
+        return imagen.get('url'), imagen.get('revised_prompt', prompt), imagen.get('b64_json')
+    
+    @cronometrado('proveedor.descarga', proveedor='openai')
+    def _guardar_imagen(self, image_url, imagen_b64, archivo_imagen):
+        """Escribe la imagen a disco, decodificándola o descargándola según el formato"""
+        if imagen_b64 is not None:
+            print("💾 Decodificando imagen...")
+            escribir_atomico(archivo_imagen, lambda f: _decodificar_b64(imagen_b64, f))
+        else:
+            print("📥 Descargando imagen...")
+            self._descargar(image_url, archivo_imagen)
+    
+    def _descargar(self, image_url, archivo_imagen):
+        """Descarga la imagen en bloques, sin cargarla entera en memoria"""
+        with self.sesion.get(image_url, stream=True, timeout=30) as img_response:
+            if img_response.status_code != 200:
+                raise ErrorProveedor(f"Error al descargar imagen: {img_response.status_code}", img_response.status_code,
+                                     leer_retry_after(img_response.headers.get('Retry-After')))
+            
+            def escribir(f):
+                for bloque in img_response.iter_content(chunk_size=64 * 1024):
+                    f.write(bloque)
+            
+            escribir_atomico(archivo_imagen, escribir)
     
     def generar_imagen(self, prompt, carpeta_salida='output'):
         """
@@ -30,116 +219,66 @@ class OpenAIClient:
             carpeta_salida: Carpeta donde guardar las imágenes
         
         Returns:
-            dict con información de la generación
+            dict con información de la generación ('cache': True si no se llamó a la API)
         """
         try:
+            prompt = self._ajustar_prompt(prompt)
+            
+            resultado = self._desde_cache(prompt, carpeta_salida)
+            if resultado is not None:
+                return resultado
+            
             print("🍄 Generando colonia de hongos con DALL-E 3...")
             print(f"📝 Prompt enviado ({len(prompt)} caracteres)")
             
             # Crear carpeta de salida si no existe
             os.makedirs(carpeta_salida, exist_ok=True)
             
-            # Preparar el request a DALL-E
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            # DALL-E 3 tiene límite de 4000 caracteres en el prompt
-            if len(prompt) > 4000:
-                print("⚠️  Prompt muy largo, recortando a 4000 caracteres...")
-                prompt = prompt[:3997] + "..."
-            
-            data = {
-                "model": "dall-e-3",
-                "prompt": prompt,
-                "n": 1,
-                "size": "1024x1024",  # Opciones: 1024x1024, 1792x1024, 1024x1792
-                "quality": "standard",  # "standard" o "hd"
-                "response_format": "url"  # "url" o "b64_json"
-            }
+            self._reservar_cupo(prompt)
+            image_url, revised_prompt, imagen_b64 = self._solicitar(prompt)
             
-            # Hacer el request
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=60)
+            # Guardar la imagen
+            timestamp, archivo_imagen = ruta_salida(carpeta_salida, 'hongos', 'png')
+            self._guardar_imagen(image_url, imagen_b64, archivo_imagen)
             
-            if response.status_code == 200:
-                result = response.json()
-                image_url = result['data'][0]['url']
-                revised_prompt = result['data'][0].get('revised_prompt', prompt)
-                
-                # Descargar la imagen
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                archivo_imagen = os.path.join(carpeta_salida, f'hongos_{timestamp}.png')
-                
-                print("📥 Descargando imagen...")
-                img_response = requests.get(image_url, timeout=30)
-                
-                if img_response.status_code == 200:
-                    with open(archivo_imagen, 'wb') as f:
-                        f.write(img_response.content)
-                    
-                    # Guardar el prompt
-                    archivo_prompt = os.path.join(carpeta_salida, f'prompt_{timestamp}.txt')
-                    with open(archivo_prompt, 'w', encoding='utf-8') as f:
-                        f.write("=== PROMPT ORIGINAL ===\n\n")
-                        f.write(prompt)
-                        f.write("\n\n=== PROMPT REVISADO POR DALL-E ===\n\n")
-                        f.write(revised_prompt)
-                        f.write(f"\n\n=== URL DE IMAGEN ===\n\n")
-                        f.write(image_url)
-                    
-                    resultado = {
-                        'exito': True,
-                        'timestamp': timestamp,
-                        'archivo_imagen': archivo_imagen,
-                        'archivo_prompt': archivo_prompt,
-                        'url_imagen': image_url,
-                        'revised_prompt': revised_prompt,
-                        'mensaje': f'✅ Imagen generada y guardada en: {archivo_imagen}'
-                    }
-                    
-                    self.historial.append(resultado)
-                    
-                    print(f"✅ Imagen guardada en: {archivo_imagen}")
-                    print(f"📁 Prompt guardado en: {archivo_prompt}")
-                    
-                    return resultado
-                else:
-                    raise Exception(f"Error al descargar imagen: {img_response.status_code}")
-            
-            else:
-                error_msg = response.json().get('error', {}).get('message', 'Error desconocido')
-                raise Exception(f"Error de API: {response.status_code} - {error_msg}")
+            return self._registrar_imagen(prompt, revised_prompt, image_url,
+                                          timestamp, archivo_imagen, carpeta_salida)
             
         except Exception as e:
-            print(f"❌ Error al generar: {str(e)}")
-            return {
-                'exito': False,
-                'error': str(e),
-                'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S")
-            }
+            return self._resultado_error(e)
     
-    def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output'):
-        """Genera imagen con reintentos en caso de fallo"""
-        import time
-        
-        for intento in range(max_intentos):
-            print(f"Intento {intento + 1}/{max_intentos}")
-            resultado = self.generar_imagen(prompt, carpeta_salida)
-            
-            if resultado['exito']:
-                return resultado
-            
-            if intento < max_intentos - 1:
-                tiempo_espera = (intento + 1) * 5
-                print(f"⏳ Esperando {tiempo_espera}s antes de reintentar...")
-                time.sleep(tiempo_espera)
-        
+    def _resultado_error(self, e):
+        """Registra y devuelve el resultado de una generación fallida"""
+        print(f"❌ Error al generar: {str(e)}")
+        resultado = {
+            'exito': False,
+            'error': str(e),
+            'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
+            **describir_error(e)
+        }
+        if resultado['codigo'] == 429 and self.limitador is not None:
+            # Los demás procesos con la misma key también esperan
+            self.limitador.pausar(resultado['retry_after'] or PAUSA_429)
+        self.historial.agregar(resultado, 'openai')
         return resultado
     
-    def obtener_historial(self):
-        """Retorna el historial de generaciones"""
-        return self.historial
+    def generar_con_reintentos(self, prompt, max_intentos=3, carpeta_salida='output'):
+        """Genera imagen reintentando solo los fallos pasajeros (ver PoliticaReintentos)"""
+        return self.reintentos.ejecutar(lambda: self.generar_imagen(prompt, carpeta_salida), max_intentos)
+    
+    def obtener_historial(self, limite=20, antes_de=None):
+        """Retorna una página con las últimas generaciones (ver HistorialGeneraciones.ultimos)"""
+        return self.historial.ultimos(limite, antes_de=antes_de)
+    
+    def cerrar(self):
+        """Cierra las conexiones de la sesión"""
+        self.sesion.close()
+
+
+def _decodificar_b64(imagen_b64, destino, bloque=64 * 1024):
+    """Decodifica base64 a un archivo por bloques (múltiplos de 4 caracteres)"""
+    for inicio in range(0, len(imagen_b64), bloque):
+        destino.write(base64.b64decode(imagen_b64[inicio:inicio + bloque]))
 
 
 # Función de prueba
@@ -1,8 +1,43 @@
 """
 OSMOTROFIA - Visualización de Computadora como Colonia de Hongos
 Aplicación principal que integra todos los componentes
+
+Uso no interactivo (sin argumentos se abre el menú):
+    python osmotrofia.py analyze [--json] [--guardar]
+    python osmotrofia.py generate [--json-datos] [--stream] [--proveedor gemini|openai|auto]
+                                 [--max-tokens-prompt T] [--encolar]
+    python osmotrofia.py monitor [--modo continuo|reactivo|async] [--minutos N] [--muestreo S] [--proveedor P]
+                                [--max-tokens-prompt T] [--compacto] [--encolar]
+    python osmotrofia.py worker [--paralelismo N] [--vaciar] [--estado] [--reintentar-fallidos]
+    python osmotrofia.py history [--limite N] [--proveedor P] [--fallidos] [--json]
+
+analyze, generate y monitor aceptan --metricas-puerto P (expone /metrics en formato
+Prometheus y /metrics.json) y --metricas-json ARCHIVO (vuelca los tiempos por etapa
+al terminar). Sin esas opciones las métricas quedan deshabilitadas y no cuestan nada.
+
+El prompt se arma dentro del límite del proveedor (4000 caracteres en OpenAI) y de
+--max-tokens-prompt: se condensan o quitan primero las secciones menos importantes
+(ver GeneradorPrompt.generar_prompt). Con --compacto, cada generación del monitoreo
+envía completas solo las dimensiones que cambiaron desde la anterior.
+
+Con --encolar, generate y monitor dejan cada generación en una cola SQLite
+persistente (osmotrofia_output/cola.db) en lugar de llamar al proveedor; `worker`
+la procesa con un pool de procesos. Entrega al menos una vez: un trabajo de un
+proceso que murió vuelve a la cola, y al reiniciar `worker` se retoma lo pendiente.
+
+Cupos de los proveedores: GEMINI_RPM, GEMINI_TPM y OPENAI_RPM activan un limitador
+compartido entre procesos (ver limitador_tasa.py); sin cupo las llamadas esperan.
+
+Presupuesto de arranque: importar este módulo y correr `analyze` no debe cargar
+los SDKs de los proveedores (google.generativeai, requests) ni asyncio; solo
+psutil y la biblioteca estándar. El objetivo es < 100 ms de imports, para
+poder tomar snapshots desde cron o timers de systemd. Se verifica con:
+    python -X importtime osmotrofia.py analyze --json 2>&1 >/dev/null | sort -t'|' -k2 -n | tail
+Los proveedores se importan la primera vez que se usan (ver Osmotrofia.cliente).
 """
 
+import argparse
+import functools
 import os
 import sys
 import time
@@ -11,28 +46,249 @@ import json
 
 from monitor_sistema import MonitorSistema
 from generador_prompt import GeneradorPrompt
-from gemini_client import GeminiClient
+from serie_temporal import SerieTemporal
+from registro_muestras import RegistroMuestras
+from historial_generaciones import HistorialGeneraciones
+from disparador_generacion import DisparadorGeneracion
+from metricas import METRICAS, span
+from errores import ErrorConfiguracion
+
+
+CARPETA_SALIDA = 'osmotrofia_output'
+
+# Paso de redondeo de los porcentajes del prompt: el estado cualitativo ya lo da la
+# firma de condiciones, y sin redondear el prompt (y su clave de cache) cambia en cada muestra
+PASO_PORCENTAJES = 10
+
+# 'auto' enruta entre los proveedores con API key según latencia y errores recientes
+PROVEEDORES = ('gemini', 'openai', 'auto')
+NOMBRES_PROVEEDORES = {'gemini': 'Gemini', 'openai': 'OpenAI', 'auto': 'los proveedores (auto)'}
+
+
+def guardar_datos_json(carpeta, parametros, salud, prompt):
+    """
+    Escribe un datos_*.json con el snapshot completo (formato anterior a muestras.bin)
+    
+    Returns:
+        ruta del archivo
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    archivo_datos = os.path.join(carpeta, f'datos_{timestamp}.json')
+    
+    datos_completos = {
+        'timestamp': timestamp,
+        'parametros': parametros,
+        'salud_general': salud,
+        'prompt': prompt
+    }
+    
+    with open(archivo_datos, 'w', encoding='utf-8') as f:
+        json.dump(datos_completos, f, indent=2, ensure_ascii=False)
+    return archivo_datos
 
 
 class Osmotrofia:
-    def __init__(self, api_key=None):
-        """Inicializa la aplicación Osmotrofia"""
-        print("🍄 Iniciando OSMOTROFIA...")
+    def __init__(self, api_key=None, verboso=True, ventana_cpu=1.0, proveedor='gemini',
+                 max_tokens_prompt=None, compacto=False, encolar=False):
+        """
+        Inicializa la aplicación Osmotrofia
         
-        self.monitor = MonitorSistema()
-        self.generador = GeneradorPrompt()
-        self.gemini = GeminiClient(api_key)
+        Args:
+            api_key: API key de Gemini (por defecto GEMINI_API_KEY); se usa recién al generar
+            verboso: Mostrar los mensajes de arranque
+            ventana_cpu: Segundos que se mide la CPU en un snapshot sin muestreo de fondo
+            proveedor: 'gemini', 'openai' o 'auto' (ver EnrutadorProveedores)
+            max_tokens_prompt: Presupuesto de tokens del prompt (None = sin límite propio)
+            compacto: Tras la primera generación, solo las dimensiones que cambiaron van completas
+            encolar: Dejar las generaciones en la cola persistente (ver cola_trabajos.py) en lugar
+                     de llamar al proveedor; las procesa `osmotrofia.py worker`
+        """
+        if proveedor not in PROVEEDORES:
+            raise ErrorConfiguracion(f"Proveedor desconocido: {proveedor} (opciones: {', '.join(PROVEEDORES)})")
+        if verboso:
+            print("🍄 Iniciando OSMOTROFIA...")
         
-        self.carpeta_salida = 'osmotrofia_output'
+        # Últimas 24 h de muestras (a 1 s de resolución) en memoria
+        self.serie = SerieTemporal(capacidad=86400)
+        self.monitor = MonitorSistema(ventana_cpu=ventana_cpu, serie=self.serie)
+        self.generador = GeneradorPrompt(cuantizar=PASO_PORCENTAJES)
+        self.carpeta_salida = CARPETA_SALIDA
         os.makedirs(self.carpeta_salida, exist_ok=True)
         
-        print("✅ Sistema inicializado correctamente\n")
+        self.historial = HistorialGeneraciones(os.path.join(self.carpeta_salida, 'historial.db'))
+        self._api_key = api_key
+        self.proveedor = proveedor
+        self.max_tokens_prompt = max_tokens_prompt
+        self.compacto = compacto
+        self._firma_anterior = None
+        self.encolar = encolar
+        self._cola = None
+        self._gemini = None
+        self._openai = None
+        self._cliente = None
+        self._cache = None
+        
+        # Log binario append-only con todas las muestras (ver registro_muestras.py)
+        self.registro = RegistroMuestras(os.path.join(self.carpeta_salida, 'muestras.bin'))
+        
+        if verboso:
+            print("✅ Sistema inicializado correctamente\n")
+    
+    @property
+    def cache(self):
+        """Cache de respuestas; prompts repetidos (mismo estado de la máquina) se responden desde disco"""
+        if self._cache is None:
+            from cache_respuestas import CacheRespuestas
+            self._cache = CacheRespuestas(os.path.join(self.carpeta_salida, 'cache'))
+        return self._cache
+    
+    @property
+    def cola(self):
+        """Cola persistente de generaciones (cola.db), creada en el primer uso"""
+        if self._cola is None:
+            from cola_trabajos import ColaTrabajos
+            self._cola = ColaTrabajos(os.path.join(self.carpeta_salida, 'cola.db'))
+        return self._cola
+    
+    def encolar_generacion(self, prompt, salud):
+        """
+        Deja una generación en la cola en lugar de llamar al proveedor
+        
+        Returns:
+            dict de resultado con 'encolado' y el id del 'trabajo'
+        
+        Raises:
+            ErrorConfiguracion: si los trabajadores no tienen la API key del proveedor
+        """
+        from cola_trabajos import verificar_proveedor
+        verificar_proveedor(self.proveedor)
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        trabajo = self.cola.encolar(prompt, self.proveedor, self.carpeta_salida,
+                                    datos={'timestamp': timestamp, 'salud_general': salud})
+        pendientes = self.cola.estado()['pendiente']
+        print(f"📥 Trabajo #{trabajo} encolado ({pendientes} pendientes); lo genera `osmotrofia.py worker`")
+        return {'exito': True, 'encolado': True, 'trabajo': trabajo, 'timestamp': timestamp}
+    
+    @property
+    def gemini(self):
+        """Cliente de Gemini, creado (e importado su SDK) en el primer uso"""
+        if self._gemini is None:
+            from gemini_client import GeminiClient
+            self._gemini = GeminiClient(self._api_key, historial=self.historial, cache=self.cache)
+        return self._gemini
+    
+    @property
+    def openai(self):
+        """Cliente de OpenAI (OPENAI_API_KEY), creado en el primer uso"""
+        if self._openai is None:
+            from openai_client import OpenAIClient
+            self._openai = OpenAIClient(historial=self.historial, cache=self.cache)
+        return self._openai
+    
+    def _clientes_disponibles(self):
+        """dict nombre -> cliente de los proveedores con API key, Gemini primero"""
+        clientes = {}
+        if self._api_key or os.getenv('GEMINI_API_KEY'):
+            clientes['gemini'] = self.gemini
+        if os.getenv('OPENAI_API_KEY'):
+            clientes['openai'] = self.openai
+        if not clientes:
+            raise ErrorConfiguracion("No hay API keys de proveedores. Define GEMINI_API_KEY u OPENAI_API_KEY.")
+        return clientes
+    
+    @property
+    def cliente(self):
+        """Cliente de generación según self.proveedor (un EnrutadorProveedores con 'auto')"""
+        if self._cliente is None:
+            if self.proveedor == 'auto':
+                from enrutador_proveedores import EnrutadorProveedores
+                self._cliente = EnrutadorProveedores(self._clientes_disponibles())
+            else:
+                self._cliente = getattr(self, self.proveedor)
+        return self._cliente
+    
+    def _cliente_async(self, max_concurrencia):
+        """Variante asyncio de self.cliente; con 'auto', un enrutador con cobertura"""
+        from clientes_async import GeminiClientAsync, OpenAIClientAsync
+        
+        envolturas = {'gemini': GeminiClientAsync, 'openai': OpenAIClientAsync}
+        if self.proveedor != 'auto':
+            return envolturas[self.proveedor](getattr(self, self.proveedor), max_concurrencia=max_concurrencia)
+        
+        from enrutador_proveedores import EnrutadorProveedoresAsync
+        clientes = {
+            nombre: envolturas[nombre](cliente, max_concurrencia=max_concurrencia)
+            for nombre, cliente in self._clientes_disponibles().items()
+        }
+        return EnrutadorProveedoresAsync(clientes, cobertura=True)
+    
+    def construir_prompt(self, parametros, salud, cliente=None):
+        """
+        Prompt dentro del límite de caracteres del cliente y de max_tokens_prompt
+        
+        Args:
+            parametros: Snapshot del sistema
+            salud: Salud general (0-100)
+            cliente: Cliente que lo va a enviar (por defecto self.cliente)
+        
+        Returns:
+            el prompt
+        """
+        cliente = cliente or self.cliente
+        firma_anterior = self._firma_anterior if self.compacto else None
+        prompt = self.generador.generar_prompt(
+            parametros, salud,
+            max_caracteres=getattr(cliente, 'max_caracteres_prompt', None),
+            max_tokens=self.max_tokens_prompt,
+            firma_anterior=firma_anterior
+        )
+        return prompt
+    
+    def confirmar_entrega(self, parametros, salud, resultado):
+        """
+        Registra el estado que el proveedor ya recibió completo, base de la variante compacta
+        
+        Solo cuenta una generación exitosa: tras un fallo o un trabajo encolado el
+        próximo prompt vuelve a describir completas las dimensiones no entregadas.
+        """
+        if resultado.get('exito') and not resultado.get('encolado'):
+            self._firma_anterior = self.generador.firma_condiciones(parametros, salud)
+    
+    def cerrar(self):
+        """Escribe el lote pendiente del historial y cierra los archivos de la aplicación"""
+        self.historial.cerrar()
+        self.registro.cerrar()
+        if self._cola is not None:
+            self._cola.cerrar()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.cerrar()
+    
+    def tomar_muestra(self, guardar=False):
+        """
+        Snapshot del sistema sin salida por pantalla
+        
+        Args:
+            guardar: Agregar la muestra al registro binario
+        
+        Returns:
+            (parametros, salud)
+        """
+        parametros = self.monitor.obtener_parametros_completos()
+        salud = self.monitor.calcular_salud_general(parametros)
+        self.monitor.registrar_muestra(parametros, salud)
+        if guardar:
+            self.registro.agregar_snapshot(parametros, salud)
+        return parametros, salud
     
     def analizar_sistema(self):
         """Analiza el estado actual del sistema"""
         print("🔍 Analizando sistema...")
-        parametros = self.monitor.obtener_parametros_completos()
-        salud = self.monitor.calcular_salud_general(parametros)
+        parametros, salud = self.tomar_muestra()
         
         print(f"\n📊 ESTADO DEL SISTEMA")
         print("=" * 50)
@@ -48,62 +304,214 @@ class Osmotrofia:
         
         return parametros, salud
     
-    def generar_visualizacion(self, guardar_datos=True):
-        """Genera la visualización completa"""
+    def generar_visualizacion(self, guardar_datos=True, guardar_json=False, en_vivo=False, encolar=None):
+        """
+        Genera la visualización completa
+        
+        Args:
+            guardar_datos: Agrega la muestra al registro binario muestras.bin
+            guardar_json: Además escribe un datos_*.json con el snapshot completo (formato anterior)
+            en_vivo: Recibe la descripción por streaming y la imprime a medida que llega
+            encolar: Dejarla en la cola persistente en lugar de generarla (None = self.encolar)
+        """
         # Analizar sistema
-        parametros, salud = self.analizar_sistema()
+        with span('visualizacion.muestreo'):
+            parametros, salud = self.analizar_sistema()
         
         # Generar prompt
         print("\n🎨 Generando descripción de hongos...")
-        prompt = self.generador.generar_prompt_completo(parametros, salud)
+        with span('visualizacion.prompt'):
+            prompt = self.construir_prompt(parametros, salud)
         
         # Guardar datos si se solicita
         if guardar_datos:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            archivo_datos = os.path.join(self.carpeta_salida, f'datos_{timestamp}.json')
-            
-            datos_completos = {
-                'timestamp': timestamp,
-                'parametros': parametros,
-                'salud_general': salud,
-                'prompt': prompt
-            }
-            
-            with open(archivo_datos, 'w', encoding='utf-8') as f:
-                json.dump(datos_completos, f, indent=2, ensure_ascii=False)
-            
+            with span('visualizacion.registro'):
+                self.registro.agregar_snapshot(parametros, salud)
+            print(f"💾 Muestra #{len(self.registro)} agregada a: {self.registro.ruta}")
+        
+        if guardar_json:
+            with span('visualizacion.json'):
+                archivo_datos = guardar_datos_json(self.carpeta_salida, parametros, salud, prompt)
             print(f"💾 Datos guardados en: {archivo_datos}")
         
-        # Generar con Gemini
-        print("\n🤖 Enviando a Gemini...")
-        resultado = self.gemini.generar_con_reintentos(prompt, carpeta_salida=self.carpeta_salida)
+        if self.encolar if encolar is None else encolar:
+            return self.encolar_generacion(prompt, salud)
+        
+        # Generar con el proveedor configurado
+        print(f"\n🤖 Enviando a {NOMBRES_PROVEEDORES[self.proveedor]}...")
+        opciones = {}
+        if en_vivo:
+            if hasattr(self.cliente, 'generar_imagen_streaming'):
+                opciones['al_recibir'] = lambda fragmento: print(fragmento, end='', flush=True)
+            else:
+                print("⚠️  Este proveedor no envía la respuesta por partes; se muestra al terminar")
+        with span('visualizacion.generacion'):
+            resultado = self.cliente.generar_con_reintentos(prompt, carpeta_salida=self.carpeta_salida, **opciones)
+        self.confirmar_entrega(parametros, salud, resultado)
         
         return resultado
     
-    def modo_monitoreo_continuo(self, intervalo_minutos=5):
-        """Monitorea continuamente y genera visualizaciones periódicas"""
+    def modo_monitoreo_continuo(self, intervalo_minutos=5, intervalo_muestreo=1.0):
+        """
+        Monitorea continuamente y genera visualizaciones periódicas
+        
+        El muestreo y la generación corren en cadencias separadas de un Planificador
+        por deadlines: las muestras quedan equiespaciadas aunque la API tarde.
+        
+        Args:
+            intervalo_minutos: Minutos entre generaciones (acepta fracciones)
+            intervalo_muestreo: Segundos entre muestras (acepta fracciones)
+        """
+        from planificador import Planificador
+        
         print(f"\n🔄 MODO MONITOREO CONTINUO")
-        print(f"Generando visualización cada {intervalo_minutos} minutos")
+        print(f"Muestreando cada {intervalo_muestreo}s, generando visualización cada {intervalo_minutos} minutos")
+        print("Presiona Ctrl+C para detener\n")
+        
+        # Mantener la ventana de CPU caliente para que cada snapshot no bloquee
+        self.monitor.iniciar_muestreo()
+        
+        ultima = {}
+        iteracion = 0
+        
+        def muestrear():
+            ultima['muestra'] = self.tomar_muestra(guardar=True)
+        
+        def generar(ticks=1):
+            nonlocal iteracion
+            iteracion += 1
+            parametros, salud = ultima['muestra']
+            print(f"\n{'='*60}")
+            print(f"ITERACIÓN #{iteracion} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Salud {salud}%")
+            print(f"{'='*60}")
+            
+            prompt = self.construir_prompt(parametros, salud)
+            if self.encolar:
+                self.encolar_generacion(prompt, salud)
+            else:
+                print(f"\n🤖 Enviando a {NOMBRES_PROVEEDORES[self.proveedor]}...")
+                resultado = self.cliente.generar_con_reintentos(prompt, carpeta_salida=self.carpeta_salida)
+                self.confirmar_entrega(parametros, salud, resultado)
+            
+            print(f"\n⏳ Próxima generación aproximadamente a las {self._calcular_proxima_hora(intervalo_minutos)}")
+        
+        planificador = Planificador()
+        planificador.agregar('muestreo', intervalo_muestreo, muestrear, politica='saltar')
+        # Desfasada medio periodo de muestreo para arrancar con una muestra ya tomada
+        planificador.agregar('generacion', intervalo_minutos * 60, generar, politica='acumular',
+                             en_hilo=True, fase=intervalo_muestreo / 2)
+        
+        try:
+            planificador.ejecutar()
+        except KeyboardInterrupt:
+            print("\n\n🛑 Monitoreo detenido por el usuario")
+            print(f"Total de iteraciones completadas: {iteracion}")
+        finally:
+            self.monitor.detener_muestreo()
+            for linea in planificador.resumen():
+                print(f"  • {linea}")
+    
+    def modo_monitoreo_async(self, intervalo_muestreo=1.0, intervalo_minutos=5, max_concurrencia=1):
+        """
+        Monitoreo continuo en asyncio: el muestreo sigue mientras hay generaciones en vuelo
+        
+        Args:
+            intervalo_muestreo: Segundos entre muestras (independiente de la latencia del proveedor)
+            intervalo_minutos: Minutos entre generaciones
+            max_concurrencia: Generaciones simultáneas permitidas
+        """
+        print(f"\n🔄 MODO MONITOREO ASÍNCRONO")
+        print(f"Muestreando cada {intervalo_muestreo}s, generando cada {intervalo_minutos} minutos")
+        print("Presiona Ctrl+C para detener\n")
+        
+        # Intervalo fijo: solo la antigüedad dispara generaciones
+        disparador = DisparadorGeneracion(delta_salud=None, max_antiguedad=intervalo_minutos * 60,
+                                          min_intervalo=0, por_condiciones=False)
+        import asyncio
+        
+        try:
+            asyncio.run(self._monitoreo_async(intervalo_muestreo, disparador, max_concurrencia))
+        except KeyboardInterrupt:
+            print("\n\n🛑 Monitoreo detenido por el usuario")
+    
+    def modo_monitoreo_eventos(self, intervalo_muestreo=1.0, delta_salud=10, max_antiguedad_minutos=30,
+                               histeresis=2.0, min_intervalo=30):
+        """
+        Monitoreo reactivo: muestrea seguido y genera solo cuando el estado cambia
+        
+        Genera al cambiar la firma de condiciones, al moverse la salud `delta_salud`
+        puntos o tras `max_antiguedad_minutos` sin generar (ver DisparadorGeneracion)
+        """
+        print(f"\n🔄 MODO MONITOREO REACTIVO")
+        print(f"Muestreando cada {intervalo_muestreo}s; se genera ante cambios de condiciones, "
+              f"saltos de salud de {delta_salud} puntos o cada {max_antiguedad_minutos} minutos")
         print("Presiona Ctrl+C para detener\n")
         
+        disparador = DisparadorGeneracion(delta_salud=delta_salud, max_antiguedad=max_antiguedad_minutos * 60,
+                                          histeresis=histeresis, min_intervalo=min_intervalo)
+        import asyncio
+        
+        try:
+            asyncio.run(self._monitoreo_async(intervalo_muestreo, disparador, max_concurrencia=1))
+        except KeyboardInterrupt:
+            print("\n\n🛑 Monitoreo detenido por el usuario")
+            print(f"Generaciones: {disparador.disparos} en {disparador.evaluaciones} muestras")
+    
+    async def _monitoreo_async(self, intervalo_muestreo, disparador, max_concurrencia):
+        import asyncio
+        cliente = self._cliente_async(max_concurrencia)
+        en_vuelo = set()
+        loop = asyncio.get_running_loop()
+        proxima_muestra = loop.time()
+        muestras = 0
+        
+        self.monitor.iniciar_muestreo()
         try:
-            iteracion = 1
             while True:
-                print(f"\n{'='*60}")
-                print(f"ITERACIÓN #{iteracion} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"{'='*60}")
-                
-                self.generar_visualizacion()
-                
-                print(f"\n⏳ Esperando {intervalo_minutos} minutos hasta la próxima generación...")
-                print(f"   (Próxima ejecución aproximadamente a las {self._calcular_proxima_hora(intervalo_minutos)})")
+                # El snapshot lee /proc y psutil: fuera del event loop
+                parametros = await asyncio.to_thread(self.monitor.obtener_parametros_completos)
+                salud = self.monitor.calcular_salud_general(parametros)
+                self.monitor.registrar_muestra(parametros, salud)
+                self.registro.agregar_snapshot(parametros, salud)
+                muestras += 1
                 
-                time.sleep(intervalo_minutos * 60)
-                iteracion += 1
+                motivo = disparador.evaluar(parametros, salud, loop.time())
+                if motivo:
+                    disparo = disparador.ultimo_disparo
+                    prompt = self.construir_prompt(parametros, salud, cliente)
+                    if self.encolar:
+                        print(f"\n📥 [{datetime.now().strftime('%H:%M:%S')}] Salud {salud}% ({motivo})")
+                        await asyncio.to_thread(self.encolar_generacion, prompt, salud)
+                        # Encolado cuenta como generado: los reintentos son de los trabajadores
+                        disparador.confirmar(disparo)
+                    else:
+                        print(f"\n🤖 [{datetime.now().strftime('%H:%M:%S')}] Salud {salud}% ({motivo}) - enviando a {NOMBRES_PROVEEDORES[self.proveedor]} "
+                              f"({len(en_vuelo)} generaciones en vuelo, {muestras} muestras)")
+                        tarea = asyncio.create_task(
+                            cliente.generar_con_reintentos(prompt, carpeta_salida=self.carpeta_salida)
+                        )
+                        en_vuelo.add(tarea)
+                        tarea.add_done_callback(en_vuelo.discard)
+                        tarea.add_done_callback(
+                            functools.partial(self._confirmar_tarea, parametros, salud, disparador, disparo)
+                        )
                 
-        except KeyboardInterrupt:
-            print("\n\n🛑 Monitoreo detenido por el usuario")
-            print(f"Total de iteraciones completadas: {iteracion - 1}")
+                # Cadencia fija: se descuenta lo que tardó el snapshot
+                proxima_muestra = max(proxima_muestra + intervalo_muestreo, loop.time())
+                await asyncio.sleep(proxima_muestra - loop.time())
+        finally:
+            for tarea in en_vuelo:
+                tarea.cancel()
+            await asyncio.gather(*en_vuelo, return_exceptions=True)
+            self.monitor.detener_muestreo()
+            print(f"Total de muestras registradas: {muestras}")
+    
+    def _confirmar_tarea(self, parametros, salud, disparador, disparo, tarea):
+        # Una generación fallida no cuenta: el disparador vuelve a intentar el mismo cambio
+        if tarea.cancelled() or tarea.exception() is not None or not tarea.result().get('exito'):
+            return
+        self.confirmar_entrega(parametros, salud, tarea.result())
+        disparador.confirmar(disparo)
     
     def _calcular_proxima_hora(self, minutos):
         """Calcula la hora aproximada de la próxima ejecución"""
@@ -111,6 +519,37 @@ class Osmotrofia:
         proxima = datetime.now() + timedelta(minutes=minutos)
         return proxima.strftime('%H:%M:%S')
     
+    def mostrar_historial(self, por_pagina=10):
+        """Muestra el historial paginado, de lo más reciente a lo más antiguo"""
+        total = self.historial.contar()
+        if not total:
+            print("\n📜 No hay generaciones en el historial")
+            input("\nPresiona Enter para continuar...")
+            return
+        
+        print(f"\n📜 Historial ({total} generaciones):")
+        antes_de = None
+        mostradas = 0
+        while True:
+            pagina = self.historial.ultimos(por_pagina, antes_de=antes_de)
+            if not pagina:
+                break
+            
+            for i, gen in enumerate(reversed(pagina), mostradas + 1):
+                print(f"\n{i}. {gen['timestamp']}")
+                print(f"   Estado: {'✅ Exitoso' if gen['exito'] else '❌ Fallido'}")
+                if gen['exito']:
+                    print(f"   Archivo: {gen['archivo_prompt']}")
+            mostradas += len(pagina)
+            antes_de = pagina[0]['id']
+            
+            if mostradas >= total:
+                break
+            if input("\nEnter para ver más, 'q' para volver: ").strip().lower() == 'q':
+                return
+        
+        input("\nPresiona Enter para continuar...")
+    
     def mostrar_menu(self):
         """Muestra el menú interactivo"""
         while True:
@@ -122,9 +561,11 @@ class Osmotrofia:
             print("3. Modo monitoreo continuo")
             print("4. Ver historial de generaciones")
             print("5. Salir")
+            print("6. Modo monitoreo reactivo (genera solo ante cambios)")
+            print("7. Encolar visualización (la generan los trabajadores: osmotrofia.py worker)")
             print("="*60)
             
-            opcion = input("\nSelecciona una opción (1-5): ").strip()
+            opcion = input("\nSelecciona una opción (1-7): ").strip()
             
             if opcion == '1':
                 self.analizar_sistema()
@@ -141,36 +582,36 @@ class Osmotrofia:
             elif opcion == '3':
                 intervalo = input("Intervalo en minutos (default: 5): ").strip()
                 try:
-                    intervalo = int(intervalo) if intervalo else 5
+                    intervalo = float(intervalo) if intervalo else 5
                     self.modo_monitoreo_continuo(intervalo)
                 except ValueError:
                     print("❌ Intervalo inválido, usando 5 minutos")
                     self.modo_monitoreo_continuo(5)
                     
             elif opcion == '4':
-                historial = self.gemini.obtener_historial()
-                if historial:
-                    print(f"\n📜 Historial ({len(historial)} generaciones):")
-                    for i, gen in enumerate(historial, 1):
-                        print(f"\n{i}. {gen['timestamp']}")
-                        print(f"   Estado: {'✅ Exitoso' if gen['exito'] else '❌ Fallido'}")
-                        if gen['exito']:
-                            print(f"   Archivo: {gen['archivo_prompt']}")
-                else:
-                    print("\n📜 No hay generaciones en el historial")
-                input("\nPresiona Enter para continuar...")
+                self.mostrar_historial()
                 
             elif opcion == '5':
                 print("\n👋 ¡Hasta pronto!")
                 break
                 
+            elif opcion == '6':
+                self.modo_monitoreo_eventos()
+                
+            elif opcion == '7':
+                try:
+                    self.generar_visualizacion(encolar=True)
+                except ErrorConfiguracion as e:
+                    print(f"\n❌ {e}")
+                input("\nPresiona Enter para continuar...")
+                
             else:
                 print("\n❌ Opción inválida")
                 time.sleep(1)
 
 
-def main():
-    """Función principal"""
+def menu_interactivo():
+    """Menú interactivo (sin argumentos en la línea de comandos)"""
     print("""
     ╔═══════════════════════════════════════════════════════════╗
     ║                                                           ║
@@ -205,8 +646,8 @@ def main():
             return
     
     try:
-        app = Osmotrofia(api_key)
-        app.mostrar_menu()
+        with Osmotrofia(api_key) as app:
+            app.mostrar_menu()
         
     except Exception as e:
         print(f"\n❌ Error fatal: {e}")
@@ -214,5 +655,202 @@ def main():
         traceback.print_exc()
 
 
+
+def crear_parser():
+    """Parser de la línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog='osmotrofia',
+        description='Visualización de la computadora como colonia de hongos. Sin comando abre el menú.'
+    )
+    subcomandos = parser.add_subparsers(dest='comando', metavar='comando')
+    
+    # Opciones de métricas comunes a los comandos que miden algo
+    opciones_metricas = argparse.ArgumentParser(add_help=False)
+    opciones_metricas.add_argument('--metricas-puerto', type=int, metavar='PUERTO',
+                                   help='Exponer /metrics (Prometheus) y /metrics.json en este puerto')
+    opciones_metricas.add_argument('--metricas-json', metavar='ARCHIVO',
+                                   help='Al terminar, volcar los tiempos por etapa a este JSON')
+    
+    opciones_prompt = argparse.ArgumentParser(add_help=False)
+    opciones_prompt.add_argument('--max-tokens-prompt', type=int, metavar='TOKENS',
+                                 help='Presupuesto del prompt: condensa o quita primero las secciones '
+                                      'de menor prioridad (default: sin límite propio)')
+    
+    analyze = subcomandos.add_parser('analyze', parents=[opciones_metricas],
+                                     help='Tomar un snapshot del sistema (no usa la API)')
+    analyze.add_argument('--json', action='store_true', help='Imprimir el snapshot como JSON')
+    analyze.add_argument('--guardar', action='store_true', help='Agregar la muestra a muestras.bin')
+    analyze.add_argument('--ventana', type=float, default=1.0,
+                         help='Segundos de medición de la CPU (default: 1)')
+    
+    generate = subcomandos.add_parser('generate', parents=[opciones_metricas, opciones_prompt], help='Generar una visualización única')
+    generate.add_argument('--json-datos', action='store_true', help='Guardar también datos_*.json')
+    generate.add_argument('--stream', action='store_true',
+                          help='Mostrar la descripción a medida que la envía Gemini')
+    generate.add_argument('--proveedor', choices=PROVEEDORES, default='gemini',
+                          help='Proveedor de generación; auto elige el más rápido y sano (default: gemini)')
+    generate.add_argument('--encolar', action='store_true',
+                          help='Dejar la generación en la cola persistente para `worker`')
+    
+    monitor = subcomandos.add_parser('monitor', parents=[opciones_metricas, opciones_prompt], help='Monitoreo continuo')
+    monitor.add_argument('--modo', choices=('continuo', 'reactivo', 'async'), default='continuo',
+                         help='continuo: intervalo fijo; reactivo: solo ante cambios; async: asyncio')
+    monitor.add_argument('--minutos', type=float, default=5, help='Minutos entre generaciones (default: 5)')
+    monitor.add_argument('--muestreo', type=float, default=1.0, help='Segundos entre muestras (default: 1)')
+    monitor.add_argument('--proveedor', choices=PROVEEDORES, default='gemini',
+                         help='Proveedor de generación; auto enruta y, en modo async, cubre la cola lenta '
+                              'con el segundo proveedor (default: gemini)')
+    
+    monitor.add_argument('--compacto', action='store_true',
+                         help='Tras la primera generación, enviar completas solo las dimensiones que cambiaron')
+    monitor.add_argument('--encolar', action='store_true',
+                         help='Dejar las generaciones en la cola persistente para `worker` (p. ej. durante una caída)')
+    
+    worker = subcomandos.add_parser('worker', help='Procesar la cola de generaciones con un pool de procesos')
+    worker.add_argument('--paralelismo', type=int, default=2,
+                        help='Procesos trabajadores (generaciones simultáneas, default: 2)')
+    worker.add_argument('--vaciar', action='store_true',
+                        help='Terminar cuando la cola quede vacía (si no, esperar trabajos nuevos)')
+    worker.add_argument('--arriendo', type=float, default=120,
+                        help='Segundos tras los que un trabajo de un proceso caído vuelve a la cola (default: 120)')
+    worker.add_argument('--estado', action='store_true', help='Mostrar el estado de la cola y salir')
+    worker.add_argument('--reintentar-fallidos', action='store_true',
+                        help='Volver a encolar los trabajos fallidos antes de empezar')
+    
+    history = subcomandos.add_parser('history', help='Mostrar el historial de generaciones')
+    history.add_argument('--limite', type=int, default=20, help='Cantidad de generaciones (default: 20)')
+    history.add_argument('--proveedor', help="Filtrar por proveedor ('gemini', 'openai')")
+    history.add_argument('--fallidos', action='store_true', help='Solo generaciones fallidas')
+    history.add_argument('--json', action='store_true', help='Imprimir como JSON')
+    
+    return parser
+
+
+def _comando_analyze(args):
+    app = Osmotrofia(verboso=not args.json, ventana_cpu=args.ventana)
+    if not args.json:
+        parametros, salud = app.analizar_sistema()
+        if args.guardar:
+            app.registro.agregar_snapshot(parametros, salud)
+        return 0
+    
+    parametros, salud = app.tomar_muestra(guardar=args.guardar)
+    print(json.dumps({'salud_general': salud, 'parametros': parametros}, indent=2, ensure_ascii=False))
+    return 0
+
+
+def _comando_generate(args):
+    with Osmotrofia(proveedor=args.proveedor, max_tokens_prompt=args.max_tokens_prompt, encolar=args.encolar) as app:
+        # Crear el cliente antes de muestrear para fallar enseguida si falta la API key
+        app.cliente
+        resultado = app.generar_visualizacion(guardar_json=args.json_datos, en_vivo=args.stream)
+    if not resultado['exito']:
+        print(f"\n❌ Error: {resultado.get('error', 'Desconocido')}")
+        return 1
+    return 0
+
+
+def _comando_monitor(args):
+    with Osmotrofia(proveedor=args.proveedor, max_tokens_prompt=args.max_tokens_prompt,
+                    compacto=args.compacto, encolar=args.encolar) as app:
+        app.cliente
+        if args.modo == 'reactivo':
+            app.modo_monitoreo_eventos(intervalo_muestreo=args.muestreo)
+        elif args.modo == 'async':
+            app.modo_monitoreo_async(intervalo_muestreo=args.muestreo, intervalo_minutos=args.minutos)
+        else:
+            app.modo_monitoreo_continuo(args.minutos, intervalo_muestreo=args.muestreo)
+    return 0
+
+
+def _comando_worker(args):
+    from cola_trabajos import ColaTrabajos, PoolTrabajadores
+    
+    # Sin Osmotrofia: el pool no toca el registro de muestras, que puede estar escribiendo un monitor
+    os.makedirs(CARPETA_SALIDA, exist_ok=True)
+    cola = ColaTrabajos(os.path.join(CARPETA_SALIDA, 'cola.db'))
+    if args.reintentar_fallidos:
+        print(f"♻️  {cola.reintentar_fallidos()} trabajos fallidos vuelven a la cola")
+    if args.estado:
+        print(json.dumps(cola.estado(), indent=2, ensure_ascii=False))
+        return 0
+    
+    print(f"⚙️  {args.paralelismo} trabajadores procesando {cola.ruta} (Ctrl+C para detener)")
+    cola.cerrar()
+    estado = PoolTrabajadores(cola.ruta, paralelismo=args.paralelismo, arriendo=args.arriendo).ejecutar(
+        hasta_vaciar=args.vaciar
+    )
+    print(f"\n📋 Cola: {estado}")
+    return 0
+
+
+def _comando_history(args):
+    app = Osmotrofia(verboso=False)
+    exito = False if args.fallidos else None
+    generaciones = app.historial.ultimos(args.limite, proveedor=args.proveedor, exito=exito)
+    if args.json:
+        print(json.dumps(generaciones, indent=2, ensure_ascii=False, default=str))
+        return 0
+    
+    if not generaciones:
+        print("📜 No hay generaciones en el historial")
+    for gen in reversed(generaciones):
+        estado = '✅' if gen['exito'] else '❌'
+        detalle = gen.get('archivo_prompt') if gen['exito'] else gen.get('error')
+        print(f"{estado} #{gen['id']} {gen.get('timestamp')}  {detalle}")
+    return 0
+
+
+COMANDOS = {
+    'analyze': _comando_analyze,
+    'generate': _comando_generate,
+    'monitor': _comando_monitor,
+    'worker': _comando_worker,
+    'history': _comando_history
+}
+
+
+def main(argv=None):
+    """Función principal: subcomando no interactivo, o el menú si no se indica ninguno"""
+    args = crear_parser().parse_args(argv)
+    if args.comando is None:
+        menu_interactivo()
+        return 0
+    
+    servidor_metricas = _iniciar_metricas(args)
+    try:
+        return COMANDOS[args.comando](args)
+    except ErrorConfiguracion as e:
+        # API key faltante o proveedor desconocido
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    finally:
+        _finalizar_metricas(args, servidor_metricas)
+
+
+def _iniciar_metricas(args):
+    """Habilita las métricas si se pidió alguna salida; devuelve el servidor HTTP o None"""
+    puerto = getattr(args, 'metricas_puerto', None)
+    archivo = getattr(args, 'metricas_json', None)
+    if puerto is None and archivo is None:
+        return None
+    
+    METRICAS.habilitar()
+    if puerto is None:
+        return None
+    servidor = METRICAS.servir(puerto)
+    print(f"📈 Métricas en http://127.0.0.1:{puerto}/metrics", file=sys.stderr)
+    return servidor
+
+
+def _finalizar_metricas(args, servidor):
+    archivo = getattr(args, 'metricas_json', None)
+    if archivo:
+        METRICAS.volcar_json(archivo)
+        print(f"📈 Métricas guardadas en: {archivo}", file=sys.stderr)
+    if servidor is not None:
+        servidor.shutdown()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""
+Osmotrofia - Planificador
+Planificador monotónico por deadlines con varias cadencias y política para ticks perdidos
+"""
+
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import contar
+
+
+POLITICAS_TICKS_PERDIDOS = ('saltar', 'acumular')
+
+
+class TareaPeriodica:
+    """
+    Una cadencia del planificador.
+    
+    Los deadlines son inicio + k * periodo: el retraso de un tick no se arrastra
+    al siguiente. Lleva estadísticas del retraso (inicio real - deadline).
+    """
+    
+    def __init__(self, nombre, periodo, funcion, politica='saltar', en_hilo=False, fase=0.0):
+        if periodo <= 0:
+            raise ValueError("El periodo debe ser positivo")
+        if politica not in POLITICAS_TICKS_PERDIDOS:
+            raise ValueError(f"Política desconocida: {politica} (opciones: {', '.join(POLITICAS_TICKS_PERDIDOS)})")
+        
+        self.nombre = nombre
+        self.periodo = periodo
+        self.funcion = funcion
+        self.politica = politica
+        self.en_hilo = en_hilo
+        self.fase = fase
+        self.tick = 0
+        self._futuro = None
+        # Ticks 'acumular' que llegaron con la ejecución anterior en curso
+        self.pendientes = 0
+        
+        self.ejecuciones = 0
+        self.perdidos = 0
+        self.errores = 0
+        self.ultimo_error = None
+        self.ultimo_retraso = 0.0
+        self.max_retraso = 0.0
+        self._suma_retrasos = 0.0
+    
+    def registrar_retraso(self, retraso):
+        self.ejecuciones += 1
+        self.ultimo_retraso = retraso
+        self.max_retraso = max(self.max_retraso, retraso)
+        self._suma_retrasos += retraso
+    
+    def registrar_error(self, error):
+        self.errores += 1
+        self.ultimo_error = f'{type(error).__name__}: {error}'
+    
+    def estadisticas(self):
+        """Resumen de la cadencia (retrasos en segundos)"""
+        return {
+            'periodo': self.periodo,
+            'ejecuciones': self.ejecuciones,
+            'perdidos': self.perdidos,
+            'errores': self.errores,
+            'ultimo_error': self.ultimo_error,
+            'ultimo_retraso': self.ultimo_retraso,
+            'retraso_medio': self._suma_retrasos / self.ejecuciones if self.ejecuciones else 0.0,
+            'max_retraso': self.max_retraso
+        }
+
+
+class Planificador:
+    """
+    Ejecuta tareas periódicas contra el reloj monotónico.
+    
+    Cada tarea tiene su propio periodo (puede ser de fracciones de segundo).
+    Cuando un tick llega tarde por más de medio periodo se considera perdido:
+      - 'saltar': los ticks perdidos se descartan y la tarea sigue en la grilla
+        original, así las muestras quedan equiespaciadas.
+      - 'acumular': los ticks vencidos se juntan en una sola ejecución inmediata;
+        la función recibe `ticks` con la cantidad de ticks que cubre.
+    Las tareas con en_hilo=True (p. ej. llamadas a una API) corren en un pool y
+    no demoran a las demás; si la ejecución anterior sigue en curso no se
+    superponen: con 'saltar' el tick se cuenta como perdido y con 'acumular'
+    se suma a la próxima ejecución.
+    """
+    
+    def __init__(self, reloj=time.monotonic, max_hilos=2):
+        self._reloj = reloj
+        self._tareas = {}
+        self._cola = []
+        self._detener = threading.Event()
+        self._max_hilos = max_hilos
+        self._inicio = None
+    
+    def agregar(self, nombre, periodo, funcion, politica='saltar', en_hilo=False, fase=0.0):
+        """
+        Registra una cadencia
+        
+        Args:
+            nombre: Identificador de la tarea
+            periodo: Segundos entre ticks (float)
+            funcion: Callable sin argumentos; con politica='acumular' recibe ticks=n
+            politica: 'saltar' o 'acumular' (ver la clase)
+            en_hilo: Ejecutar en el pool del planificador
+            fase: Desfase en segundos del primer tick respecto del inicio
+        """
+        tarea = TareaPeriodica(nombre, periodo, funcion, politica, en_hilo, fase)
+        self._tareas[nombre] = tarea
+        return tarea
+    
+    def _deadline(self, tarea):
+        return self._inicio + tarea.fase + tarea.tick * tarea.periodo
+    
+    def detener(self):
+        """Pide al bucle que termine (se puede llamar desde otro hilo o desde una tarea)"""
+        self._detener.set()
+    
+    def ejecutar(self, duracion=None):
+        """
+        Corre el bucle hasta detener() o hasta `duracion` segundos
+        
+        Las excepciones de las tareas en línea se propagan; las de las tareas en
+        hilo se informan y se cuentan en `errores`, sin detener el bucle.
+        """
+        self._detener.clear()
+        self._inicio = self._reloj()
+        fin = None if duracion is None else self._inicio + duracion
+        self._cola = [(self._deadline(t), i, t) for i, t in enumerate(self._tareas.values())]
+        heapq.heapify(self._cola)
+        
+        pool = ThreadPoolExecutor(max_workers=self._max_hilos, thread_name_prefix='planificador')
+        try:
+            while self._cola and not self._detener.is_set():
+                deadline, orden, tarea = self._cola[0]
+                if fin is not None and deadline >= fin:
+                    break
+                
+                espera = deadline - self._reloj()
+                if espera > 0 and self._detener.wait(espera):
+                    break
+                
+                heapq.heappop(self._cola)
+                self._disparar(tarea, deadline, pool)
+                heapq.heappush(self._cola, (self._deadline(tarea), orden, tarea))
+        finally:
+            self._detener.set()
+            # No esperar a las tareas en hilo que sigan corriendo (p. ej. una llamada a la API)
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _disparar(self, tarea, deadline, pool):
+        ahora = self._reloj()
+        retraso = ahora - deadline
+        # Ticks cuyo deadline ya pasó (el actual incluido)
+        vencidos = int((ahora - deadline) // tarea.periodo) + 1
+        
+        if tarea.politica == 'saltar' and retraso > tarea.periodo / 2:
+            # Tarde: descartar este y los demás vencidos, y seguir en la grilla
+            tarea.perdidos += vencidos
+            tarea.tick += vencidos
+            return
+        
+        ticks = vencidos if tarea.politica == 'acumular' else 1
+        tarea.tick += ticks
+        
+        if tarea.en_hilo and tarea._futuro is not None and not tarea._futuro.done():
+            # Ocupada: con 'acumular' los ticks pasan a la próxima ejecución
+            if tarea.politica == 'acumular':
+                tarea.pendientes += ticks
+            else:
+                tarea.perdidos += 1
+            return
+        
+        ticks += tarea.pendientes
+        tarea.pendientes = 0
+        tarea.perdidos += ticks - 1
+        if tarea.en_hilo:
+            tarea._futuro = pool.submit(self._llamar_en_hilo, tarea, ticks)
+        else:
+            self._llamar(tarea, ticks)
+        tarea.registrar_retraso(retraso)
+    
+    @staticmethod
+    def _llamar(tarea, ticks):
+        if tarea.politica == 'acumular':
+            return tarea.funcion(ticks=ticks)
+        return tarea.funcion()
+    
+    @classmethod
+    def _llamar_en_hilo(cls, tarea, ticks):
+        # Un fallo (p. ej. de la API) no tiene que terminar el monitoreo
+        try:
+            cls._llamar(tarea, ticks)
+        except Exception as e:
+            tarea.registrar_error(e)
+            contar('tarea_errores', tarea=tarea.nombre)
+            print(f"⚠️  La tarea '{tarea.nombre}' falló: {tarea.ultimo_error}")
+    
+    def estadisticas(self):
+        """dict nombre -> estadísticas de retraso de cada tarea"""
+        return {nombre: tarea.estadisticas() for nombre, tarea in self._tareas.items()}
+    
+    def resumen(self):
+        """Líneas legibles con el retraso por cadencia"""
+        lineas = []
+        for nombre, e in self.estadisticas().items():
+            lineas.append(
+                f"{nombre}: {e['ejecuciones']} ejecuciones cada {e['periodo']}s, "
+                f"retraso medio {e['retraso_medio'] * 1000:.1f} ms, máx {e['max_retraso'] * 1000:.1f} ms, "
+                f"{e['perdidos']} ticks perdidos"
+                + (f", {e['errores']} errores" if e['errores'] else '')
+            )
+        return lineas
+
+
+# Función de prueba
+if __name__ == "__main__":
+    print("=== PRUEBA DEL PLANIFICADOR ===")
+    
+    instantes = []
+    inicio = time.monotonic()
+    
+    def muestrear():
+        instantes.append(time.monotonic() - inicio)
+    
+    def generar_lento():
+        print(f"  generación en t={time.monotonic() - inicio:.2f}s")
+        time.sleep(0.7)
+    
+    planificador = Planificador()
+    planificador.agregar('muestreo', 0.1, muestrear)
+    planificador.agregar('generacion', 0.5, generar_lento, en_hilo=True)
+    planificador.ejecutar(duracion=2.0)
+    
+    intervalos = [b - a for a, b in zip(instantes, instantes[1:])]
+    print(f"\n{len(instantes)} muestras; intervalo mín {min(intervalos):.3f}s, máx {max(intervalos):.3f}s")
+    for linea in planificador.resumen():
+        print(f"  {linea}")
@@ -0,0 +1,288 @@
+"""
+Osmotrofia - Política de Reintentos
+Clasificación de errores, backoff exponencial con jitter, Retry-After e interruptor de circuito
+"""
+
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from errores import ErrorProveedor
+from metricas import contar, observar, span
+
+
+# Códigos HTTP que indican un problema pasajero del proveedor
+CODIGOS_REINTENTABLES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+def leer_retry_after(valor, ahora=None):
+    """
+    Interpreta un encabezado Retry-After (segundos o fecha HTTP)
+    
+    Returns:
+        segundos a esperar (>= 0), o None si falta o es inválido
+    """
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    ahora = ahora or datetime.now(timezone.utc)
+    return max(0.0, (fecha - ahora).total_seconds())
+
+
+def describir_error(error):
+    """
+    Clasifica una excepción de un cliente
+    
+    Entiende ErrorProveedor, excepciones con .response (requests) y con .code
+    entero (google.api_core). Los errores de red (OSError, que incluye los de
+    requests) son reintentables; los 4xx que no están en CODIGOS_REINTENTABLES no.
+    
+    Returns:
+        dict con 'codigo', 'retry_after' y 'reintentable'
+    """
+    codigo = getattr(error, 'codigo', None)
+    retry_after = getattr(error, 'retry_after', None)
+    
+    respuesta = getattr(error, 'response', None)
+    if codigo is None and respuesta is not None:
+        codigo = getattr(respuesta, 'status_code', None)
+        encabezados = getattr(respuesta, 'headers', None) or {}
+        retry_after = leer_retry_after(encabezados.get('Retry-After'))
+    if codigo is None and isinstance(getattr(error, 'code', None), int):
+        codigo = error.code
+    
+    if codigo is not None:
+        reintentable = codigo in CODIGOS_REINTENTABLES or codigo >= 500
+    else:
+        # Sin código: los errores de red y los desconocidos se reintentan; los de datos no
+        reintentable = not isinstance(error, (ValueError, TypeError, KeyError))
+    
+    return {'codigo': codigo, 'retry_after': retry_after, 'reintentable': reintentable}
+
+
+def etiqueta_resultado(resultado):
+    """Valor de la etiqueta 'resultado' de un intento: ok, cache, error_<código> o error"""
+    if resultado.get('exito'):
+        return 'cache' if resultado.get('cache') else 'ok'
+    codigo = resultado.get('codigo')
+    return f'error_{codigo}' if codigo else 'error'
+
+
+class InterruptorCircuito:
+    """
+    Interruptor de circuito por proveedor.
+    
+    Tras `umbral_fallos` fallos seguidos se abre y rechaza llamadas durante
+    `tiempo_abierto` segundos; después deja pasar una sola llamada de prueba
+    (semiabierto) que lo cierra si sale bien o lo vuelve a abrir si falla.
+    """
+    
+    def __init__(self, umbral_fallos=5, tiempo_abierto=60.0, reloj=time.monotonic):
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_abierto = tiempo_abierto
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = None
+        self._prueba_en_curso = False
+    
+    @property
+    def estado(self):
+        with self._lock:
+            if self._abierto_hasta is None:
+                return 'cerrado'
+            return 'abierto' if self._reloj() < self._abierto_hasta else 'semiabierto'
+    
+    def permitir(self):
+        """
+        Pide permiso para una llamada
+        
+        Returns:
+            0 si puede llamar; si no, segundos que faltan para reintentar
+        """
+        with self._lock:
+            if self._abierto_hasta is None:
+                return 0
+            restante = self._abierto_hasta - self._reloj()
+            if restante > 0:
+                return restante
+            if self._prueba_en_curso:
+                return self.tiempo_abierto
+            self._prueba_en_curso = True
+            return 0
+    
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._abierto_hasta = None
+            self._prueba_en_curso = False
+    
+    def liberar(self):
+        """Descarta una llamada de prueba que no llegó a terminar (p. ej. cancelada)"""
+        with self._lock:
+            self._prueba_en_curso = False
+    
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._prueba_en_curso or self._fallos >= self.umbral_fallos:
+                self._abierto_hasta = self._reloj() + self.tiempo_abierto
+            self._prueba_en_curso = False
+
+
+class PoliticaReintentos:
+    """
+    Decide si reintentar un resultado fallido y cuánto esperar.
+    
+    Trabaja sobre los dicts de resultado de los clientes: un fallo lleva
+    'reintentable', 'codigo' y 'retry_after' (ver describir_error). La espera
+    es backoff exponencial con jitter completo, o el Retry-After del proveedor
+    si es mayor. ejecutar() duerme con time.sleep; ejecutar_async() con asyncio.sleep.
+    """
+    
+    def __init__(self, max_intentos=3, base=1.0, maximo=30.0, max_retry_after=120.0,
+                 interruptor=None, aleatorio=random.random, nombre='proveedor'):
+        """
+        Args:
+            max_intentos: Intentos por llamada (incluido el primero)
+            base: Espera base en segundos; se duplica en cada intento
+            maximo: Tope de la espera calculada
+            max_retry_after: Retry-After más largo que se acepta esperar; si el
+                             proveedor pide más, se devuelve el fallo
+            interruptor: InterruptorCircuito (por defecto uno nuevo)
+            aleatorio: Fuente de números en [0, 1) para el jitter
+            nombre: Etiqueta 'proveedor' de las métricas de esta política
+        """
+        self.max_intentos = max_intentos
+        self.base = base
+        self.maximo = maximo
+        self.max_retry_after = max_retry_after
+        self.interruptor = interruptor if interruptor is not None else InterruptorCircuito()
+        self._aleatorio = aleatorio
+        self.nombre = nombre
+    
+    def espera(self, intento, resultado=None):
+        """Segundos a esperar después del intento número `intento` (desde 0)"""
+        tope = min(self.maximo, self.base * (2 ** intento))
+        espera = self._aleatorio() * tope
+        retry_after = (resultado or {}).get('retry_after')
+        if retry_after is not None:
+            espera = max(espera, retry_after)
+        return espera
+    
+    def _circuito_abierto(self, restante):
+        contar('circuito_abierto', proveedor=self.nombre)
+        print(f"⛔ Proveedor en pausa tras fallos repetidos; reintentar en {restante:.0f}s")
+        return {
+            'exito': False,
+            'error': 'Circuito abierto: demasiados fallos seguidos del proveedor',
+            'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
+            'codigo': None,
+            'retry_after': restante,
+            'reintentable': False,
+            'circuito_abierto': True
+        }
+    
+    def _siguiente(self, intento, max_intentos, resultado):
+        """Registra el resultado; devuelve la espera antes del próximo intento, o None para terminar"""
+        if resultado['exito']:
+            self.interruptor.registrar_exito()
+            return None
+        
+        reintentable = resultado.get('reintentable', True)
+        if reintentable:
+            self.interruptor.registrar_fallo()
+        else:
+            # Un error fatal (p. ej. 400) prueba que el proveedor responde
+            self.interruptor.registrar_exito()
+        if not reintentable or intento >= max_intentos - 1:
+            return None
+        
+        espera = self.espera(intento, resultado)
+        if espera > self.max_retry_after:
+            return None
+        observar('reintento_espera_segundos', espera, proveedor=self.nombre)
+        print(f"⏳ Esperando {espera:.1f}s antes de reintentar...")
+        return espera
+    
+    def ejecutar(self, llamada, max_intentos=None):
+        """
+        Llama a `llamada()` (que devuelve un dict de resultado) con reintentos
+        
+        Returns:
+            el último resultado
+        """
+        max_intentos = max_intentos or self.max_intentos
+        for intento in range(max_intentos):
+            restante = self.interruptor.permitir()
+            if restante:
+                return self._circuito_abierto(restante)
+            
+            print(f"Intento {intento + 1}/{max_intentos}")
+            try:
+                with span('proveedor.intento', proveedor=self.nombre) as medicion:
+                    resultado = llamada()
+                    medicion.etiqueta('resultado', etiqueta_resultado(resultado))
+            except BaseException:
+                self.interruptor.liberar()
+                raise
+            espera = self._siguiente(intento, max_intentos, resultado)
+            if espera is None:
+                return resultado
+            time.sleep(espera)
+        return resultado
+    
+    async def ejecutar_async(self, llamada, max_intentos=None):
+        """Como ejecutar(), pero `llamada()` devuelve un awaitable y la espera no bloquea el event loop"""
+        max_intentos = max_intentos or self.max_intentos
+        for intento in range(max_intentos):
+            restante = self.interruptor.permitir()
+            if restante:
+                return self._circuito_abierto(restante)
+            
+            print(f"Intento {intento + 1}/{max_intentos}")
+            try:
+                with span('proveedor.intento', proveedor=self.nombre) as medicion:
+                    resultado = await llamada()
+                    medicion.etiqueta('resultado', etiqueta_resultado(resultado))
+            except BaseException:
+                self.interruptor.liberar()
+                raise
+            espera = self._siguiente(intento, max_intentos, resultado)
+            if espera is None:
+                return resultado
+            await asyncio.sleep(espera)
+        return resultado
+
+
+# Función de prueba
+if __name__ == "__main__":
+    print("=== PRUEBA DE POLÍTICA DE REINTENTOS ===")
+    
+    politica = PoliticaReintentos(base=0.1, interruptor=InterruptorCircuito(umbral_fallos=3, tiempo_abierto=1))
+    
+    def falla():
+        return {'exito': False, 'error': 'Error de API: 503', **describir_error(ErrorProveedor('503', 503))}
+    
+    print("\nPrimera llamada (3 intentos con backoff):")
+    print(politica.ejecutar(falla)['error'])
+    print(f"\nEstado del interruptor: {politica.interruptor.estado}")
+    print("\nSegunda llamada (falla rápido):")
+    print(politica.ejecutar(falla)['error'])
+    
+    print("\nClasificación:")
+    for error in (ErrorProveedor('400', 400), ErrorProveedor('429', 429, retry_after=7), ConnectionError('red')):
+        print(f"  {error!r}: {describir_error(error)}")
@@ -0,0 +1,298 @@
+"""
+Osmotrofia - Registro de Muestras
+Log binario append-only de registros de ancho fijo, con índice lateral y lector mmap
+"""
+
+import glob
+import json
+import mmap
+import os
+import struct
+
+from serie_temporal import CAMPOS_MUESTRA, extraer_muestra
+
+
+MAGIA = b'OSMO'
+VERSION = 1
+
+# Cabecera: magia, versión, cantidad de campos, tamaño de registro (16 bytes)
+CABECERA = struct.Struct('<4sHHI4x')
+# Registro: timestamp epoch (float64) + un float32 por campo
+REGISTRO = struct.Struct('<d' + 'f' * len(CAMPOS_MUESTRA))
+# Entrada del índice lateral: timestamp del primer registro del bloque y número de registro
+ENTRADA_INDICE = struct.Struct('<dQ')
+
+# Cada cuántos registros se agrega una entrada al índice
+REGISTROS_POR_BLOQUE = 4096
+
+
+def _ruta_indice(ruta):
+    return ruta + '.idx'
+
+
+class RegistroMuestras:
+    """
+    Escritor append-only.
+    
+    Cada muestra es un registro de ancho fijo; el índice lateral guarda el timestamp
+    del primer registro de cada bloque de REGISTROS_POR_BLOQUE para ubicar rangos de tiempo.
+    """
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        carpeta = os.path.dirname(ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        
+        self._archivo = open(ruta, 'ab')
+        if self._archivo.tell() == 0:
+            self._archivo.write(CABECERA.pack(MAGIA, VERSION, len(CAMPOS_MUESTRA), REGISTRO.size))
+            self._archivo.flush()
+        else:
+            _validar_cabecera(ruta)
+            # Descartar un registro parcial que haya quedado de una escritura interrumpida
+            datos = self._archivo.tell() - CABECERA.size
+            sobrante = datos % REGISTRO.size
+            if sobrante:
+                self._archivo.truncate(self._archivo.tell() - sobrante)
+                self._archivo.seek(0, os.SEEK_END)
+        
+        self._cantidad = (self._archivo.tell() - CABECERA.size) // REGISTRO.size
+        self._reparar_indice()
+        self._indice = open(_ruta_indice(ruta), 'ab')
+    
+    def _reparar_indice(self):
+        """Deja el índice con exactamente una entrada por bloque existente"""
+        ruta_indice = _ruta_indice(self.ruta)
+        esperadas = -(-self._cantidad // REGISTROS_POR_BLOQUE)
+        tamano = os.path.getsize(ruta_indice) if os.path.exists(ruta_indice) else 0
+        if tamano == esperadas * ENTRADA_INDICE.size:
+            return
+        
+        # Índice perdido o con entradas de más por una escritura interrumpida: reconstruirlo
+        with open(self.ruta, 'rb') as f, open(ruta_indice, 'wb') as indice:
+            for bloque in range(esperadas):
+                registro = bloque * REGISTROS_POR_BLOQUE
+                f.seek(CABECERA.size + registro * REGISTRO.size)
+                timestamp = struct.unpack('<d', f.read(8))[0]
+                indice.write(ENTRADA_INDICE.pack(timestamp, registro))
+    
+    def __len__(self):
+        return self._cantidad
+    
+    def agregar(self, timestamp, valores):
+        """Agrega una muestra al final del log"""
+        if self._cantidad % REGISTROS_POR_BLOQUE == 0:
+            self._indice.write(ENTRADA_INDICE.pack(timestamp, self._cantidad))
+            self._indice.flush()
+        
+        self._archivo.write(REGISTRO.pack(timestamp, *valores))
+        # Sin fsync: flush basta para que los lectores vean el registro
+        self._archivo.flush()
+        self._cantidad += 1
+    
+    def agregar_snapshot(self, parametros, salud):
+        """Agrega un snapshot de MonitorSistema"""
+        self.agregar(*extraer_muestra(parametros, salud))
+    
+    def cerrar(self):
+        self._archivo.close()
+        self._indice.close()
+
+
+def _validar_cabecera(ruta):
+    with open(ruta, 'rb') as f:
+        magia, version, campos, tamano = CABECERA.unpack(f.read(CABECERA.size))
+    if magia != MAGIA or version != VERSION:
+        raise ValueError(f"{ruta} no es un registro de muestras v{VERSION}")
+    if campos != len(CAMPOS_MUESTRA) or tamano != REGISTRO.size:
+        raise ValueError(f"{ruta} tiene {campos} campos; se esperaban {len(CAMPOS_MUESTRA)}")
+
+
+class LectorMuestras:
+    """
+    Lector de solo lectura sobre un mmap del log.
+    
+    No parsea nada hasta que se accede a un registro; los rangos de tiempo se
+    ubican con el índice lateral y una búsqueda binaria dentro del bloque.
+    """
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        _validar_cabecera(ruta)
+        
+        with open(ruta, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cantidad = (len(self._mmap) - CABECERA.size) // REGISTRO.size
+        
+        self._indice = []
+        try:
+            with open(_ruta_indice(ruta), 'rb') as f:
+                datos = f.read()
+            datos = datos[:len(datos) - len(datos) % ENTRADA_INDICE.size]
+            # Ignorar entradas de bloques que este mmap todavía no ve
+            bloques = -(-self._cantidad // REGISTROS_POR_BLOQUE)
+            self._indice = [t for t, _ in ENTRADA_INDICE.iter_unpack(datos)][:bloques]
+        except OSError:
+            pass
+    
+    def __len__(self):
+        return self._cantidad
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.cerrar()
+    
+    def cerrar(self):
+        self._mmap.close()
+    
+    @property
+    def mapa(self):
+        """mmap subyacente, para construir vistas externas (p. ej. con NumPy)"""
+        return self._mmap
+    
+    def registro(self, i):
+        """Devuelve (timestamp, valores) del registro i"""
+        if i < 0:
+            i += self._cantidad
+        if not 0 <= i < self._cantidad:
+            raise IndexError(i)
+        registro = REGISTRO.unpack_from(self._mmap, CABECERA.size + i * REGISTRO.size)
+        return registro[0], registro[1:]
+    
+    def _timestamp(self, i):
+        return struct.unpack_from('<d', self._mmap, CABECERA.size + i * REGISTRO.size)[0]
+    
+    def _buscar(self, timestamp, derecha=False):
+        """Primer registro con timestamp >= (o > si derecha) al dado"""
+        # El índice acota la búsqueda a un bloque
+        bajo, alto = 0, len(self._indice)
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._indice[medio] < timestamp or (derecha and self._indice[medio] == timestamp):
+                bajo = medio + 1
+            else:
+                alto = medio
+        bloque = max(bajo - 1, 0)
+        inicio = bloque * REGISTROS_POR_BLOQUE
+        fin = self._cantidad if bajo >= len(self._indice) else min(bajo * REGISTROS_POR_BLOQUE, self._cantidad)
+        
+        while inicio < fin:
+            medio = (inicio + fin) // 2
+            valor = self._timestamp(medio)
+            if valor < timestamp or (derecha and valor == timestamp):
+                inicio = medio + 1
+            else:
+                fin = medio
+        return inicio
+    
+    def rango(self, desde=None, hasta=None):
+        """Índices [inicio, fin) de los registros entre dos timestamps epoch (hasta incluido)"""
+        inicio = 0 if desde is None else self._buscar(desde)
+        fin = self._cantidad if hasta is None else self._buscar(hasta, derecha=True)
+        return inicio, max(inicio, fin)
+    
+    def _vista(self, inicio, fin):
+        fin = self._cantidad if fin is None else min(fin, self._cantidad)
+        inicio = min(inicio, fin)
+        return memoryview(self._mmap)[CABECERA.size + inicio * REGISTRO.size:CABECERA.size + fin * REGISTRO.size]
+    
+    def iterar(self, inicio=0, fin=None):
+        """
+        Itera (timestamp, valores) sobre los registros [inicio, fin) sin copiar el archivo
+        
+        Lee registro por registro del mmap sin retener una vista, así cerrar() funciona
+        aunque quede un iterador sin agotar (que al seguir avanzando da ValueError).
+        """
+        fin = self._cantidad if fin is None else min(fin, self._cantidad)
+        for i in range(max(inicio, 0), fin):
+            registro = REGISTRO.unpack_from(self._mmap, CABECERA.size + i * REGISTRO.size)
+            yield registro[0], registro[1:]
+    
+    def columna(self, campo, inicio=0, fin=None):
+        """Lista con los valores de un campo ('timestamp' o de CAMPOS_MUESTRA) en [inicio, fin)"""
+        posicion = 0 if campo == 'timestamp' else CAMPOS_MUESTRA.index(campo) + 1
+        with self._vista(inicio, fin) as vista:
+            return [registro[posicion] for registro in REGISTRO.iter_unpack(vista)]
+
+
+def _leer_registros(ruta):
+    """Registros empaquetados (bytes) de un log existente, en orden"""
+    if not os.path.exists(ruta):
+        return []
+    with LectorMuestras(ruta) as lector:
+        datos = lector.mapa[CABECERA.size:CABECERA.size + len(lector) * REGISTRO.size]
+    return [datos[i:i + REGISTRO.size] for i in range(0, len(datos), REGISTRO.size)]
+
+
+def convertir_json(carpeta, ruta_registro):
+    """
+    Incorpora los datos_*.json de una carpeta al registro binario
+    
+    rango() necesita el log ordenado por timestamp, y el de la aplicación ya tiene
+    muestras nuevas: las convertidas se intercalan con las existentes en un archivo
+    nuevo que reemplaza al anterior. Las muestras ya presentes se omiten, así que
+    convertir dos veces no duplica nada. No usar mientras un monitor escribe el log.
+    
+    Returns:
+        cantidad de muestras agregadas
+    """
+    existentes = _leer_registros(ruta_registro)
+    presentes = set(existentes)
+    nuevos = []
+    for archivo in sorted(glob.glob(os.path.join(carpeta, 'datos_*.json'))):
+        try:
+            with open(archivo, encoding='utf-8') as f:
+                datos = json.load(f)
+            timestamp, valores = extraer_muestra(datos['parametros'], datos['salud_general'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  {archivo} omitido: {e}")
+            continue
+        empaquetado = REGISTRO.pack(timestamp, *valores)
+        if empaquetado not in presentes:
+            presentes.add(empaquetado)
+            nuevos.append(empaquetado)
+    if not nuevos:
+        return 0
+    
+    # Orden estable: a igual timestamp se conserva el orden original
+    todos = sorted(existentes + nuevos, key=lambda registro: struct.unpack_from('<d', registro)[0])
+    temporal = ruta_registro + '.tmp'
+    for ruta in (temporal, _ruta_indice(temporal)):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    escritor = RegistroMuestras(temporal)
+    try:
+        for empaquetado in todos:
+            registro = REGISTRO.unpack(empaquetado)
+            escritor.agregar(registro[0], registro[1:])
+    finally:
+        escritor.cerrar()
+    
+    # Sin índice el log sigue siendo legible (y RegistroMuestras lo reconstruye),
+    # así que una caída entre los dos reemplazos no deja un índice de otro archivo
+    if os.path.exists(_ruta_indice(ruta_registro)):
+        os.remove(_ruta_indice(ruta_registro))
+    os.replace(temporal, ruta_registro)
+    os.replace(_ruta_indice(temporal), _ruta_indice(ruta_registro))
+    return len(nuevos)
+
+
+# Conversión de los JSON existentes
+if __name__ == "__main__":
+    import sys
+    
+    carpeta = sys.argv[1] if len(sys.argv) > 1 else 'osmotrofia_output'
+    destino = os.path.join(carpeta, 'muestras.bin')
+    
+    print("=== CONVERSIÓN DE datos_*.json A REGISTRO BINARIO ===")
+    cantidad = convertir_json(carpeta, destino)
+    print(f"✅ {cantidad} muestras agregadas a {destino}")
+    
+    with LectorMuestras(destino) as lector:
+        print(f"📊 El registro contiene {len(lector)} muestras")
+        if len(lector):
+            timestamp, valores = lector.registro(-1)
+            print(f"Última muestra: {dict(zip(CAMPOS_MUESTRA, valores))}")
@@ -0,0 +1,172 @@
+"""
+Osmotrofia - Serie Temporal
+Buffer circular de capacidad fija para las muestras numéricas del monitor
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+
+# Columnas numéricas que se guardan por muestra (además del timestamp)
+CAMPOS_MUESTRA = (
+    'cpu',
+    'ram',
+    'disco',
+    'temperatura',
+    'bateria',
+    'procesos_total',
+    'procesos_innecesarios',
+    'procesos_pesados',
+    'salud'
+)
+
+
+def extraer_muestra(parametros, salud):
+    """
+    Aplana un snapshot de MonitorSistema en (timestamp, valores)
+    
+    Returns:
+        tupla (timestamp_epoch, tupla de valores en el orden de CAMPOS_MUESTRA)
+    """
+    timestamp = datetime.fromisoformat(parametros['timestamp']).timestamp()
+    hardware = parametros['hardware']
+    rendimiento = parametros['rendimiento']
+    procesos = parametros['software']['procesos']
+    
+    return timestamp, (
+        rendimiento['cpu']['uso_porcentaje'],
+        rendimiento['ram']['uso_porcentaje'],
+        rendimiento['almacenamiento']['uso_porcentaje'],
+        hardware['temperatura']['cpu'],
+        hardware['bateria']['porcentaje'],
+        procesos['total'],
+        procesos['innecesarios'],
+        procesos['pesados'],
+        salud
+    )
+
+
+class SerieTemporal:
+    """
+    Buffer circular columnar: un array preasignado por campo.
+    
+    Agregar es O(1) y no asigna memoria; las vistas devuelven memoryviews sobre
+    los arrays (sin copias). 24 h a 1 s (86400 muestras) ocupan unos 3.8 MB.
+    """
+    
+    def __init__(self, capacidad=86400):
+        if capacidad <= 0:
+            raise ValueError("La capacidad debe ser positiva")
+        
+        self.capacidad = capacidad
+        self._tiempos = array('d', bytes(8 * capacidad))
+        self._columnas = {campo: array('f', bytes(4 * capacidad)) for campo in CAMPOS_MUESTRA}
+        self._vistas = {campo: memoryview(col) for campo, col in self._columnas.items()}
+        self._vistas['timestamp'] = memoryview(self._tiempos)
+        self._inicio = 0
+        self._n = 0
+    
+    def __len__(self):
+        return self._n
+    
+    def agregar(self, timestamp, valores):
+        """Agrega una muestra; si el buffer está lleno sobrescribe la más antigua"""
+        if self._n < self.capacidad:
+            posicion = (self._inicio + self._n) % self.capacidad
+            self._n += 1
+        else:
+            posicion = self._inicio
+            self._inicio = (self._inicio + 1) % self.capacidad
+        
+        self._tiempos[posicion] = timestamp
+        for columna, valor in zip(self._columnas.values(), valores):
+            columna[posicion] = valor
+    
+    def agregar_snapshot(self, parametros, salud):
+        """Agrega un snapshot de MonitorSistema"""
+        self.agregar(*extraer_muestra(parametros, salud))
+    
+    def _segmentos(self, inicio, cantidad):
+        """Rangos físicos (a, b) que cubren `cantidad` muestras desde la posición lógica `inicio`"""
+        if cantidad <= 0:
+            return []
+        a = (self._inicio + inicio) % self.capacidad
+        b = a + cantidad
+        if b <= self.capacidad:
+            return [(a, b)]
+        return [(a, self.capacidad), (0, b - self.capacidad)]
+    
+    def vista(self, campo, ultimas=None):
+        """
+        Vistas sin copia de un campo, en orden cronológico
+        
+        Args:
+            campo: 'timestamp' o un nombre de CAMPOS_MUESTRA
+            ultimas: Cantidad de muestras más recientes (None = todas)
+        
+        Returns:
+            lista de uno o dos memoryviews (dos cuando la ventana da la vuelta al buffer)
+        """
+        cantidad = self._n if ultimas is None else min(ultimas, self._n)
+        memoria = self._vistas[campo]
+        return [memoria[a:b] for a, b in self._segmentos(self._n - cantidad, cantidad)]
+    
+    def _posicion_tiempo(self, timestamp, buscar=bisect_left):
+        """Posición lógica de un timestamp (las muestras se asumen en orden cronológico)"""
+        posicion = 0
+        for a, b in self._segmentos(0, self._n):
+            indice = buscar(self._tiempos, timestamp, a, b)
+            if indice < b:
+                return posicion + indice - a
+            posicion += b - a
+        return posicion
+    
+    def vista_tiempo(self, campo, desde, hasta=None):
+        """Vistas sin copia de un campo entre dos timestamps epoch (hasta incluido)"""
+        inicio = self._posicion_tiempo(desde)
+        fin = self._n if hasta is None else self._posicion_tiempo(hasta, bisect_right)
+        memoria = self._vistas[campo]
+        return [memoria[a:b] for a, b in self._segmentos(inicio, fin - inicio)]
+    
+    def ultima(self):
+        """Última muestra como dict, o None si la serie está vacía"""
+        if not self._n:
+            return None
+        posicion = (self._inicio + self._n - 1) % self.capacidad
+        muestra = {'timestamp': self._tiempos[posicion]}
+        for campo, columna in self._columnas.items():
+            muestra[campo] = columna[posicion]
+        return muestra
+    
+    def reducir(self, campo, tamano_cubo, ultimas=None):
+        """
+        Submuestrea un campo en cubos de `tamano_cubo` muestras consecutivas
+        
+        Returns:
+            lista de tuplas (timestamp_inicial, minimo, maximo, promedio) por cubo
+        """
+        if tamano_cubo <= 0:
+            raise ValueError("El tamaño de cubo debe ser positivo")
+        
+        cubos = []
+        valores = (v for segmento in self.vista(campo, ultimas) for v in segmento)
+        tiempos = (t for segmento in self.vista('timestamp', ultimas) for t in segmento)
+        
+        cuenta = 0
+        for tiempo, valor in zip(tiempos, valores):
+            if cuenta == 0:
+                inicio, minimo, maximo, suma = tiempo, valor, valor, 0.0
+            elif valor < minimo:
+                minimo = valor
+            elif valor > maximo:
+                maximo = valor
+            suma += valor
+            cuenta += 1
+            if cuenta == tamano_cubo:
+                cubos.append((inicio, minimo, maximo, suma / cuenta))
+                cuenta = 0
+        
+        if cuenta:
+            cubos.append((inicio, minimo, maximo, suma / cuenta))
+        return cubos
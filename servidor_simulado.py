@@ -0,0 +1,413 @@
+"""
+Osmotrofia - Servidor Simulado
+Servidor HTTP local que imita las APIs de OpenAI y Gemini, con latencia y errores inyectados
+
+Uso:
+    python servidor_simulado.py --puerto 8765 --latencia 0.8 --prob-429 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 GEMINI_BASE_URL=http://127.0.0.1:8765 \\
+        OPENAI_API_KEY=x GEMINI_API_KEY=x python osmotrofia.py generate
+    
+    python servidor_simulado.py --carga 50 --concurrencia 4   # prueba de carga con OpenAIClientAsync
+    python servidor_simulado.py --carga 20 --proveedor gemini [--stream]   # con GeminiClientAsync
+"""
+
+import base64
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DISTRIBUCIONES_LATENCIA = ('fija', 'uniforme', 'lognormal')
+
+RUTA_OPENAI = '/v1/images/generations'
+RUTA_IMAGEN = re.compile(r'^/imagenes/(?P<id>[0-9a-f]+)\.png$')
+RUTA_GEMINI = re.compile(r'^/v1(beta)?/models/(?P<modelo>[^/:]+):(?P<metodo>generateContent|streamGenerateContent)$')
+
+
+class ConfiguracionSimulacion:
+    """Comportamiento del servidor; se puede modificar en caliente desde otro hilo"""
+    
+    def __init__(self, latencia=0.5, distribucion='lognormal', dispersion=0.5, latencia_descarga=0.05,
+                 prob_429=0.0, prob_500=0.0, retry_after=1, tamano_imagen=1024 * 1024,
+                 tamano_texto=1200, fragmentos_texto=8, latencia_fragmento=0.05, semilla=None):
+        """
+        Args:
+            latencia: Latencia mediana (s) de las generaciones
+            distribucion: 'fija', 'uniforme' (entre 0 y 2*latencia) o 'lognormal'
+            dispersion: Sigma de la lognormal (colas más largas con valores mayores)
+            latencia_descarga: Latencia fija (s) de la descarga de imágenes
+            prob_429: Probabilidad de responder 429 con Retry-After
+            prob_500: Probabilidad de responder 500
+            retry_after: Segundos del encabezado Retry-After en los 429
+            tamano_imagen: Bytes de cada imagen generada
+            tamano_texto: Caracteres de cada descripción de Gemini
+            fragmentos_texto: En cuántos fragmentos se envía la descripción por streaming
+            latencia_fragmento: Segundos entre fragmentos del streaming (la latencia
+                                sorteada es la del primero)
+            semilla: Semilla del generador aleatorio (reproducible)
+        """
+        if distribucion not in DISTRIBUCIONES_LATENCIA:
+            raise ValueError(f"Distribución desconocida: {distribucion}")
+        self.latencia = latencia
+        self.distribucion = distribucion
+        self.dispersion = dispersion
+        self.latencia_descarga = latencia_descarga
+        self.prob_429 = prob_429
+        self.prob_500 = prob_500
+        self.retry_after = retry_after
+        self.tamano_imagen = tamano_imagen
+        self.tamano_texto = tamano_texto
+        self.fragmentos_texto = fragmentos_texto
+        self.latencia_fragmento = latencia_fragmento
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+    
+    def muestrear_latencia(self):
+        with self._lock:
+            if self.distribucion == 'fija':
+                return self.latencia
+            if self.distribucion == 'uniforme':
+                return self._azar.uniform(0, 2 * self.latencia)
+            return self.latencia * self._azar.lognormvariate(0, self.dispersion)
+    
+    def sortear_error(self):
+        """Código de error a inyectar, o None"""
+        with self._lock:
+            tirada = self._azar.random()
+        if tirada < self.prob_429:
+            return 429
+        if tirada < self.prob_429 + self.prob_500:
+            return 500
+        return None
+
+
+def png_sintetico(tamano):
+    """PNG válido (escala de grises) de aproximadamente `tamano` bytes"""
+    lado = max(1, int(tamano ** 0.5))
+    
+    def bloque(tipo, datos):
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos))
+    
+    filas = b''.join(b'\x00' + os.urandom(lado) for _ in range(lado))
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + bloque(b'IHDR', struct.pack('>IIBBBBB', lado, lado, 8, 0, 0, 0, 0))
+        + bloque(b'IDAT', zlib.compress(filas, 0))
+        + bloque(b'IEND', b'')
+    )
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, formato, *args):
+        pass
+    
+    @property
+    def _servidor(self):
+        return self.server.simulado
+    
+    def _responder(self, codigo, cuerpo, tipo='application/json', encabezados=None):
+        if not isinstance(cuerpo, bytes):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in (encabezados or {}).items():
+            self.send_header(nombre, str(valor))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+        self._servidor.contar(self.path.split('?')[0], codigo)
+    
+    def _leer_json(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(largo) or b'{}')
+        except ValueError:
+            return None
+    
+    def _inyectar_error(self, formato_error):
+        """Espera la latencia sorteada y responde un error si toca; devuelve True si respondió"""
+        configuracion = self._servidor.configuracion
+        time.sleep(configuracion.muestrear_latencia())
+        codigo = configuracion.sortear_error()
+        if codigo is None:
+            return False
+        encabezados = {'Retry-After': configuracion.retry_after} if codigo == 429 else None
+        self._responder(codigo, formato_error(codigo), encabezados=encabezados)
+        return True
+    
+    def do_POST(self):
+        ruta = self.path.split('?')[0]
+        if ruta == RUTA_OPENAI:
+            return self._openai()
+        coincidencia = RUTA_GEMINI.match(ruta)
+        if coincidencia:
+            return self._gemini(coincidencia.group('modelo'), coincidencia.group('metodo'))
+        self._responder(404, {'error': {'message': f'Ruta desconocida: {ruta}'}})
+    
+    def do_GET(self):
+        ruta = self.path.split('?')[0]
+        if ruta == '/__estadisticas':
+            return self._responder(200, self._servidor.estadisticas())
+        coincidencia = RUTA_IMAGEN.match(ruta)
+        if coincidencia is None:
+            return self._responder(404, {'error': {'message': f'Ruta desconocida: {ruta}'}})
+        
+        time.sleep(self._servidor.configuracion.latencia_descarga)
+        imagen = self._servidor.imagen(coincidencia.group('id'))
+        if imagen is None:
+            return self._responder(404, {'error': {'message': 'Imagen expirada'}})
+        self._responder(200, imagen, tipo='image/png')
+    
+    def _openai(self):
+        datos = self._leer_json()
+        if not datos or not datos.get('prompt'):
+            return self._responder(400, {'error': {'message': 'Falta el prompt', 'type': 'invalid_request_error'}})
+        if self._inyectar_error(lambda codigo: {'error': {'message': f'Error simulado {codigo}', 'type': 'server_error'}}):
+            return
+        
+        imagen = png_sintetico(self._servidor.configuracion.tamano_imagen)
+        respuesta = {'revised_prompt': f"[simulado] {datos['prompt'][:200]}"}
+        if datos.get('response_format') == 'b64_json':
+            respuesta['b64_json'] = base64.b64encode(imagen).decode('ascii')
+        else:
+            identificador = self._servidor.guardar_imagen(imagen)
+            respuesta['url'] = f'{self._servidor.url}/imagenes/{identificador}.png'
+        self._responder(200, {'created': int(time.time()), 'data': [respuesta]})
+    
+    def _gemini(self, modelo, metodo='generateContent'):
+        datos = self._leer_json()
+        if datos is None or not datos.get('contents'):
+            return self._responder(400, {'error': {'code': 400, 'message': 'contents vacío', 'status': 'INVALID_ARGUMENT'}})
+        estados = {429: 'RESOURCE_EXHAUSTED', 500: 'INTERNAL'}
+        if self._inyectar_error(lambda codigo: {'error': {'code': codigo, 'message': f'Error simulado {codigo}',
+                                                          'status': estados[codigo]}}):
+            return
+        
+        texto = self._servidor.texto()
+        if metodo == 'streamGenerateContent':
+            return self._gemini_stream(modelo, texto)
+        self._responder(200, _respuesta_gemini(modelo, texto, 'STOP'))
+    
+    def _gemini_stream(self, modelo, texto):
+        """
+        Respuesta del transporte REST para streaming: un arreglo JSON enviado
+        por partes (Transfer-Encoding: chunked), un candidato por fragmento
+        """
+        configuracion = self._servidor.configuracion
+        cantidad = max(1, configuracion.fragmentos_texto)
+        largo = -(-len(texto) // cantidad)
+        fragmentos = [texto[i:i + largo] for i in range(0, len(texto), largo)] or ['']
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        
+        def enviar(datos):
+            datos = datos.encode('utf-8')
+            self.wfile.write(f'{len(datos):X}\r\n'.encode('ascii') + datos + b'\r\n')
+            self.wfile.flush()
+        
+        for i, fragmento in enumerate(fragmentos):
+            if i:
+                time.sleep(configuracion.latencia_fragmento)
+            fin = 'STOP' if i == len(fragmentos) - 1 else None
+            enviar(('[' if i == 0 else ',') + json.dumps(_respuesta_gemini(modelo, fragmento, fin), ensure_ascii=False))
+        enviar(']')
+        self.wfile.write(b'0\r\n\r\n')
+        self._servidor.contar(self.path.split('?')[0], 200)
+
+
+def _respuesta_gemini(modelo, texto, fin):
+    """Cuerpo de generateContent (o un fragmento de streamGenerateContent)"""
+    candidato = {'content': {'parts': [{'text': texto}], 'role': 'model'}, 'index': 0}
+    if fin:
+        candidato['finishReason'] = fin
+    return {
+        'candidates': [candidato],
+        'usageMetadata': {'promptTokenCount': 0, 'candidatesTokenCount': len(texto) // 4,
+                          'totalTokenCount': len(texto) // 4},
+        'modelVersion': modelo
+    }
+
+
+class ServidorSimulado:
+    """
+    Servidor local que imita los endpoints que usan los clientes:
+      - POST /v1/images/generations (OpenAI; formatos url y b64_json)
+      - GET  /imagenes/<id>.png (descarga de la URL devuelta)
+      - POST /v1beta/models/<modelo>:generateContent (Gemini, transporte REST)
+      - POST /v1beta/models/<modelo>:streamGenerateContent (Gemini, por fragmentos)
+      - GET  /__estadisticas (conteo de respuestas por ruta y código)
+    """
+    
+    # Imágenes servidas que se conservan para descargar
+    MAX_IMAGENES = 64
+    
+    def __init__(self, configuracion=None, host='127.0.0.1', puerto=0):
+        self.configuracion = configuracion or ConfiguracionSimulacion()
+        self._http = ThreadingHTTPServer((host, puerto), _Manejador)
+        self._http.daemon_threads = True
+        self._http.simulado = self
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._imagenes = {}
+        self._contadores = Counter()
+    
+    @property
+    def url(self):
+        host, puerto = self._http.server_address[:2]
+        return f'http://{host}:{puerto}'
+    
+    @property
+    def url_openai(self):
+        """Valor para OPENAI_BASE_URL / OpenAIClient(base_url=...)"""
+        return f'{self.url}/v1'
+    
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._http.serve_forever, name='servidor-simulado', daemon=True)
+        self._hilo.start()
+        return self
+    
+    def detener(self):
+        self._http.shutdown()
+        self._http.server_close()
+    
+    def __enter__(self):
+        return self.iniciar()
+    
+    def __exit__(self, *exc):
+        self.detener()
+    
+    def guardar_imagen(self, imagen):
+        identificador = os.urandom(8).hex()
+        with self._lock:
+            self._imagenes[identificador] = imagen
+            while len(self._imagenes) > self.MAX_IMAGENES:
+                self._imagenes.pop(next(iter(self._imagenes)))
+        return identificador
+    
+    def imagen(self, identificador):
+        with self._lock:
+            return self._imagenes.get(identificador)
+    
+    def texto(self):
+        base = ('Colonia de hongos simulada: micelio blanco denso, sombreros marrones con lamelas '
+                'visibles, iluminación lateral suave y gotas de humedad sobre la superficie. ')
+        repeticiones = self.configuracion.tamano_texto // len(base) + 1
+        return (base * repeticiones)[:self.configuracion.tamano_texto]
+    
+    def contar(self, ruta, codigo):
+        if RUTA_IMAGEN.match(ruta):
+            ruta = '/imagenes'
+        with self._lock:
+            self._contadores[(ruta, codigo)] += 1
+    
+    def estadisticas(self):
+        """dict ruta -> {código: cantidad}"""
+        with self._lock:
+            resumen = {}
+            for (ruta, codigo), cantidad in sorted(self._contadores.items()):
+                resumen.setdefault(ruta, {})[str(codigo)] = cantidad
+            return resumen
+
+
+def prueba_carga(servidor, cantidad, concurrencia, carpeta_salida, proveedor='openai', streaming=False):
+    """
+    Lanza `cantidad` generaciones con el cliente asíncrono de `proveedor` y resume latencias y resultados
+    
+    Args:
+        servidor: ServidorSimulado en marcha
+        proveedor: 'openai' (OpenAIClientAsync) o 'gemini' (GeminiClientAsync)
+        streaming: Con Gemini, pedir la descripción por streaming
+    """
+    import asyncio
+    from clientes_async import GeminiClientAsync, OpenAIClientAsync
+    
+    async def correr():
+        if proveedor == 'gemini':
+            cliente = GeminiClientAsync(api_key='simulado', base_url=servidor.url, max_concurrencia=concurrencia)
+        else:
+            cliente = OpenAIClientAsync(api_key='simulado', base_url=servidor.url_openai, max_concurrencia=concurrencia)
+        opciones = {'al_recibir': lambda fragmento: None} if streaming else {}
+        
+        async def una(i):
+            inicio = time.perf_counter()
+            resultado = await cliente.generar_con_reintentos(f'Prueba de carga #{i}: hongos simulados',
+                                                             carpeta_salida=carpeta_salida, **opciones)
+            return time.perf_counter() - inicio, resultado
+        
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*(una(i) for i in range(cantidad)))
+        return time.perf_counter() - inicio, resultados
+    
+    total, resultados = asyncio.run(correr())
+    latencias = sorted(latencia for latencia, _ in resultados)
+    exitos = sum(1 for _, resultado in resultados if resultado['exito'])
+    return {
+        'generaciones': cantidad,
+        'exitos': exitos,
+        'duracion_s': total,
+        'por_segundo': cantidad / total if total else 0.0,
+        'latencia_p50_s': latencias[len(latencias) // 2],
+        'latencia_p95_s': latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))]
+    }
+
+
+# Función de prueba
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    
+    parser = argparse.ArgumentParser(description='Servidor local que imita las APIs de OpenAI y Gemini')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.5, help='Latencia mediana en segundos')
+    parser.add_argument('--distribucion', choices=DISTRIBUCIONES_LATENCIA, default='lognormal')
+    parser.add_argument('--dispersion', type=float, default=0.5, help='Sigma de la lognormal')
+    parser.add_argument('--prob-429', type=float, default=0.0)
+    parser.add_argument('--prob-500', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--tamano-imagen', type=int, default=1024 * 1024, help='Bytes por imagen')
+    parser.add_argument('--semilla', type=int)
+    parser.add_argument('--carga', type=int, default=0, help='Correr N generaciones contra el servidor y salir')
+    parser.add_argument('--concurrencia', type=int, default=4)
+    parser.add_argument('--proveedor', choices=('openai', 'gemini'), default='openai',
+                        help='Cliente asíncrono de la prueba de carga')
+    parser.add_argument('--stream', action='store_true', help='Con --proveedor gemini, pedir por streaming')
+    args = parser.parse_args()
+    
+    configuracion = ConfiguracionSimulacion(
+        latencia=args.latencia, distribucion=args.distribucion, dispersion=args.dispersion,
+        prob_429=args.prob_429, prob_500=args.prob_500, retry_after=args.retry_after,
+        tamano_imagen=args.tamano_imagen, semilla=args.semilla
+    )
+    
+    with ServidorSimulado(configuracion, args.host, 0 if args.carga else args.puerto) as servidor:
+        print("=== SERVIDOR SIMULADO ===")
+        print(f"🌐 Escuchando en {servidor.url}")
+        
+        if args.carga:
+            with tempfile.TemporaryDirectory() as carpeta:
+                resumen = prueba_carga(servidor, args.carga, args.concurrencia, carpeta,
+                                       proveedor=args.proveedor, streaming=args.stream)
+            print(json.dumps(resumen, indent=2))
+            print(json.dumps(servidor.estadisticas(), indent=2))
+        else:
+            print(f"   OPENAI_BASE_URL={servidor.url_openai}")
+            print(f"   GEMINI_BASE_URL={servidor.url}")
+            print("Presiona Ctrl+C para detener")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                print("\n🛑 Servidor detenido")
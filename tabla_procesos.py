@@ -0,0 +1,115 @@
+"""
+Osmotrofia - Tabla de Procesos
+Mantiene la información de procesos entre snapshots para no reclasificarlos en cada ciclo
+"""
+
+import psutil
+import re
+from functools import lru_cache
+
+
+# Subcadenas de nombres de proceso por categoría
+PATRONES_PROCESOS = {
+    'innecesario': ['bloatware', 'toolbar', 'updater', 'helper'],
+    'antivirus': ['defender', 'avast', 'avg', 'norton', 'mcafee', 'kaspersky']
+}
+
+# Porcentaje de memoria a partir del cual un proceso se considera pesado
+UMBRAL_PROCESO_PESADO = 5
+
+
+def compilar_patrones(patrones):
+    """Compila todas las categorías en una sola expresión con un grupo nombrado por categoría"""
+    alternativas = [
+        f"(?P<{categoria}>{'|'.join(re.escape(p) for p in subcadenas)})"
+        for categoria, subcadenas in patrones.items()
+    ]
+    return re.compile('|'.join(alternativas))
+
+
+_MATCHER_PROCESOS = compilar_patrones(PATRONES_PROCESOS)
+
+
+@lru_cache(maxsize=4096)
+def clasificar_nombre(nombre):
+    """Devuelve el conjunto de categorías cuyas subcadenas aparecen en el nombre del proceso"""
+    if not nombre:
+        return frozenset()
+    return frozenset(m.lastgroup for m in _MATCHER_PROCESOS.finditer(nombre.lower()))
+
+
+class TablaProcesos:
+    """
+    Tabla persistente de procesos indexada por (pid, create_time).
+    
+    Los atributos estáticos (nombre, categorías) se consultan una sola vez, cuando el
+    proceso aparece; en cada actualización solo se refresca el uso de memoria.
+    """
+    
+    def __init__(self):
+        self._entradas = {}
+        # Conteo de procesos vivos por categoría, mantenido de forma incremental
+        self._por_categoria = dict.fromkeys(PATRONES_PROCESOS, 0)
+    
+    def __len__(self):
+        return len(self._entradas)
+    
+    def actualizar(self):
+        """
+        Sincroniza la tabla con los procesos actuales
+        
+        Returns:
+            dict con total, innecesarios, pesados y antivirus_activo
+        """
+        vistos = set()
+        pesados = 0
+        
+        for proc in psutil.process_iter():
+            try:
+                with proc.oneshot():
+                    clave = (proc.pid, proc.create_time())
+                    entrada = self._entradas.get(clave)
+                    if entrada is None:
+                        entrada = self._registrar(clave, proc)
+                    
+                    try:
+                        entrada['memoria'] = proc.memory_percent()
+                    except psutil.AccessDenied:
+                        entrada['memoria'] = None
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                continue
+            
+            vistos.add(clave)
+            if entrada['memoria'] and entrada['memoria'] > UMBRAL_PROCESO_PESADO:
+                pesados += 1
+        
+        # Olvidar procesos que terminaron (o cuyo pid fue reutilizado)
+        for clave in self._entradas.keys() - vistos:
+            self._olvidar(clave)
+        
+        return {
+            'total': len(self._entradas),
+            'innecesarios': self._por_categoria['innecesario'],
+            'pesados': pesados,
+            'antivirus_activo': self._por_categoria['antivirus'] > 0
+        }
+    
+    def _registrar(self, clave, proc):
+        """Consulta en detalle un proceso nuevo y lo agrega a la tabla"""
+        try:
+            nombre = proc.name()
+        except psutil.AccessDenied:
+            nombre = None
+        
+        categorias = clasificar_nombre(nombre)
+        for categoria in categorias:
+            self._por_categoria[categoria] += 1
+        
+        entrada = {'nombre': nombre, 'categorias': categorias, 'memoria': None}
+        self._entradas[clave] = entrada
+        return entrada
+    
+    def _olvidar(self, clave):
+        entrada = self._entradas.pop(clave)
+        for categoria in entrada['categorias']:
+            self._por_categoria[categoria] -= 1